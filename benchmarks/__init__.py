@@ -0,0 +1,10 @@
+"""
+Benchmarks of the stages of an equilibrium calculation, for use with
+airspeed velocity (asv): reading TDB files, building Models, compiling
+their energies, sampling the energy surface, finding the lower convex
+hull and minimizing the energy. Each stage is timed (time_*) and its
+peak memory usage tracked (peakmem_*) separately.
+
+Run "asv run" from the root of the repository to benchmark the latest
+commit, or "asv continuous master HEAD" to compare a branch with master.
+"""
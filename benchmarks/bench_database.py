@@ -0,0 +1,25 @@
+"""
+Benchmarks of reading TDB files.
+"""
+
+import os
+from pycalphad import Database
+from .common import EXAMPLES_DIR, TDB_FILES, UNSUPPORTED_TDB_FILES
+
+class ReadDatabase(object):
+    "Parse a TDB file into a Database."
+    params = TDB_FILES
+    param_names = ['tdb']
+
+    def setup(self, filename):
+        if filename in UNSUPPORTED_TDB_FILES:
+            # Skipped until the parser supports this file
+            raise NotImplementedError('Cannot read {0}'.format(filename))
+        with open(os.path.join(EXAMPLES_DIR, filename)) as tdb:
+            self.data = tdb.read()
+
+    def time_read(self, filename):
+        Database(self.data)
+
+    def peakmem_read(self, filename):
+        Database(self.data)
@@ -0,0 +1,40 @@
+"""
+Benchmarks of sampling the energy surface of a system.
+"""
+
+import numpy as np
+from pycalphad import energy_surf
+from .common import SYSTEMS, system
+
+class EnergySurf(object):
+    "Sample the energy surfaces of all phases at one temperature."
+    params = sorted(SYSTEMS.keys())
+    param_names = ['system']
+    timeout = 600
+
+    def setup(self, name):
+        self.dbf, self.comps, self.phases = system(name)
+
+    def time_energy_surf(self, name):
+        energy_surf(self.dbf, self.comps, self.phases, T=1000., pdens=1000)
+
+    def peakmem_energy_surf(self, name):
+        energy_surf(self.dbf, self.comps, self.phases, T=1000., pdens=1000)
+
+class EnergySurfTemperatures(object):
+    "Sample the energy surfaces of all phases at many temperatures."
+    params = [False, True]
+    param_names = ['temperature_sweep']
+    timeout = 600
+
+    def setup(self, temperature_sweep):
+        self.dbf, self.comps, self.phases = system('alni')
+        self.temperatures = list(np.linspace(500., 1500., 41))
+
+    def time_energy_surf(self, temperature_sweep):
+        energy_surf(self.dbf, self.comps, self.phases, T=self.temperatures,
+                    pdens=200, temperature_sweep=temperature_sweep)
+
+    def peakmem_energy_surf(self, temperature_sweep):
+        energy_surf(self.dbf, self.comps, self.phases, T=self.temperatures,
+                    pdens=200, temperature_sweep=temperature_sweep)
@@ -0,0 +1,71 @@
+"""
+Benchmarks of finding the lower convex hull of an energy surface and of
+minimizing the energy from it.
+"""
+
+import pycalphad.variables as v
+from pycalphad import Equilibrium, energy_surf
+from pycalphad.eq.geometry import lower_convex_hull, prune_energy_surf
+from .common import system
+
+# Phases of the Al-Fe equilibrium tests
+PHASES = ['LIQUID', 'FCC_A1', 'HCP_A3', 'AL5FE2', 'AL2FE', 'AL13FE4', 'AL5FE4']
+CONDITIONS = {v.X('AL'): 0.55}
+TEMPERATURE = 1400.
+
+class ConvexHull(object):
+    "Prune an energy surface and find the starting simplex on its hull."
+    timeout = 600
+
+    def setup_cache(self):
+        dbf, comps, _ = system('alfe')
+        return energy_surf(dbf, comps, PHASES, T=TEMPERATURE, pdens=2000)
+
+    def setup(self, data):
+        _, self.comps, _ = system('alfe')
+        self.conditions = dict(CONDITIONS)
+        self.conditions[v.T] = TEMPERATURE
+
+    def time_prune(self, data):
+        prune_energy_surf(data, self.comps)
+
+    def peakmem_prune(self, data):
+        prune_energy_surf(data, self.comps)
+
+    def time_lower_convex_hull(self, data):
+        lower_convex_hull(data, self.comps, self.conditions)
+
+class Minimize(object):
+    "Refine the starting simplex of an equilibrium calculation."
+    params = ['slsqp', 'newton']
+    param_names = ['solver']
+    timeout = 600
+
+    def setup(self, solver):
+        dbf, comps, _ = system('alfe')
+        self.eqx = Equilibrium(dbf, comps, PHASES, CONDITIONS, T=TEMPERATURE,
+                               pdens=2000, solver=solver)
+        self.simplex, self.phase_fractions = self.eqx.get_starting_simplex()
+
+    def time_minimize(self, solver):
+        self.eqx.minimize(self.simplex, self.phase_fractions)
+
+    def peakmem_minimize(self, solver):
+        self.eqx.minimize(self.simplex, self.phase_fractions)
+
+class SolveEquilibrium(object):
+    "Complete equilibrium calculation: every stage above, in sequence."
+    params = ['slsqp', 'newton']
+    param_names = ['solver']
+    timeout = 600
+
+    def setup(self, solver):
+        self.dbf, self.comps, _ = system('alfe')
+
+    def time_equilibrium(self, solver):
+        Equilibrium(self.dbf, self.comps, PHASES, CONDITIONS,
+                    T=TEMPERATURE, pdens=2000, solver=solver)
+
+    def peakmem_equilibrium(self, solver):
+        Equilibrium(self.dbf, self.comps, PHASES, CONDITIONS,
+                    T=TEMPERATURE, pdens=2000, solver=solver)
@@ -0,0 +1,63 @@
+"""
+Benchmarks of building Models and compiling and evaluating their energies.
+"""
+
+import pycalphad.variables as v
+from pycalphad import Model
+from pycalphad.eq.utils import make_callable, generate_dof, point_sample
+from .common import PHASES, system
+
+class BuildModel(object):
+    "Build the symbolic energy of a phase."
+    params = sorted(PHASES.keys())
+    param_names = ['phase']
+
+    def setup(self, name):
+        system_name, self.phase_name = PHASES[name]
+        self.dbf, self.comps, _ = system(system_name)
+
+    def time_build(self, name):
+        Model(self.dbf, self.comps, self.phase_name)
+
+    def peakmem_build(self, name):
+        Model(self.dbf, self.comps, self.phase_name)
+
+class CompileModel(object):
+    "Compile the energy of a phase, and its gradient, to numpy functions."
+    params = sorted(PHASES.keys())
+    param_names = ['phase']
+    timeout = 600
+
+    def setup(self, name):
+        system_name, phase_name = PHASES[name]
+        dbf, comps, _ = system(system_name)
+        self.model = Model(dbf, comps, phase_name)
+        self.variables, _ = generate_dof(dbf.phases[phase_name],
+                                         self.model.components)
+
+    def time_energy(self, name):
+        make_callable(self.model.ast, [v.T] + self.variables)
+
+    def peakmem_energy(self, name):
+        make_callable(self.model.ast, [v.T] + self.variables)
+
+    def time_gradient(self, name):
+        make_callable([self.model.ast.diff(x) for x in self.variables],
+                      [v.T] + self.variables)
+
+class EvaluateModel(object):
+    "Evaluate the compiled energy of a phase at many points."
+    params = sorted(PHASES.keys())
+    param_names = ['phase']
+
+    def setup(self, name):
+        system_name, phase_name = PHASES[name]
+        dbf, comps, _ = system(system_name)
+        model = Model(dbf, comps, phase_name)
+        variables, sublattice_dof = generate_dof(dbf.phases[phase_name],
+                                                 model.components)
+        self.energy = make_callable(model.ast, [v.T] + variables)
+        self.points = point_sample(sublattice_dof, pdof=10000).T
+
+    def time_energy(self, name):
+        self.energy(1000., *self.points)
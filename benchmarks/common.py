@@ -0,0 +1,47 @@
+"""
+Databases and systems shared by the benchmarks.
+"""
+
+import os
+from pycalphad import Database
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'examples')
+
+# Bundled TDB files
+TDB_FILES = ['alfe_sei.TDB', 'NI_AL_DUPIN_2001.TDB', '7-3-2014_ALCOCR.TDB',
+             'bigrose.tdb']
+# Files the parser cannot read yet (no support for DATABASE_INFO); their
+# benchmarks are skipped
+UNSUPPORTED_TDB_FILES = ['7-3-2014_ALCOCR.TDB']
+
+# Name: (TDB file, components, phases)
+SYSTEMS = {
+    'alfe': ('alfe_sei.TDB', ['AL', 'FE', 'VA'],
+             ['LIQUID', 'B2_BCC', 'FCC_A1', 'HCP_A3', 'AL5FE2', 'AL2FE',
+              'AL13FE4', 'AL5FE4']),
+    'alni': ('NI_AL_DUPIN_2001.TDB', ['AL', 'NI', 'VA'],
+             ['LIQUID', 'FCC_L12', 'BCC_B2', 'AL3NI1', 'AL3NI2', 'AL3NI5']),
+    'rose': ('bigrose.tdb', ['H', 'HE', 'LI', 'BE', 'B'], ['TEST'])
+}
+
+# Name: (system, phase) of a representative phase of each system
+PHASES = {
+    'alfe-B2_BCC': ('alfe', 'B2_BCC'),
+    'alni-FCC_L12': ('alni', 'FCC_L12'),
+    'alni-LIQUID': ('alni', 'LIQUID'),
+    'rose-TEST': ('rose', 'TEST')
+}
+
+_DATABASES = {}
+
+def database(filename):
+    "Return the Database of a bundled TDB file, read only once."
+    if filename not in _DATABASES:
+        _DATABASES[filename] = Database(os.path.join(EXAMPLES_DIR, filename))
+    return _DATABASES[filename]
+
+def system(name):
+    "Return the Database, components and phases of a system."
+    filename, comps, phases = SYSTEMS[name]
+    return database(filename), comps, phases
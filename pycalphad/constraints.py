@@ -3,8 +3,10 @@ The constraints module contains definitions for equilibrium constraints and
 their Jacobian.
 """
 
+import copy
 import pycalphad.variables as v
 import numpy as np
+import scipy.sparse
 from sympy import S
 
 # An index range is a list of (ordered pairs of indices).
@@ -25,25 +27,162 @@ def sitefrac_jac(input_x, idx_range):
         -2.0*sum(input_x[idx_range[0]:idx_range[1]])
     return output_x
 
+def linear_balance_matrix(index_ranges, sublattice_dofs, num_vars):
+    """
+    Construct the linear equality constraints on phase fractions and
+    site fractions, in the form `A x = b`.
+    The first row requires the phase fractions to sum to unity; each
+    subsequent row requires the site fractions of one sublattice of one
+    composition set to sum to unity.
+
+    Parameters
+    ----------
+    index_ranges : list of (int, int)
+        Start and end index of each composition set's variables in x.
+        The first variable of each composition set is its phase fraction.
+    sublattice_dofs : list of list of int
+        Number of site fraction variables in each sublattice of each
+        composition set.
+    num_vars : int
+        Length of x.
+
+    Returns
+    -------
+    Tuple of (scipy.sparse.csr_matrix A, ndarray b)
+    """
+    rows = []
+    cols = []
+    # phase fraction balance
+    for idx_range in index_ranges:
+        rows.append(0)
+        cols.append(idx_range[0])
+    num_rows = 1
+    # site fraction balances
+    for idx_range, dofs in zip(index_ranges, sublattice_dofs):
+        cur_idx = idx_range[0]+1
+        for dof in dofs:
+            if dof > 0:
+                rows.extend([num_rows] * dof)
+                cols.extend(range(cur_idx, cur_idx+dof))
+                num_rows += 1
+            cur_idx += dof
+    matrix = scipy.sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(num_rows, num_vars))
+    return matrix, np.ones(num_rows)
+
+class MoleFractionProjection(object):
+    """
+    Map from the site fractions of a phase to the mole fractions of some
+    species, X = (M y) / (c + n . y), where M holds the site ratio of each
+    species' site fractions and c + n . y is the site ratio normalization,
+    which decreases with the vacancy site fractions.
+
+    Parameters
+    ----------
+    site_ratios : list of float
+        Number of sites in each sublattice.
+    variables : list of SiteFraction
+        Site fractions, in the order of the inputs.
+    species : list of string
+        Species whose mole fractions are the outputs.
+
+    Attributes
+    ----------
+    matrix : ndarray
+        Coefficient matrix M with shape (species, variables).
+    norm_constant : float
+        Constant c of the normalization.
+    norm_vector : ndarray
+        Coefficients n of the vacancy site fractions in the normalization.
+
+    Examples
+    --------
+    >>> projection = MoleFractionProjection(phase.sublattices, variables,
+    ...                                     ['AL', 'NI'])
+    >>> molefracs = projection(points)
+    """
+    def __init__(self, site_ratios, variables, species):
+        self.variables = list(variables)
+        self.species = list(species)
+        self.matrix = np.zeros((len(self.species), len(self.variables)))
+        self.norm_vector = np.zeros(len(self.variables))
+        sublattices = set()
+        for col, var in enumerate(self.variables):
+            ratio = float(site_ratios[var.sublattice_index])
+            sublattices.add(var.sublattice_index)
+            if var.species in self.species:
+                self.matrix[self.species.index(var.species), col] = ratio
+            if var.species == 'VA':
+                self.norm_vector[col] = -ratio
+        self.norm_constant = float(sum(site_ratios[idx] \
+            for idx in sublattices))
+
+    def closed(self, open_species):
+        """
+        Return the projection to amounts per mole of the species other
+        than 'open_species', i.e., X / (1 - sum(X of open_species)).
+        """
+        result = copy.copy(self)
+        result.norm_vector = self.norm_vector - \
+            self.matrix[[self.species.index(x) for x in open_species]] \
+            .sum(axis=0)
+        return result
+
+    def __call__(self, points):
+        """
+        Return the mole fractions of points with shape (..., variables),
+        as an ndarray of shape (..., species).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        return np.dot(points, self.matrix.T) / \
+            (self.norm_constant + np.dot(points, self.norm_vector))[..., None]
+
+    def values(self, *site_fractions):
+        """
+        Return the mole fractions at a point, with the site fractions
+        as separate arguments like the callables of make_callable().
+        """
+        return self(site_fractions)
+
+    def jacobian(self, *site_fractions):
+        """
+        Return the derivatives of the mole fractions at a point, with
+        shape (species, variables).
+        """
+        point = np.asarray(site_fractions, dtype=np.float64)
+        norm = self.norm_constant + np.dot(self.norm_vector, point)
+        return self.matrix / norm - \
+            np.outer(np.dot(self.matrix, point), self.norm_vector) / norm**2
+
+    def hessian(self, *site_fractions):
+        """
+        Return the second derivatives of the mole fractions at a point,
+        with shape (species, variables, variables).
+        """
+        point = np.asarray(site_fractions, dtype=np.float64)
+        norm = self.norm_constant + np.dot(self.norm_vector, point)
+        cross = self.matrix[:, :, None] * self.norm_vector[None, None, :]
+        return -(cross + cross.transpose(0, 2, 1)) / norm**2 + \
+            2 * np.dot(self.matrix, point)[:, None, None] * \
+            np.outer(self.norm_vector, self.norm_vector)[None] / norm**3
+
+    def ast(self):
+        """
+        Return the mole fractions as a list of SymPy objects.
+        """
+        norm = self.norm_constant + sum(coef * var for coef, var \
+            in zip(self.norm_vector, self.variables) if coef != 0)
+        return [sum((coef * var for coef, var in zip(row, self.variables) \
+            if coef != 0), S.Zero) / norm for row in self.matrix]
+
 def molefrac_ast(phase, species):
     """
     Return a SymPy object representing the mole fraction as a function of
     site fractions.
     TODO: Assumes all phase constituents are active
     """
-    result = S.Zero
-    site_ratio_normalization = S.Zero
-    # Calculate normalization factor
-    for idx, sublattice in enumerate(phase.constituents):
-        if 'VA' in set(sublattice):
-            site_ratio_normalization += phase.sublattices[idx] * \
-                (1.0 - v.SiteFraction(phase.name, idx, 'VA'))
-        else:
-            site_ratio_normalization += phase.sublattices[idx]
-    site_ratios = [c/site_ratio_normalization for c in phase.sublattices]
-    # Sum up site fraction contributions from each sublattice
-    for idx, sublattice in enumerate(phase.constituents):
-        if species in set(sublattice):
-            result += site_ratios[idx] * \
-                v.SiteFraction(phase.name, idx, species)
-    return result
+    variables = [v.SiteFraction(phase.name, idx, comp) \
+        for idx, sublattice in enumerate(phase.constituents) \
+        for comp in sorted(set(sublattice))]
+    return MoleFractionProjection(phase.sublattices, variables,
+                                  [species]).ast()[0]
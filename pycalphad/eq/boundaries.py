@@ -0,0 +1,219 @@
+"""
+The boundaries module traces the two-phase boundaries of binary isobaric
+phase diagrams by continuation in temperature.
+
+Instead of resolving the diagram with the lower convex hull of a densely
+sampled energy surface at every temperature, a coarse surface is only used
+to locate the two-phase regions. Each region is then followed from one
+temperature to the next with local equilibrium calculations, which give
+the boundary compositions to solver precision. A change in the pair of
+phases of a region between two temperatures marks an invariant reaction.
+"""
+
+from __future__ import division
+import numpy as np
+import pandas as pd
+import pycalphad.variables as v
+from pycalphad.eq.energy_surf import energy_surf
+from pycalphad.eq.equilibrium import Equilibrium
+from pycalphad.eq.geometry import binary_tie_lines
+from pycalphad.log import logger
+
+def two_phase_seeds(data, x_variable, mindist=0.03):
+    """
+    Find the two-phase regions on the lower convex hull of a sampled
+    binary energy surface at a single temperature.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Energy surface at a single temperature, as from energy_surf().
+    x_variable : string
+        Name of the composition column, e.g., 'X(AL)'.
+    mindist : float, optional
+        Facets between points of the same phase are only considered
+        miscibility gaps if their endpoints are at least this far apart.
+
+    Returns
+    -------
+    ndarray of overall compositions lying inside each two-phase region
+    """
+    compositions = data[x_variable].values
+    phase_codes = pd.Categorical(data['Phase'].values).codes
+    tie_lines = binary_tie_lines(compositions, data['GM'].values, phase_codes,
+                                 mindist=mindist)
+    return np.sort(compositions[tie_lines].mean(axis=1))
+
+def _tie_line(result, species, temperature):
+    """
+    Return the tie-line of a two-phase equilibrium as
+    [[x, T, phase], [x, T, phase]], ordered by composition, or None.
+    """
+    if result is None:
+        return None
+    stable = [phase for phase in result.phases \
+        if phase.volume_fraction > 1e-8]
+    if len(stable) != 2:
+        return None
+    line = sorted([[phase.mole_fractions[species], temperature, phase.name] \
+        for phase in stable], key=lambda x: x[0])
+    return line
+
+def _contains(line, composition, tol=1e-6):
+    "Return True if `composition` lies on the tie-line `line`."
+    return line[0][0] - tol <= composition <= line[1][0] + tol
+
+def _same_phases(first, second):
+    "Return True if two tie-lines join the same pair of phases."
+    return sorted([first[0][2], first[1][2]]) == \
+        sorted([second[0][2], second[1][2]])
+
+def _is_new(line, regions):
+    "Return True if `line` is a tie-line not already in `regions`."
+    return line is not None and \
+        not any(_same_phases(line, other) and \
+                abs(line[0][0] - other[0][0]) < 1e-4 \
+                for other, _ in regions)
+
+def _invariant_temperature(eqx, composition, midpoint, line, result,
+                           temp, tol):
+    """
+    Bisect the temperature at which the two-phase region of the tie-line
+    `line` (solution `result`) changes phases, between the temperature
+    of `line` and `temp`, at overall composition `midpoint`.
+
+    Returns the temperature and the tie-lines on both sides.
+    """
+    species = composition.species
+    low, high = line[0][1], temp
+    high_line = None
+    while high - low > tol:
+        cur_temp = 0.5 * (low + high)
+        cur_result = eqx.step([v.T, composition], [[cur_temp, midpoint]],
+                              start=result)[0]
+        cur_line = _tie_line(cur_result, species, cur_temp)
+        if cur_line is not None and _same_phases(cur_line, line):
+            low, line, result = cur_temp, cur_line, cur_result
+        else:
+            high, high_line = cur_temp, cur_line
+    return 0.5 * (low + high), line, high_line
+
+def trace_boundaries(dbf, comps, phases, x_variable, temperatures,
+                     pdens=200, invariant_tol=1e-2, **kwargs):
+    """
+    Trace the two-phase boundaries of a binary isobaric phase diagram.
+
+    At each temperature, the two-phase regions found at the previous
+    temperature are continued from the midpoints of their tie-lines and
+    from their own solutions. The coarse lower convex hull is only
+    searched for regions at the first temperature and where continuation
+    fails. Every tie-line comes from an equilibrium calculation, so its
+    endpoints are exact to solver precision regardless of `pdens`.
+
+    Parameters
+    ----------
+    dbf : Database
+        Thermodynamic database containing the relevant parameters.
+    comps : list
+        Names of components to consider in the calculation.
+    phases : list
+        Names of phases to consider in the calculation.
+    x_variable : string
+        Name of the x-axis variable, e.g., 'X(AL)'.
+    temperatures : array_like
+        Temperatures at which to calculate tie-lines.
+    pdens : int, optional
+        Number of points to sample per degree of freedom. Only used to
+        locate regions and to start the equilibrium calculations.
+    invariant_tol : float, optional
+        Tolerance of the bisection locating the temperatures of invariant
+        reactions.
+    Other keyword arguments are passed to Equilibrium.
+
+    Returns
+    -------
+    A tuple containing:
+    (1) A list of tie-lines, each [[x, T, phase], [x, T, phase]]
+    (2) A list of invariant reactions in the same format, spanning the
+        composition range of the reaction at its temperature
+
+    Examples
+    --------
+    >>> tie_lines, invariants = trace_boundaries(dbf, ['AL', 'FE', 'VA'],
+    ...     phases, 'X(AL)', np.arange(1000, 1800, 10))
+    """
+    species = x_variable[2:-1].upper()
+    composition = v.X(species)
+    temperatures = np.unique(np.asarray(temperatures, dtype=np.float64))
+    # The coarse surface is sampled once; the equilibrium calculations
+    # evaluate it at the other temperatures
+    surface = energy_surf(dbf, comps, phases, T=temperatures[0], pdens=pdens)
+    seeds = two_phase_seeds(surface, x_variable)
+    eqx = Equilibrium(dbf, comps, phases,
+                      {composition: seeds[0] if len(seeds) > 0 else 0.5},
+                      T=temperatures[0], pdens=pdens, data=surface, **kwargs)
+    tie_lines = []
+    invariants = []
+    # Tie-lines of the known regions, with their solutions
+    current_regions = []
+    for idx, temp in enumerate(temperatures):
+        new_regions = []
+        failed = idx > 0 and len(current_regions) == 0
+        pending = []
+        for line, result in current_regions:
+            midpoint = 0.5 * (line[0][0] + line[1][0])
+            if any(_contains(other, midpoint) for other, _ in new_regions):
+                continue
+            new_result = eqx.step([v.T, composition], [[temp, midpoint]],
+                                  start=result)[0]
+            new_line = _tie_line(new_result, species, temp)
+            if new_line is None or not _same_phases(new_line, line):
+                failed = True
+                if new_line is not None:
+                    # The region has changed phases: an invariant lies
+                    # between the previous temperature and this one
+                    pending.append((midpoint, line, result))
+            if _is_new(new_line, new_regions):
+                new_regions.append((new_line, new_result))
+        if failed:
+            if len(current_regions) == 0:
+                # Evaluate the surface at this temperature
+                eqx.step(v.T, [temp])
+            seeds = two_phase_seeds(eqx.data, x_variable)
+        elif idx > 0:
+            seeds = []
+        for seed in seeds:
+            if any(_contains(other, seed) for other, _ in new_regions):
+                continue
+            new_result = eqx.step([v.T, composition], [[temp, seed]])[0]
+            new_line = _tie_line(new_result, species, temp)
+            if _is_new(new_line, new_regions):
+                new_regions.append((new_line, new_result))
+        for midpoint, line, result in pending:
+            invariant_temp, low_line, high_line = _invariant_temperature(
+                eqx, composition, midpoint, line, result, temp,
+                invariant_tol)
+            lines = [low_line] + ([high_line] if high_line else [])
+            logger.debug('Invariant reaction at T=%s: %s', invariant_temp,
+                         lines)
+            invariants.append([[min(x[0][0] for x in lines),
+                                invariant_temp, None],
+                               [max(x[1][0] for x in lines),
+                                invariant_temp, None]])
+        tie_lines.extend(line for line, _ in new_regions)
+        current_regions = new_regions
+    return tie_lines, _merge_invariants(invariants, invariant_tol)
+
+def _merge_invariants(invariants, tol):
+    """
+    Merge invariant lines detected from several regions at the same
+    temperature, within `tol`, into one line per reaction.
+    """
+    merged = []
+    for line in sorted(invariants, key=lambda x: (x[0][1], x[0][0])):
+        if len(merged) > 0 and abs(merged[-1][0][1] - line[0][1]) <= tol and \
+            line[0][0] <= merged[-1][1][0] + 1e-6:
+            merged[-1][1][0] = max(merged[-1][1][0], line[1][0])
+            continue
+        merged.append(line)
+    return merged
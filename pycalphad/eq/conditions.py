@@ -32,8 +32,10 @@ class FixedVariable(Condition):
     def __str__(self):
         return '%s = %.4g (fixed)' % (self.symbol, self.value)
 
-class FixedPartialMolarQuantity(Condition):
+class FixedPartialMolarQuantity(FixedVariable):
     "Fixed partial molar quantity, e.g., chemical potential of a component."
-    def __init__(self):
-        Condition.__init__(self, None, None)
-        raise NotImplementedError
+    def __init__(self, symbol, value):
+        FixedVariable.__init__(self, symbol, value)
+        self.species = symbol.species
+    def __repr__(self):
+        return 'FixedPartialMolarQuantity(%s, %.8g)' % (self.symbol, self.value)
@@ -8,14 +8,20 @@ from pycalphad import Model
 from pycalphad.model import DofError
 from pycalphad.eq.utils import make_callable, point_sample, generate_dof
 from pycalphad.eq.utils import endmember_matrix, unpack_kwarg
+from pycalphad.eq import surfstore
+from pycalphad.eq.tbasis import TemperatureBasis
+from pycalphad.eq.magnetic import energy_callable
+from pycalphad.eq.ordering import OrderingEnergy
+from pycalphad.eq.redlich_kister import excess_callables
+from pycalphad.constraints import MoleFractionProjection
 from pycalphad.log import logger
 import pycalphad.variables as v
-from sympy import Symbol
 import scipy.spatial
 import pandas as pd
 import numpy as np
 import itertools
 import collections
+import os
 
 try:
     set
@@ -30,7 +36,7 @@ def _listify(val):
         return [val]
 
 def refine_energy_surf(input_matrix, energies, phase_obj, comps, variables,
-                       energy_func, max_iterations=1):
+                       energy_func, max_iterations=1, projection=None):
     """
     Recursively refine the equilibrium energy surface of a phase, starting
     from some initial points.
@@ -53,6 +59,9 @@ def refine_energy_surf(input_matrix, energies, phase_obj, comps, variables,
         Function that accepts rows of 'input_matrix' and returns the energy
     max_iterations : int, optional
         Number of recursive refinement iterations.
+    projection : MoleFractionProjection, optional
+        Map from 'variables' to the mole fractions of the active
+        components other than VA. Built from 'phase_obj' if not given.
 
     Returns
     -------
@@ -64,32 +73,15 @@ def refine_energy_surf(input_matrix, energies, phase_obj, comps, variables,
     # for debugging purposes; return input (do nothing)
     if max_iterations < 0:
         return input_matrix, energies
-    # Normalize site ratios
-    # Normalize by the sum of site ratios times a factor
-    # related to the site fraction of vacancies
-    site_ratio_normalization = np.zeros(len(input_matrix))
-    for idx, sublattice in enumerate(phase_obj.constituents):
-        vacancy_column = np.ones(len(input_matrix))
-        if 'VA' in set(sublattice):
-            var_idx = variables.index(v.SiteFraction(phase_obj.name, idx, 'VA'))
-            vacancy_column -= input_matrix[:, var_idx]
-        site_ratio_normalization += phase_obj.sublattices[idx] * vacancy_column
-
-    comp_list = sorted(list(comps))
-    try:
-        comp_list.remove('VA')
-    except ValueError:
-        pass
-    # Remove last component from the list, as it's dependent
-    comp_list.pop()
+    if projection is None:
+        projection = MoleFractionProjection(
+            phase_obj.sublattices, variables,
+            [comp for comp in sorted(comps) if comp != 'VA'])
     # Map input_matrix to global coordinates (mole fractions)
+    # Remove last component from the list, as it's dependent
+    comp_list = projection.species[:-1]
     global_matrix = np.zeros((len(input_matrix), len(comp_list)+1))
-    for comp_idx, comp in enumerate(comp_list):
-        avector = [float(cur_var.species == comp) * \
-            phase_obj.sublattices[cur_var.sublattice_index] \
-            for cur_var in variables]
-        global_matrix[:, comp_idx] = np.divide(np.dot(
-            input_matrix[:, :], avector), site_ratio_normalization)
+    global_matrix[:, :-1] = projection(input_matrix)[:, :-1]
     global_matrix[:, -1] = energies
 
     # If this is a stoichiometric phase, we can't calculate a hull
@@ -125,13 +117,17 @@ def refine_energy_surf(input_matrix, energies, phase_obj, comps, variables,
     # Call recursively for next iteration, decrementing max_iterations
     return refine_energy_surf(input_matrix, energies,
                               phase_obj, comps, variables,
-                              energy_func, max_iterations=max_iterations-1)
+                              energy_func, max_iterations=max_iterations-1,
+                              projection=projection)
 
-def energy_surf(dbf, comps, phases, mode=None, **kwargs):
+def energy_surf_chunks(dbf, comps, phases, mode=None, chunksize=None,
+                       **kwargs):
     """
     Sample the energy surface of a system containing the specified
-    components and phases. Model parameters are taken from 'dbf' and any
-    state variables (T, P, etc.) can be specified as keyword arguments.
+    components and phases, yielding the result in pieces instead of
+    returning it all at once. Each piece contains points from exactly one
+    phase at exactly one combination of state variables, so consumers can
+    reduce the surface (e.g., to its lower convex hull) as it is generated.
 
     Parameters
     ----------
@@ -141,21 +137,49 @@ def energy_surf(dbf, comps, phases, mode=None, **kwargs):
         Names of components to consider in the calculation.
     phases : list
         Names of phases to consider in the calculation.
+    chunksize : int, optional
+        Maximum number of points in each yielded DataFrame.
+        If None, all points of a phase at one set of conditions are yielded
+        together.
     pdens : int, a dict of phase names to int, or a list of both, optional
         Number of points to sample per degree of freedom.
+    temperature_sweep : bool, optional
+        If True and T is given, evaluate each phase through its
+        TemperatureBasis: the composition-only terms are computed once per
+        phase and set of points, and are combined with the values of the
+        temperature functions at every temperature. This is faster when
+        there are many temperatures. Energies at temperatures outside of
+        the ranges of the parameters are NaN. Default is False.
+    numeric_magnetic : bool, optional
+        If True, evaluate the IHJ magnetic contribution of each phase with
+        MagneticEnergy instead of compiling its symbolic form. Not used
+        with temperature_sweep. Default is False.
 
     Returns
     -------
-    DataFrame of the energy as a function of composition, temperature, etc.
+    Generator of DataFrames with the same columns as energy_surf().
+
+    Notes
+    -----
+    Unless temperature_sweep is used, phases with an atomic ordering
+    contribution are evaluated with pycalphad.eq.ordering.OrderingEnergy,
+    so that their fully substituted energy is never built. Likewise, the
+    excess energy of Model instances built with numeric_excess=True is
+    evaluated with pycalphad.eq.redlich_kister.RedlichKister.
 
     Examples
     --------
-    None yet.
+    >>> for chunk in energy_surf_chunks(dbf, comps, phases, T=1000,
+    ...                                 chunksize=10000):
+    ...     print(chunk['GM'].min())
     """
     # Here we check for any keyword arguments that are special, i.e.,
     # there may be keyword arguments that aren't state variables
     pdens_dict = unpack_kwarg(kwargs.pop('pdens', 2000), default_arg=2000)
     model_dict = unpack_kwarg(kwargs.pop('model', Model), default_arg=Model)
+    temperature_sweep = kwargs.pop('temperature_sweep', False) and \
+        'T' in kwargs
+    numeric_magnetic = kwargs.pop('numeric_magnetic', False)
 
     # Convert keyword strings to proper state variable objects
     # If we don't do this, sympy will get confused during substitution
@@ -173,9 +197,6 @@ def energy_surf(dbf, comps, phases, mode=None, **kwargs):
     # Consider only the active phases
     active_phases = dict((name.upper(), dbf.phases[name.upper()]) \
         for name in phases)
-    comp_sets = {}
-    # Construct a list to hold all the data
-    all_phase_data = []
     for phase_name, phase_obj in sorted(active_phases.items()):
         # Build the symbolic representation of the energy
         mod = model_dict[phase_name]
@@ -194,17 +215,34 @@ def energy_surf(dbf, comps, phases, mode=None, **kwargs):
         # As a last resort, treat undefined symbols as zero
         # But warn the user when we do this
         # This is consistent with TC's behavior
-        undefs = list(mod.ast.atoms(Symbol) - mod.ast.atoms(v.StateVariable))
-        for undef in undefs:
-            mod.ast = mod.ast.xreplace({undef: float(0)})
+        for undef in mod.zero_undefined_symbols():
             logger.warning('Setting undefined symbol %s for phase %s to zero',
                            undef, phase_name)
         # Construct an ordered list of the variables
         variables, sublattice_dof = generate_dof(phase_obj, mod.components)
 
-        # Build the "fast" representation of that model
-        comp_sets[phase_name] = make_callable(mod.ast, \
-            list(statevar_dict.keys()) + variables, mode=mode)
+        if temperature_sweep:
+            # Temperature is an argument of sweep(), not of the features
+            other_statevars = [x for x in statevar_dict.keys() if x != v.T]
+            phase_basis = TemperatureBasis(mod, other_statevars + variables,
+                                           mode=mode)
+        elif mod.ordering_terms is not None:
+            # Compose the ordered and disordered parts, instead of
+            # compiling the fully substituted energy
+            phase_callable = OrderingEnergy(
+                mod, list(statevar_dict.keys()) + variables, mode=mode)
+        elif mod.excess_terms is not None:
+            # Only the parameters of the excess energy were kept
+            phase_callable = excess_callables(
+                mod, list(statevar_dict.keys()) + variables,
+                numeric_magnetic=numeric_magnetic, mode=mode)[0]
+        elif numeric_magnetic:
+            phase_callable = energy_callable(
+                mod, list(statevar_dict.keys()) + variables, mode=mode)
+        else:
+            # Build the "fast" representation of that model
+            phase_callable = make_callable(mod.ast, \
+                list(statevar_dict.keys()) + variables, mode=mode)
 
         # Get the site ratios in each sublattice
         site_ratios = list(phase_obj.sublattices)
@@ -248,70 +286,185 @@ def energy_surf(dbf, comps, phases, mode=None, **kwargs):
                 # add to points matrix
                 points = np.concatenate((points, addtl_pts), axis=0)
 
-        data_dict = {'Phase': phase_name}
+        # The composition columns do not depend on the state variables,
+        # so we only need to calculate them once per phase
+        molefrac_species = [comp for comp in sorted(comps) if comp != 'VA']
+        molefrac_columns = ['X('+comp+')' for comp in molefrac_species]
+        projection = MoleFractionProjection(site_ratios, variables,
+                                            molefrac_species)
+        molefrac_matrix = projection(points)
+
+        if temperature_sweep:
+            # Energies at every temperature, for each combination of the
+            # other state variables
+            swept_energies = {}
+            temperatures = _listify(kwargs['T'])
+            for statevars in statevars_to_map:
+                others = tuple((key, value) for key, value in \
+                    sorted(statevars.items()) if key != 'T')
+                if others in swept_energies:
+                    continue
+                sweep = phase_basis.sweep(
+                    temperatures, *itertools.chain(
+                        [value for key, value in others], points.T))
+                swept_energies[others] = dict(zip(temperatures, sweep))
+
+        step = chunksize or max(len(points), 1)
         # Generate input d.o.f matrix for all state variable combinations
         for statevars in statevars_to_map:
-            # Prefill the state variable arguments to the energy function
-            energy_func = \
-                lambda *args: comp_sets[phase_name](
-                    *itertools.chain(list(statevars.values()),
-                                     args))
-            # Get the stable points and energies for this configuration
-            # Set max refinements equal to the number of independent dof
-            mxr = sum(phase_obj.sublattices) - len(phase_obj.sublattices)
-            refined_points, energies = \
-                refine_energy_surf(points, None, phase_obj, comps,
-                                   variables, energy_func, max_iterations=-1)
-            try:
-                data_dict['GM'].extend(energies)
-                for statevar in kwargs.keys():
-                    data_dict[statevar].extend(
-                        list(np.repeat(list(statevars.values()),
-                                       len(refined_points))))
-            except KeyError:
-                data_dict['GM'] = list(energies)
-                for statevar in kwargs.keys():
-                    data_dict[statevar] = \
-                        list(np.repeat(list(statevars.values()),
-                                       len(refined_points)))
-
-            # Map the internal degrees of freedom to global coordinates
-
-            # Normalize site ratios
-            # Normalize by the sum of site ratios times a factor
-            # related to the site fraction of vacancies
-            site_ratio_normalization = np.zeros(len(refined_points))
-            for idx, sublattice in enumerate(phase_obj.constituents):
-                vacancy_column = np.ones(len(refined_points))
-                if 'VA' in set(sublattice):
-                    var_idx = variables.index(v.SiteFraction(phase_name, idx, 'VA'))
-                    vacancy_column -= refined_points[:, var_idx]
-                site_ratio_normalization += site_ratios[idx] * vacancy_column
-
-            for comp in sorted(comps):
-                if comp == 'VA':
-                    continue
-                avector = [float(cur_var.species == comp) * \
-                    site_ratios[cur_var.sublattice_index] for cur_var in variables]
-                try:
-                    data_dict['X('+comp+')'].extend(list(np.divide(np.dot(
-                        refined_points[:, :], avector), site_ratio_normalization)))
-                except KeyError:
-                    data_dict['X('+comp+')'] = list(np.divide(np.dot(
-                        refined_points[:, :], avector), site_ratio_normalization))
-
-            # Copy coordinate information into data_dict
-            # TODO: Is there a more memory-efficient way to deal with this?
-            # Perhaps with hierarchical indexing...
-            try:
-                for column_idx, data in enumerate(refined_points.T):
-                    data_dict[str(variables[column_idx])].extend(list(data))
-            except KeyError:
+            if temperature_sweep:
+                phase_energies = swept_energies[tuple(
+                    (key, value) for key, value in sorted(statevars.items()) \
+                    if key != 'T')][statevars['T']]
+                energy_func = None
+            else:
+                phase_energies = None
+                # Prefill the state variable arguments to the energy function
+                energy_func = \
+                    lambda *args: phase_callable(
+                        *itertools.chain(list(statevars.values()),
+                                         args))
+            for start in range(0, len(points), step):
+                chunk_points = points[start:start+step]
+                chunk_energies = None if phase_energies is None else \
+                    phase_energies[start:start+step]
+                # Get the stable points and energies for this configuration
+                refined_points, energies = \
+                    refine_energy_surf(chunk_points, chunk_energies,
+                                       phase_obj, comps, variables,
+                                       energy_func, max_iterations=-1,
+                                       projection=projection)
+                data_dict = {'Phase': phase_name}
+                data_dict['GM'] = np.broadcast_to(
+                    energies, (len(refined_points),)).astype(np.float64)
+                for statevar, value in statevars.items():
+                    data_dict[statevar] = np.repeat(value, len(refined_points))
+                for column_idx, column in enumerate(molefrac_columns):
+                    data_dict[column] = \
+                        molefrac_matrix[start:start+step, column_idx]
+                # Copy coordinate information into data_dict
                 for column_idx, data in enumerate(refined_points.T):
-                    data_dict[str(variables[column_idx])] = list(data)
+                    data_dict[str(variables[column_idx])] = data
+                yield pd.DataFrame(data_dict)
 
-        all_phase_data.append(pd.DataFrame(data_dict))
+def energy_surf(dbf, comps, phases, mode=None, **kwargs):
+    """
+    Sample the energy surface of a system containing the specified
+    components and phases. Model parameters are taken from 'dbf' and any
+    state variables (T, P, etc.) can be specified as keyword arguments.
 
-    # all_phases_data now contains energy surface information for the system
-    return pd.concat(all_phase_data, axis=0, join='outer', \
-                            ignore_index=True, verify_integrity=False)
+    Parameters
+    ----------
+    dbf : Database
+        Thermodynamic database containing the relevant parameters.
+    comps : list
+        Names of components to consider in the calculation.
+    phases : list
+        Names of phases to consider in the calculation.
+    pdens : int, a dict of phase names to int, or a list of both, optional
+        Number of points to sample per degree of freedom.
+    cache_dir : string, optional
+        Directory for storing sampled energy surfaces on disk.
+        If a surface for the same database, components, phases, models,
+        point density, state variables and options was stored there
+        previously, it is read from disk instead of being recalculated
+        (see energy_surf_cache).
+    temperature_sweep : bool, optional
+        If True, evaluate the energies of all temperatures from the same
+        composition-only terms (see energy_surf_chunks). Default is False.
+    numeric_magnetic : bool, optional
+        If True, evaluate magnetic contributions numerically (see
+        energy_surf_chunks). Default is False.
+
+    Returns
+    -------
+    DataFrame of the energy as a function of composition, temperature, etc.
+
+    Examples
+    --------
+    None yet.
+
+    See Also
+    --------
+    energy_surf_chunks : Generate the same data in bounded-size pieces.
+    """
+    cache_dir = kwargs.pop('cache_dir', None)
+    if cache_dir is None:
+        all_phase_data = list(energy_surf_chunks(dbf, comps, phases,
+                                                 mode=mode, **kwargs))
+        # all_phases_data now contains energy surface information
+        return pd.concat(all_phase_data, axis=0, join='outer', \
+                                ignore_index=True, verify_integrity=False)
+    path = energy_surf_cache(dbf, comps, phases, cache_dir, mode=mode,
+                             **kwargs)
+    # Copy the memory-mapped blocks once, into a single array
+    blocks = list(surfstore.read_surface(path))
+    columns = sorted(set().union(*[block.keys() for _, block in blocks]))
+    values = np.full((sum(len(block['GM']) for _, block in blocks),
+                      len(columns)), np.nan)
+    phase_names = []
+    start = 0
+    for phase_name, block in blocks:
+        stop = start + len(block['GM'])
+        for col, column in enumerate(columns):
+            if column in block:
+                values[start:stop, col] = block[column]
+        phase_names.extend([phase_name] * (stop - start))
+        start = stop
+    result = pd.DataFrame(values, columns=columns)
+    # Same column order and types as the concatenated chunks
+    for column in columns:
+        dtypes = set(block[column].dtype if column in block else None \
+            for _, block in blocks)
+        if len(dtypes) == 1 and dtypes != set([values.dtype]):
+            result[column] = result[column].astype(dtypes.pop())
+    result.insert(sorted(columns + ['Phase']).index('Phase'), 'Phase',
+                  phase_names)
+    return result
+
+def energy_surf_cache(dbf, comps, phases, cache_dir, mode=None, **kwargs):
+    """
+    Sample the energy surface of a system into a directory of 'cache_dir',
+    unless it was stored there previously, and return that directory.
+    Its blocks can be read, memory-mapped, with surfstore.read_surface();
+    processes reading the same surface share its pages.
+
+    Parameters
+    ----------
+    dbf : Database
+        Thermodynamic database containing the relevant parameters.
+    comps : list
+        Names of components to consider in the calculation.
+    phases : list
+        Names of phases to consider in the calculation.
+    cache_dir : string
+        Directory for storing sampled energy surfaces on disk.
+    Other keyword arguments are the same as those of energy_surf().
+
+    Returns
+    -------
+    Path of the directory holding the energy surface.
+
+    Examples
+    --------
+    >>> path = energy_surf_cache(dbf, comps, phases, '/tmp/surfaces', T=1000)
+    >>> for phase_name, columns in surfstore.read_surface(path):
+    ...     print(phase_name, columns['GM'].min())
+    """
+    option_names = ('temperature_sweep', 'numeric_magnetic')
+    statevars = dict((key, value) for key, value in kwargs.items() \
+        if key not in ('pdens', 'model') + option_names)
+    options = dict((key, bool(kwargs.get(key, False))) \
+        for key in option_names)
+    key = surfstore.surface_key(
+        dbf, comps, phases,
+        unpack_kwarg(kwargs.get('model', Model), default_arg=Model),
+        unpack_kwarg(kwargs.get('pdens', 2000), default_arg=2000),
+        statevars, options=options)
+    path = os.path.join(cache_dir, key)
+    if not surfstore.has_surface(path):
+        logger.debug('Writing energy surface to %s', path)
+        surfstore.write_surface(path,
+                                energy_surf_chunks(dbf, comps, phases,
+                                                   mode=mode, **kwargs))
+    return path
@@ -6,6 +6,7 @@ from operator import itemgetter
 from collections import defaultdict
 import copy
 import pycalphad.variables as v
+from pycalphad.constraints import MoleFractionProjection
 
 class SublatticeResult(object):
     def __init__(self):
@@ -29,23 +30,17 @@ class PhaseResult(object):
     @property
     def mole_fractions(self):
         result = defaultdict(lambda: 0.0)
-        site_ratio_normalization = 0.0
-        # Calculate normalization factor
-        for sublattice in self.sublattices:
-            if 'VA' in set(sublattice.site_fractions.keys()):
-                site_ratio_normalization += sublattice.site_count * \
-                    (1.0 - sublattice.site_fractions['VA'])
-            else:
-                site_ratio_normalization += sublattice.site_count
-        site_ratios = [c.site_count/site_ratio_normalization \
-            for c in self.sublattices]
-        # Sum up site fraction contributions
-        for idx, sublattice in enumerate(self.sublattices):
-            for component in sublattice.site_fractions.keys():
-                if component == 'VA':
-                    continue
-                result[component] += site_ratios[idx] * \
-                    sublattice.site_fractions[component]
+        variables = [v.SiteFraction(self.name, idx, component) \
+            for idx, sublattice in enumerate(self.sublattices) \
+            for component in sorted(sublattice.site_fractions.keys())]
+        components = sorted(set(var.species for var in variables) - \
+            set(['VA']))
+        projection = MoleFractionProjection(
+            [sublattice.site_count for sublattice in self.sublattices],
+            variables, components)
+        values = projection.values(*[self.sublattices[var.sublattice_index]\
+            .site_fractions[var.species] for var in variables])
+        result.update(zip(components, values))
         return result
 
     def __repr__(self):
@@ -64,11 +59,13 @@ class PhaseResult(object):
         return res
 
 class EquilibriumResult(object):
-    def __init__(self, phases, components, potentials, energy, variables):
+    def __init__(self, phases, components, potentials, energy, variables,
+                 chemical_potentials=None):
         self.phases = list()
         self.energy = energy
         self.components = components
         self.potentials = potentials
+        self.chemical_potentials = chemical_potentials
         phase_res = PhaseResult()
         for variable, value in variables:
             if isinstance(variable, v.PhaseFraction):
@@ -113,6 +110,11 @@ class EquilibriumResult(object):
         res += '    '.join(['{0!s}={1}'.format(k, v) \
             for k, v in self.potentials.items()])
         res += '\n'
+        if self.chemical_potentials is not None:
+            res += 'Chemical Potentials:\n'
+            res += '    '.join(['MU({0!s})={1:E}'.format(k, v) \
+                for k, v in sorted(self.chemical_potentials.items())])
+            res += '\n'
         res += 'Molar Composition:\n'
         res += '    '.join(['X({0!s})={1:E}'.format(k, v) \
             for k, v in sorted(list(self.mole_fractions.items()))])
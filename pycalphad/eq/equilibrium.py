@@ -8,19 +8,24 @@ from pycalphad.log import logger
 from pycalphad.eq.utils import make_callable, generate_dof
 from pycalphad.eq.utils import check_degenerate_phases
 from pycalphad.eq.utils import unpack_kwarg
-from pycalphad.constraints import sitefrac_cons, sitefrac_jac
-from pycalphad.constraints import molefrac_ast
+from pycalphad.constraints import MoleFractionProjection, \
+    linear_balance_matrix
 from pycalphad import Model
 from pycalphad.eq.energy_surf import energy_surf
-from pycalphad.eq.geometry import lower_convex_hull
+from pycalphad.eq.geometry import lower_convex_hull_arrays, composition_target
+from pycalphad.eq.geometry import prune_energy_surf
 from pycalphad.eq.eqresult import EquilibriumResult
-from sympy import Symbol
+from pycalphad.eq.newton import newton_minimize
+from pycalphad.eq.magnetic import energy_callables
+from pycalphad.eq.ordering import OrderingEnergy
+from pycalphad.eq.redlich_kister import excess_callables
 import pandas as pd
 import numpy as np
 import scipy.spatial
 import scipy.optimize
 from collections import Counter
 import copy
+import functools
 
 try:
     set
@@ -46,29 +51,103 @@ class Equilibrium(object):
         Names (case-sensitive) of components to consider in the calculation.
     phases : list
         Names (case-sensitive) of phases to consider in the calculation.
-    conditions : dict
-        StateVariables and their corresponding value.
+    conditions : dict or list of FixedVariable
+        StateVariables and their corresponding value. Fixing the chemical
+        potential of a component, e.g., {v.MU('AL'): -8e4}, opens the
+        system to that component; see Notes.
+    solver : ['slsqp', 'newton'], optional
+        Method used to refine the starting point. 'slsqp' uses SciPy's
+        general-purpose SLSQP optimizer. 'newton' uses a barrier Newton
+        method which exploits the block-diagonal Hessian and the sparse
+        constraints of the problem; see pycalphad.eq.newton.
+    numeric_magnetic : bool, optional
+        If True, evaluate the IHJ magnetic contribution of each phase, and
+        its derivatives, with pycalphad.eq.magnetic.MagneticEnergy instead
+        of compiling its symbolic form. Not used with fixed chemical
+        potentials. Default is False.
+    prune_tol : float or None, optional
+        Before searching for the starting point, discard sampled points
+        lying more than this distance above the lower convex hull of the
+        energy surface, in units of R*T. Values around 1e-2 are safe and
+        speed up large calculations. Default is None (no pruning).
+    driving_force_tol : float or None, optional
+        After minimization, sampled points whose driving force for
+        precipitation exceeds this value, in units of R*T, are added as new
+        composition sets and the system is solved again, e.g., 1e-3.
+        Default is None (no check).
+    cache_dir : string, optional
+        Directory for storing the sampled energy surfaces on disk (see
+        energy_surf), so that they are reused by later calculations with
+        the same system and state variables.
+    data : DataFrame, optional
+        Energy surface sampled at the state variables of the calculation,
+        as from energy_surf(), used instead of sampling a new one. It is
+        pruned according to `prune_tol`.
 
     Returns
     -------
-    Structured equilibrium calculation.
+    Structured equilibrium calculation. The chemical potentials of the
+    final solution are in result.chemical_potentials; hull_potentials holds
+    the cheaper estimate from the lower convex hull of the sampled points.
+
+    Notes
+    -----
+    With fixed chemical potentials the Legendre-transformed energy
+    G - sum(MU(i)*X(i)), summed over the open components, is minimized per
+    mole of the remaining (closed) components. Composition conditions then
+    refer to mole fractions within the closed components only, and one
+    fewer is needed for each fixed potential.
+
+    Otherwise, the energy of phases with an atomic ordering contribution,
+    and its derivatives, are evaluated with
+    pycalphad.eq.ordering.OrderingEnergy, and the excess energy of Model
+    instances built with numeric_excess=True with
+    pycalphad.eq.redlich_kister.RedlichKister.
 
     Examples
     --------
     None yet.
     """
     def __init__(self, dbf, comps, phases, conditions, **kwargs):
-        self.conditions = conditions
+        if not isinstance(conditions, dict):
+            conditions = dict((cond.symbol, cond.value) for cond in conditions)
+        self.conditions = dict(conditions)
         self.components = set(comps)
+        # Components with a fixed chemical potential are open to a
+        # reservoir; the rest form the closed subsystem
+        self._fixed_potentials = dict( \
+            (cond.species, value) for cond, value in conditions.items() \
+            if isinstance(cond, v.ChemicalPotential))
+        self._closed_components = self.components - \
+            set(self._fixed_potentials)
+        for cond in conditions.keys():
+            if isinstance(cond, v.Composition) and \
+                cond.species in self._fixed_potentials:
+                raise ValueError('Composition and chemical potential of {0} '
+                                 'cannot both be fixed'.format(cond.species))
+        if not set(self._fixed_potentials) <= self.components - set(['VA']):
+            raise ValueError('Chemical potentials can only be fixed for '
+                             'non-vacancy components of the system')
+        if len(self._closed_components - set(['VA'])) == 0:
+            raise ValueError('At least one component must be closed')
         self.phases = dict()
         self.statevars = dict()
         self.data = pd.DataFrame()
+        self.hull_potentials = dict()
+        self._solution = None
 
         self._phases = dict([[name, dbf.phases[name]] for name in phases])
         self._phase_callables = dict()
         self._gradient_callables = dict()
         self._molefrac_callables = dict()
         self._molefrac_jac_callables = dict()
+        self._hessian_callables = dict()
+        self._molefrac_hess_callables = dict()
+        self._solver = kwargs.pop('solver', 'slsqp')
+        # Also passed on to energy_surf
+        self._numeric_magnetic = kwargs.get('numeric_magnetic', False)
+        if self._solver not in ('slsqp', 'newton'):
+            raise ValueError('Unknown solver: {0}'.format(self._solver))
         self._variables = dict()
         self._sublattice_dof = dict()
         self.statevars = dict()
@@ -88,46 +167,396 @@ class Equilibrium(object):
                 self._models[name] = mod(dbf, self.components, name)
 
         self._build_objective_functions()
+        self._bind_parameters()
+
+        self._prune_tol = kwargs.pop('prune_tol', None)
+        sampled_surface = kwargs.pop('data', None)
+        self._driving_force_tol = kwargs.pop('driving_force_tol', None)
+        self._dbf = dbf
+        self._surface_args = (comps, phases)
+        self._surface_kwargs = kwargs
+        # Unpruned sample of the energy surface at the initial state
+        # variables; step() evaluates it again at new state variables
+        self._sampled_surface = sampled_surface
+        if self._sampled_surface is None:
+            self._sampled_surface = self._sample_surface(**kwargs)
+        # Pruned energy surfaces, keyed by the values of the state variables
+        self._surfaces = {self._surface_key(dict((str(key), value) \
+            for key, value in self.statevars.items())): \
+                self._prune_surface(self._sampled_surface)}
+        # self.data contains energy surface information for the system
+        self.data = list(self._surfaces.values())[0]
+        self.result = self._solve_from_hull()
+
+    def _sample_surface(self, **kwargs):
+        "Sample the energy surface at the given state variables."
+        return energy_surf(self._dbf, *self._surface_args, \
+            model=self._models, **kwargs)
+
+    def _prune_surface(self, data):
+        "Keep only the points of `data` near its lower convex hull."
+        if self._prune_tol is None:
+            return data
+        # Only points near the lower convex hull can enter the solution
+        return prune_energy_surf(data, self.components,
+                                 tolerance=self._prune_tol)
 
-        self.data = energy_surf(dbf, comps, phases, model=self._models, \
-            **kwargs)
+    def _evaluate_surface(self, point):
+        """
+        Energy surface at the state variables of `point`, from the points
+        sampled at the initial state variables. The energies are evaluated
+        with the energy callables, which must be bound to `point`.
+        """
+        data = self._sampled_surface.copy()
+        for name, value in point.items():
+            data[name] = float(value)
+        energies = np.empty(len(data))
+        for phase_name, indices in \
+            data.groupby('Phase', sort=False).indices.items():
+            site_fractions = data[[str(x) for x in \
+                self._variables[phase_name]]].values[indices].T
+            # Phases without internal degrees of freedom give a scalar
+            energies[indices] = \
+                self._phase_callables[phase_name](*site_fractions)
+        data['GM'] = energies
+        return data
 
-        # self.data now contains energy surface information for the system
+    def _solve_from_hull(self):
+        "Find the equilibrium of self.data, starting from its convex hull."
+        # The solver works on dense arrays; self.data is kept for users
+        self._build_dense_surface()
         # find simplex for a starting point; refine with optimization
-        estimates = self.get_starting_simplex()
-        logger.debug(estimates)
-        self.result = self.minimize(estimates[0], estimates[1])
+        indices, phase_fracs = self._starting_point()
+        result = self._minimize(self._vertex_phases(indices),
+                                self._vertex_site_fractions(indices),
+                                phase_fracs, self._energies[indices])
+        if self._driving_force_tol is not None:
+            result = self.add_missing_composition_sets(result)
+        return result
+
+    def step(self, axis, values, start=None):
+        """
+        Calculate the equilibria along a path in condition space. Each
+        calculation starts from the composition sets of the previous
+        solution; the convex hull of the energy surface is only searched
+        again when a phase appears or disappears, or the local solve fails.
+        The energy surface at new state variables is evaluated at the
+        points sampled for the initial ones, unless chemical potentials
+        are fixed.
+
+        Parameters
+        ----------
+        axis : StateVariable or list of StateVariable
+            Conditions to vary: v.T, v.P, or the keys of composition or
+            chemical potential conditions.
+        values : array_like
+            Values of `axis` in the order they are calculated; one column
+            per axis if several axes are given.
+        start : EquilibriumResult, optional
+            Solution to continue the first point from, e.g., returned by an
+            earlier call. Default is the most recent solution.
+
+        Returns
+        -------
+        List of EquilibriumResult, one per point (None where the
+        calculation failed). The conditions and energy surface of this
+        object are left at the last point.
+
+        Examples
+        --------
+        >>> eqx = Equilibrium(dbf, comps, phases, conds, T=1000, pdens=1000)
+        >>> results = eqx.step(v.T, np.arange(1000, 1500, 10))
+        """
+        axes = list(axis) if isinstance(axis, (list, tuple)) else [axis]
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(axes))
+        for cur_axis in axes:
+            if cur_axis not in self.statevars and \
+                cur_axis not in self.conditions:
+                raise ValueError('{0} is not a condition of this '
+                                 'calculation'.format(cur_axis))
+        points = []
+        for row in values:
+            point = dict((str(key), value) \
+                for key, value in self.statevars.items())
+            point.update((str(cur_axis), value) \
+                for cur_axis, value in zip(axes, row) \
+                if cur_axis in self.statevars)
+            points.append(point)
+        if start is not None:
+            self._solution = self._result_solution(start)
+        if self._fixed_potentials:
+            # The energy callables include the chemical potentials, so the
+            # surfaces are sampled again, all at once
+            self._sample_surfaces(points)
+        results = []
+        for row, point in zip(values, points):
+            for cur_axis, value in zip(axes, row):
+                if cur_axis in self.statevars:
+                    self.statevars[cur_axis] = value
+                else:
+                    self.conditions[cur_axis] = value
+                    if isinstance(cur_axis, v.ChemicalPotential):
+                        self._fixed_potentials[cur_axis.species] = value
+            self._bind_parameters()
+            key = self._surface_key(point)
+            if key not in self._surfaces:
+                self._surfaces[key] = \
+                    self._prune_surface(self._evaluate_surface(point))
+            self.data = self._surfaces[key]
+            result = None
+            if self._solution is not None:
+                self._build_dense_surface()
+                result = self._continue_solution()
+            if result is None:
+                logger.debug('Searching the convex hull at %s = %s',
+                             axes, row)
+                result = self._solve_from_hull()
+            results.append(result)
+        return results
+
+    def _surface_key(self, point):
+        "Key of the energy surface for a dict of state variable values."
+        return tuple(float(point[name]) for name in sorted(point.keys()))
+
+    def _sample_surfaces(self, points):
+        """
+        Make sure the energy surface at each of `points` (dicts of state
+        variable values) is in the cache, sampling any missing ones in a
+        single call.
+        """
+        missing = [point for point in points \
+            if self._surface_key(point) not in self._surfaces]
+        if len(missing) == 0:
+            return
+        names = sorted(missing[0].keys())
+        surface_kwargs = dict(self._surface_kwargs)
+        for name in names:
+            surface_kwargs[name] = sorted(set(point[name] \
+                for point in missing))
+        data = self._prune_surface(self._sample_surface(**surface_kwargs))
+        for key, indices in data.groupby(names, sort=False).indices.items():
+            key = tuple(np.atleast_1d(key).astype(np.float64))
+            if key not in self._surfaces:
+                self._surfaces[key] = data.iloc[indices].reset_index(drop=True)
+
+    def _result_solution(self, result):
+        """
+        Phases, site fractions, phase fractions and energies of the stable
+        composition sets of `result`, as kept in self._solution.
+        """
+        stable = [phase for phase in result.phases \
+            if phase.volume_fraction > 1e-8]
+        site_fractions = [np.array([phase.sublattices[var.sublattice_index]\
+            .site_fractions[var.species] \
+            for var in self._variables[phase.name]]) for phase in stable]
+        # Energies only set the scale of the objective
+        return ([phase.name for phase in stable], site_fractions,
+                np.array([phase.volume_fraction for phase in stable]),
+                np.repeat(result.energy, len(stable)))
+
+    def _continue_solution(self):
+        """
+        Solve starting from the stable composition sets of the previous
+        solution. Returns None if the set of stable phases has changed.
+        """
+        phases, site_fractions, phase_fractions, energies = self._solution
+        stable = [idx for idx in range(len(phases)) \
+            if phase_fractions[idx] > 1e-8]
+        result = self._minimize([phases[idx] for idx in stable],
+                                [site_fractions[idx] for idx in stable],
+                                phase_fractions[stable] / \
+                                    np.sum(phase_fractions[stable]),
+                                energies[stable])
+        if result is None:
+            return None
+        # A phase has disappeared
+        if np.any(self._solution[2] <= 1e-8):
+            return None
+        # A phase has appeared; this is checked even when the driving
+        # force check of single calculations is off
+        tolerance = self._driving_force_tol
+        if tolerance is None:
+            tolerance = 1e-3
+        if np.max(self.driving_forces(result)) > tolerance:
+            return None
+        return result
 
     def __str__(self):
         return str(self.result)
 
-    def get_starting_simplex(self):
+    def _build_dense_surface(self):
+        """
+        Extract the arrays needed by the solver from self.data.
+        Phases are represented by integer codes into self._phase_names.
+        """
+        self._composition_columns, _ = \
+            composition_target(self._closed_components, self.conditions)
+        compositions = self.data[self._composition_columns].values
+        energies = self.data['GM'].values
+        if self._fixed_potentials:
+            # Transform to the semi-grand energy per mole of closed
+            # components; points made only of open components are dropped
+            open_species = sorted(self._fixed_potentials.keys())
+            open_fractions = self.data[['X({0})'.format(x) \
+                for x in open_species]].values
+            closed_fraction = 1 - np.sum(open_fractions, axis=1)
+            keep = closed_fraction > 1e-8
+            self.data = self.data[keep].reset_index(drop=True)
+            closed_fraction = closed_fraction[keep]
+            compositions = compositions[keep] / closed_fraction[:, None]
+            energies = (energies[keep] - np.dot(open_fractions[keep], \
+                [self._fixed_potentials[x] for x in open_species])) / \
+                closed_fraction
+        self._phase_names = sorted(set(self.data['Phase']))
+        self._phase_codes = np.searchsorted(self._phase_names,
+                                            self.data['Phase'].values)
+        self._compositions = np.ascontiguousarray(compositions,
+                                                  dtype=np.float64)
+        self._energies = np.ascontiguousarray(energies, dtype=np.float64)
+        self._temperature = self.data['T'].values[0]
+        # Site fraction columns of every phase, stored side by side
+        sitefrac_columns = []
+        self._sitefrac_indices = dict()
+        for phase_name in self._phase_names:
+            start = len(sitefrac_columns)
+            sitefrac_columns.extend(str(x) for x in self._variables[phase_name])
+            self._sitefrac_indices[phase_name] = \
+                np.arange(start, len(sitefrac_columns))
+        self._site_fractions = np.ascontiguousarray(
+            self.data[sitefrac_columns].fillna(0).values, dtype=np.float64)
+
+    def _vertex_phases(self, indices):
+        "Return the phase names of the sampled points at `indices`."
+        return [self._phase_names[code] for code in self._phase_codes[indices]]
+
+    def _vertex_site_fractions(self, indices):
+        "Return the site fractions of the sampled points at `indices`."
+        return [self._site_fractions[idx, self._sitefrac_indices[name]]
+                for idx, name in zip(indices, self._vertex_phases(indices))]
+
+    def _starting_point(self):
         """
         Calculate convex hull and find a suitable starting point.
-        Returns (DataFrame of phase compositions, ndarray of phase fractions)
+        Returns (ndarray of indices into self.data,
+                 ndarray of phase fractions)
         """
+        _, dof_values = composition_target(self._closed_components,
+                                           self.conditions)
         phase_compositions, phase_fracs, pots = \
-            lower_convex_hull(self.data, self.components, self.conditions)
+            lower_convex_hull_arrays(self._compositions, self._energies,
+                                     dof_values, self._temperature)
         if phase_compositions is None:
             logger.error('Unable to find starting point for calculation')
             raise EquilibriumError('Unable to find starting point for calculation')
+        self.hull_potentials = dict(zip(sorted(x for x in \
+            self._closed_components if x != 'VA'), pots))
+        self.hull_potentials.update(self._fixed_potentials)
         logger.debug(self.data.iloc[phase_compositions])
+        simplex_codes = self._phase_codes[phase_compositions]
         independent_indices = \
-            check_degenerate_phases(self.data.iloc[phase_compositions],
-                                    mindist=0.1)
+            check_degenerate_phases(self._compositions[phase_compositions],
+                                    mindist=0.1, phase_codes=simplex_codes)
         logger.debug('phase_fracs: %s', phase_fracs)
         logger.debug('independent_indices: %s', independent_indices)
         # renormalize phase fractions to 1 after eliminating redundant phases
         phase_fracs = phase_fracs[independent_indices]
         phase_fracs /= np.sum(phase_fracs)
-        return [self.data.iloc[phase_compositions[independent_indices]],
-                phase_fracs]
+        return phase_compositions[independent_indices], phase_fracs
+
+    def get_starting_simplex(self):
+        """
+        Calculate convex hull and find a suitable starting point.
+        Returns (DataFrame of phase compositions, ndarray of phase fractions)
+        """
+        indices, phase_fracs = self._starting_point()
+        return [self.data.iloc[indices], phase_fracs]
 
     def minimize(self, simplex, phase_fractions=None):
         """
         Accept a list of simplex vertices and return the values of the
         variables that minimize the energy under the constraints.
         """
+        vertex_phases = list(simplex['Phase'])
+        site_fractions = [simplex[[str(x) for x in self._variables[name]]]
+                          .iloc[idx].values.astype(np.float64)
+                          for idx, name in enumerate(vertex_phases)]
+        return self._minimize(vertex_phases, site_fractions, phase_fractions,
+                              simplex['GM'].values)
+
+    def driving_forces(self, result):
+        """
+        Calculate the driving force for precipitation of every sampled
+        point in self.data, relative to the chemical potentials of `result`.
+
+        Parameters
+        ----------
+        result : EquilibriumResult
+            Solution returned by minimize().
+
+        Returns
+        -------
+        ndarray of driving forces, in units of R*T. Positive values mark
+        points below the tangent plane of the solution.
+        """
+        potentials = [result.chemical_potentials[x] for x in \
+            sorted(self._closed_components - set(['VA']))]
+        return (np.dot(self._compositions, potentials) - self._energies) / \
+            (8.3145 * self._temperature)
+
+    def add_missing_composition_sets(self, result, max_iterations=10):
+        """
+        Check that no sampled point has a positive driving force with
+        respect to `result`. The point with the largest driving force is
+        added as a new composition set and the system is solved again from
+        the previous solution, until the check passes.
+
+        Parameters
+        ----------
+        result : EquilibriumResult
+            Solution to check, e.g. returned by minimize(). The stable
+            phases of this result are the starting point of the new solves.
+        max_iterations : int, optional
+            Maximum number of composition sets to add.
+
+        Returns
+        -------
+        EquilibriumResult
+        """
+        tolerance = self._driving_force_tol
+        if tolerance is None:
+            tolerance = 1e-3
+        for _ in range(max_iterations):
+            if result is None:
+                break
+            driving_forces = self.driving_forces(result)
+            new_point = np.argmax(driving_forces)
+            if driving_forces[new_point] < tolerance:
+                break
+            logger.info('Adding composition set of %s with driving force '
+                        '%s RT', self._phase_names[self._phase_codes[new_point]],
+                        driving_forces[new_point])
+            # Restart from the stable phases of the previous result
+            phases, site_fractions, phase_fractions, energies = \
+                self._result_solution(result)
+            new_result = self._minimize(
+                phases + self._vertex_phases([new_point]),
+                site_fractions + self._vertex_site_fractions([new_point]),
+                np.append(phase_fractions, 0.0),
+                np.append(energies, self._energies[new_point]))
+            if new_result is None:
+                logger.warning('Unable to add composition set; keeping the '
+                               'previous solution')
+                break
+            result = new_result
+        return result
+
+    def _minimize(self, vertex_phases, site_fractions, phase_fractions,
+                  energies):
+        """
+        Accept the phase names, site fractions and energies of the
+        simplex vertices and return the values of the variables that
+        minimize the energy under the constraints.
+        """
         # Generate phase fraction variables
         # Track the multiplicity of phases with a Counter object
         composition_sets = Counter()
@@ -137,236 +566,352 @@ class Equilibrium(object):
         # scaling factor -- set to minimum energy of starting simplex
         # Scaling the objective to be of order '10' seems to result in
         # sufficient precision (at least 5 significant figures).
-        scaling_factor = abs(simplex['GM'].min()) / 10.0
+        scaling_factor = abs(np.min(energies)) / 10.0
         # a list of tuples for where each phase's variable indices
         # start and end
         index_ranges = []
-        #print(list(enumerate(simplex.iterrows())))
-        #print((simplex.iterrows()))
-        #print('END')
-        for m_idx, vertex in enumerate(simplex.iterrows()):
-            vertex = vertex[1]
+        for m_idx, phase_name in enumerate(vertex_phases):
             # increase multiplicity by one
-            composition_sets[vertex['Phase']] += 1
+            composition_sets[phase_name] += 1
             # create new phase fraction variable
             all_variables.append(
-                v.PhaseFraction(vertex['Phase'],
-                                composition_sets[vertex['Phase']])
+                v.PhaseFraction(phase_name,
+                                composition_sets[phase_name])
                 )
             start = len(x_0)
             # default position is centroid of the simplex
             if phase_fractions is None:
-                x_0.append(1.0/len(list(simplex.iterrows())))
+                x_0.append(1.0/len(vertex_phases))
             else:
                 # use the provided guess for the phase fraction
                 x_0.append(phase_fractions[m_idx])
 
             # add site fraction variables
-            all_variables.extend(self._variables[vertex['Phase']])
+            all_variables.extend(self._variables[phase_name])
             # add starting point for variable
-            for varname in self._variables[vertex['Phase']]:
-                x_0.append(vertex[str(varname)])
+            x_0.extend(site_fractions[m_idx])
             index_ranges.append([start, len(x_0)])
 
+        x_0 = np.array(x_0, dtype=np.float64)
+        num_vars = len(x_0)
+        num_vertices = len(vertex_phases)
+        # Precompute where each vertex's variables live in the x vector
+        phasefrac_indices = np.array([r[0] for r in index_ranges], dtype=np.int)
+        sitefrac_slices = [slice(r[0]+1, r[1]) for r in index_ranges]
+
+        # Mass balance conditions, in the order of self._molefrac_species
+        molefrac_conds = [(self._molefrac_species.index(cond.species), value)
+                          for cond, value in self.conditions.items()
+                          if isinstance(cond, v.Composition)]
+        molefrac_rows = np.array([c[0] for c in molefrac_conds], dtype=np.int)
+        molefrac_values = np.array([c[1] for c in molefrac_conds],
+                                   dtype=np.float64)
+
+        # Phase fraction and site fraction balances are linear: A x = b
+        balance_matrix, balance_values = linear_balance_matrix(
+            index_ranges, [self._sublattice_dof[x] for x in vertex_phases],
+            num_vars)
+        # SLSQP only works with dense Jacobians; this one is constant
+        balance_jac = -balance_matrix.toarray()
+
+        # The phase energies, mole fractions and their derivatives are
+        # needed by several callbacks; evaluate them once per point
+        cache = {'x': None}
+        def evaluate(input_x):
+            "Evaluate all per-vertex quantities at input_x."
+            if cache['x'] is not None and np.array_equal(cache['x'], input_x):
+                return cache
+            cache['x'] = np.array(input_x, copy=True)
+            cache['energies'] = np.empty(num_vertices)
+            cache['gradients'] = []
+            cache['molefracs'] = np.empty((num_vertices,
+                                           len(self._molefrac_species)))
+            cache['molefrac_jacs'] = []
+            for idx, phase_name in enumerate(vertex_phases):
+                cur_x = input_x[sitefrac_slices[idx]]
+                cache['energies'][idx] = \
+                    self._phase_callables[phase_name](*cur_x)
+                cache['gradients'].append(np.array(
+                    self._gradient_callables[phase_name](*cur_x),
+                    dtype=np.float64))
+                cache['molefracs'][idx] = \
+                    self._molefrac_callables[phase_name](*cur_x)
+                cache['molefrac_jacs'].append(np.array(
+                    self._molefrac_jac_callables[phase_name](*cur_x),
+                    dtype=np.float64))
+            return cache
+
         # Create master objective function
         def obj(input_x):
             "Objective function. Takes x vector as input. Returns scalar."
-            objective = 0.0
-            for idx, vertex in enumerate(simplex.iterrows()):
-                vertex = vertex[1]
-                cur_x = input_x[index_ranges[idx][0]+1:index_ranges[idx][1]]
-                #print('Phase: '+vertex['Phase']+' '+str(cur_x))
-                # phase fraction times value of objective for that phase
-                objective += input_x[index_ranges[idx][0]] * \
-                    self._phase_callables[vertex['Phase']](
-                        *list(cur_x))
+            vals = evaluate(input_x)
+            # phase fraction times value of objective for that phase
+            objective = np.dot(input_x[phasefrac_indices], vals['energies'])
             return objective / scaling_factor
 
         # Create master gradient function
         def gradient(input_x):
             "Accepts input vector and returns gradient vector."
-            gradient = np.zeros(len(input_x))
-            for idx, vertex in enumerate(simplex.iterrows()):
-                vertex = vertex[1]
-                cur_x = input_x[index_ranges[idx][0]+1:index_ranges[idx][1]]
-                #print('grad cur_x: '+str(cur_x))
-                # phase fraction derivative is just the phase energy
-                gradient[index_ranges[idx][0]] = \
-                    self._phase_callables[vertex['Phase']](
-                        *list(cur_x))
-                # gradient for particular phase's variables
-                # NOTE: We assume all phase d.o.f are independent here,
-                # and we handle any coupling through the constraints
-                for g_idx, grad in \
-                    enumerate(self._gradient_callables[vertex['Phase']]):
-                    gradient[index_ranges[idx][0]+1+g_idx] = \
-                        input_x[index_ranges[idx][0]] * \
-                            grad(*list(cur_x))
-            #print('grad: '+str(gradient / scaling_factor))
-            return gradient / scaling_factor
-
-        # Generate constraint sequence
-        constraints = []
-
-        # phase fraction constraint
-        def phasefrac_cons(input_x):
-            "Accepts input vector and returns phase fraction constraint."
-            output = 1.0 - sum([input_x[i[0]] for i in index_ranges])#** 2
-            return output
-        def phasefrac_jac(input_x):
-            "Accepts input vector and returns Jacobian of constraint."
-            output_x = np.zeros(len(input_x))
-            for idx_range in index_ranges:
-                output_x[idx_range[0]] = -1.0 #\
-                #    -2.0*sum([input_x[i[0]] for i in index_ranges])
-            return output_x
-        phasefrac_dict = dict()
-        phasefrac_dict['type'] = 'eq'
-        phasefrac_dict['fun'] = phasefrac_cons
-        phasefrac_dict['jac'] = phasefrac_jac
-        constraints.append(phasefrac_dict)
-
-        # bounds constraint
-        def nonneg_cons(input_x, idx):
-            "Accepts input vector and returns non-negativity constraint."
-            output = input_x[idx]
-            #print('nonneg_cons: '+str(output))
-            return output
+            vals = evaluate(input_x)
+            grad = np.zeros(num_vars)
+            # phase fraction derivative is just the phase energy
+            grad[phasefrac_indices] = vals['energies']
+            # NOTE: We assume all phase d.o.f are independent here,
+            # and we handle any coupling through the constraints
+            for idx in range(num_vertices):
+                grad[sitefrac_slices[idx]] = \
+                    input_x[phasefrac_indices[idx]] * vals['gradients'][idx]
+            return grad / scaling_factor
 
-        def nonneg_jac(input_x, idx):
-            "Accepts input vector and returns Jacobian of constraint."
-            output_x = np.zeros(len(input_x))
-            output_x[idx] = 1.0
-            return output_x
-
-        for idx in range(len(all_variables)):
-            nonneg_dict = dict()
-            nonneg_dict['type'] = 'ineq'
-            nonneg_dict['fun'] = nonneg_cons
-            nonneg_dict['jac'] = nonneg_jac
-            nonneg_dict['args'] = [idx]
-            constraints.append(nonneg_dict)
-
-        # Generate all site fraction constraints
-        for idx_range in index_ranges:
-            # need to generate constraint for each sublattice
-            dofs = self._sublattice_dof[all_variables[idx_range[0]].phase_name]
-            cur_idx = idx_range[0]+1
-            for dof in dofs:
-                sitefrac_dict = dict()
-                sitefrac_dict['type'] = 'eq'
-                sitefrac_dict['fun'] = sitefrac_cons
-                sitefrac_dict['jac'] = sitefrac_jac
-                sitefrac_dict['args'] = [[cur_idx, cur_idx+dof]]
-                cur_idx += dof
-                if dof > 0:
-                    constraints.append(sitefrac_dict)
-
-        # All other constraints, e.g., mass balance
-        def molefrac_cons(input_x, species, fix_val, all_variables, phases):
-            """
-            Accept input vector, species and fixed value.
-            Returns constraint.
-            """
-            output = -fix_val
-            for idx, vertex in enumerate(simplex.iterrows()):
-                vertex = vertex[1]
-                cur_x = input_x[index_ranges[idx][0]+1:index_ranges[idx][1]]
-                res = self._molefrac_callables[vertex['Phase']][species](*cur_x)
-                output += input_x[index_ranges[idx][0]] * res
-            #print('molefrac_cons: '+str(output))
-            return output
-        def molefrac_jac(input_x, species, fix_val, all_variables, phases):
-            "Accepts input vector and returns Jacobian vector."
-            output_x = np.zeros(len(input_x))
-            for idx, vertex in enumerate(simplex.iterrows()):
-                vertex = vertex[1]
-                cur_x = input_x[index_ranges[idx][0]+1:index_ranges[idx][1]]
-                output_x[index_ranges[idx][0]] = \
-                    self._molefrac_callables[vertex['Phase']][species](*cur_x)
-                for g_idx, grad in \
-                    enumerate(self._molefrac_jac_callables[vertex['Phase']][species]):
-                    output_x[index_ranges[idx][0]+1+g_idx] = \
-                        input_x[index_ranges[idx][0]] * \
-                            grad(*list(cur_x))
-            #print('molefrac_jac '+str(output_x))
-            return output_x
-
-        eqs = len([x for x in constraints if x['type'] == 'eq'])
-        if eqs < len(x_0):
-            for condition, value in self.conditions.items():
-                if isinstance(condition, v.Composition):
-                    # mass balance constraint for mole fraction
-                    molefrac_dict = dict()
-                    molefrac_dict['type'] = 'eq'
-                    molefrac_dict['fun'] = molefrac_cons
-                    molefrac_dict['jac'] = molefrac_jac
-                    molefrac_dict['args'] = \
-                        [condition.species, value, all_variables,
-                         self._phases]
-                    constraints.append(molefrac_dict)
-        else:
+        # Mass balances of all conditions, even if dropped from the solve,
+        # are needed to recover the chemical potentials
+        condition_rows = molefrac_rows
+        if balance_matrix.shape[0] >= num_vars:
             logger.warning("""Dropping mass balance constraints due to
                 zero internal degrees of freedom""")
+            molefrac_rows = molefrac_rows[:0]
+            molefrac_values = molefrac_values[:0]
+
+        def molefrac_cons(input_x):
+            "Accepts input vector and returns mass balance constraint vector."
+            vals = evaluate(input_x)
+            return np.dot(input_x[phasefrac_indices],
+                          vals['molefracs'][:, molefrac_rows]) - \
+                molefrac_values
+
+        def molefrac_jac(input_x, rows=None):
+            "Accepts input vector and returns Jacobian of mass balances."
+            if rows is None:
+                rows = molefrac_rows
+            vals = evaluate(input_x)
+            output = np.zeros((len(rows), num_vars))
+            output[:, phasefrac_indices] = vals['molefracs'][:, rows].T
+            for idx in range(num_vertices):
+                output[:, sitefrac_slices[idx]] = \
+                    input_x[phasefrac_indices[idx]] * \
+                    vals['molefrac_jacs'][idx][rows]
+            return output
+
+        constraints = [{'type': 'eq',
+                        'fun': lambda input_x: balance_values - \
+                            balance_matrix.dot(input_x),
+                        'jac': lambda input_x: balance_jac}]
+        if len(molefrac_rows) > 0:
+            constraints.append({'type': 'eq', 'fun': molefrac_cons,
+                                'jac': molefrac_jac})
+        # All variables are fractions
+        bounds = [(0.0, 1.0)] * num_vars
 
         # Run optimization
-        res = scipy.optimize.minimize(obj, x_0, method='slsqp', jac=gradient,\
-            constraints=constraints, options={'maxiter': 1000})
-        # rescale final values back to original
-        res['raw_fun'] = copy.deepcopy(res['fun'])
-        res['raw_jac'] = copy.deepcopy(res['jac'])
-        res['raw_x'] = copy.deepcopy(res['x'])
-        res['fun'] *= scaling_factor
-        res['jac'] *= scaling_factor
+        if self._solver == 'newton':
+            composition_sets = [{
+                'phasefrac_index': phasefrac_indices[idx],
+                'sitefrac_slice': sitefrac_slices[idx],
+                'energy': self._phase_callables[phase_name],
+                'gradient': self._gradient_callables[phase_name],
+                'hessian': self._hessian_callables[phase_name],
+                'molefracs': self._molefrac_callables[phase_name],
+                'molefrac_jac': self._molefrac_jac_callables[phase_name],
+                'molefrac_hess': self._molefrac_hess_callables[phase_name]
+                } for idx, phase_name in enumerate(vertex_phases)]
+            res = newton_minimize(x_0, composition_sets, balance_matrix,
+                                  balance_values, molefrac_rows,
+                                  molefrac_values, scale=scaling_factor)
+        else:
+            res = scipy.optimize.minimize(obj, x_0, method='slsqp', \
+                jac=gradient, bounds=bounds, constraints=constraints, \
+                options={'maxiter': 1000})
+            # rescale final values back to original
+            res['raw_fun'] = copy.deepcopy(res['fun'])
+            res['raw_jac'] = copy.deepcopy(res['jac'])
+            res['raw_x'] = copy.deepcopy(res['x'])
+            res['fun'] *= scaling_factor
+            res['jac'] *= scaling_factor
         # force tiny numerical values to be positive
         res['x'] = np.maximum(res['x'], np.zeros(1, dtype=np.float64))
         logger.debug(res)
         if not res['success']:
             logger.error('Energy minimization failed')
             return None
+        # Keep the solution in solver variables for restarts
+        solution_values = evaluate(res['x'])
+        self._solution = (list(vertex_phases),
+                          [res['x'][sl] for sl in sitefrac_slices],
+                          res['x'][phasefrac_indices],
+                          np.array(solution_values['energies']))
+
+        # Recover the Lagrange multipliers of the balance constraints
+        multipliers = res.get('multipliers', None)
+        num_balances = balance_matrix.shape[0] + len(condition_rows)
+        if multipliers is None or len(multipliers) != num_balances:
+            # Least-squares estimate from the stationarity conditions;
+            # variables at zero or in no constraint have bound multipliers
+            jac = np.vstack((balance_matrix.toarray(),
+                             molefrac_jac(res['x'], rows=condition_rows)))
+            free_vars = (res['x'] > 1e-8) & np.any(jac != 0, axis=0)
+            multipliers = np.linalg.lstsq(jac[:, free_vars].T,
+                                          -gradient(res['x'])[free_vars])[0]
+        chemical_potentials = self._chemical_potentials(
+            multipliers[0] * scaling_factor,
+            multipliers[balance_matrix.shape[0]:] * scaling_factor,
+            condition_rows)
+
+        values = res['x']
+        energy = res['fun']
+        if self._fixed_potentials:
+            # Convert amounts of closed components to phase fractions and
+            # the semi-grand energy back to the molar Gibbs energy
+            vals = evaluate(values)
+            amounts = values[phasefrac_indices] * \
+                np.sum(vals['molefracs'], axis=1)
+            open_amounts = np.dot(values[phasefrac_indices],
+                                  vals['molefracs'])
+            energy = (energy + sum(open_amounts[idx] * \
+                self._fixed_potentials[species] for idx, species in \
+                enumerate(self._molefrac_species) \
+                if species in self._fixed_potentials)) / np.sum(amounts)
+            values = values.copy()
+            values[phasefrac_indices] = amounts / np.sum(amounts)
 
         # Build result object
         eq_res = EquilibriumResult(self._phases, self.components,
-                                   self.statevars, res['fun'],
-                                   zip(all_variables, res['x']))
+                                   self.statevars, energy,
+                                   zip(all_variables, values),
+                                   chemical_potentials=chemical_potentials)
         return eq_res
 
+    def _chemical_potentials(self, phasefrac_multiplier, molefrac_multipliers,
+                             condition_rows):
+        """
+        Convert the Lagrange multipliers of the phase fraction balance and
+        the mass balances into chemical potentials.
+
+        At equilibrium the molar energy of every stable phase lies on the
+        plane sum(MU(i) * X(i)). The phase fraction multiplier gives the
+        potential of the dependent component, and each mass balance
+        multiplier the difference between its component's potential and
+        that of the dependent component.
+
+        Returns
+        -------
+        dict of component name to chemical potential
+        """
+        dependent_potential = -phasefrac_multiplier
+        result = dict((species, dependent_potential) \
+            for species in self._molefrac_species)
+        for row, multiplier in zip(condition_rows, molefrac_multipliers):
+            result[self._molefrac_species[row]] = \
+                dependent_potential - multiplier
+        result.update(self._fixed_potentials)
+        return result
+
     def _build_objective_functions(self):
         "Construct objective function callables for each phase."
+        self._molefrac_species = sorted(x for x in self.components \
+            if x != 'VA')
+        # State variables and fixed chemical potentials are compiled as
+        # arguments, so that they can change without recompiling
+        self._parameters = sorted(self.statevars.keys(), key=str) + \
+            [v.MU(x) for x in sorted(self._fixed_potentials.keys())]
+        self._parametric_callables = {'energy': dict(), 'gradient': dict(),
+                                      'hessian': dict()}
         for phase_name, phase_obj in self._phases.items():
             # Get the symbolic representation of the energy
             mod = self._models[phase_name]
-            undefs = list(mod.ast.atoms(Symbol) - mod.ast.atoms(v.StateVariable))
-            for undef in undefs:
-                mod.ast = mod.ast.xreplace({undef: float(0)})
+            for undef in mod.zero_undefined_symbols():
                 logger.warning('Setting undefined symbol %s for phase %s to zero',
                                undef, phase_name)
             # Construct an ordered list of the variables
             self._variables[phase_name], self._sublattice_dof[phase_name] = \
                 generate_dof(phase_obj, self.components)
-            molefrac_dict = dict([(x, molefrac_ast(phase_obj, x)) \
-                for x in self.components if x != 'VA'])
-            molefrac_jac_dict = dict()
-
-            # Generate callables for the mole fractions
-            for comp in self.components:
-                if comp == 'VA':
-                    continue
-                molefrac_jac_dict[comp] = [ \
-                    make_callable(molefrac_dict[comp].diff(vx), \
-                    self._variables[phase_name], \
-                    ) for vx in self._variables[phase_name]]
-                molefrac_dict[comp] = make_callable(molefrac_dict[comp], \
-                    self._variables[phase_name])
+            projection = MoleFractionProjection(
+                phase_obj.sublattices, self._variables[phase_name],
+                self._molefrac_species)
+            # Ordered phases compose their ordered and disordered parts,
+            # and the excess and magnetic contributions are evaluated
+            # numerically, unless the semi-grand transformation below is
+            # needed
+            ordering = mod.ordering_terms is not None and \
+                not self._fixed_potentials
+            numeric_magnetic = self._numeric_magnetic and \
+                mod.magnetic_terms is not None and not self._fixed_potentials
+            numeric_excess = mod.excess_terms is not None and \
+                not self._fixed_potentials
+            if self._fixed_potentials:
+                energy_ast = mod.ast
+                # Semi-grand energy and amounts per mole of closed components
+                molefrac_list = projection.ast()
+                closed_fraction = 1 - sum(molefrac \
+                    for molefrac, species in \
+                    zip(molefrac_list, self._molefrac_species) \
+                    if species in self._fixed_potentials)
+                energy_ast = (energy_ast - sum(v.MU(species) * molefrac \
+                    for molefrac, species in \
+                    zip(molefrac_list, self._molefrac_species) \
+                    if species in self._fixed_potentials)) / closed_fraction
+                projection = projection.closed(
+                    sorted(self._fixed_potentials.keys()))
+            # The mole fractions and their derivatives are matrix products
+            molefrac_callable = projection.values
+            molefrac_jac_callable = projection.jacobian
 
             # Build the "fast" representation of energy model
-            subbed_ast = mod.ast.subs(self.statevars)
-            self._phase_callables[phase_name] = \
-                make_callable(subbed_ast, \
-                self._variables[phase_name])
-            self._gradient_callables[phase_name] = [ \
-                make_callable(subbed_ast.diff(vx), \
-                    self._variables[phase_name], \
-                    ) for vx in self._variables[phase_name]]
-            self._molefrac_callables[phase_name] = molefrac_dict
-            self._molefrac_jac_callables[phase_name] = molefrac_jac_dict
+            # Parameters come first; they are bound by _bind_parameters()
+            arguments = self._parameters + self._variables[phase_name]
+            self._molefrac_callables[phase_name] = molefrac_callable
+            self._molefrac_jac_callables[phase_name] = molefrac_jac_callable
+            if self._solver == 'newton':
+                self._molefrac_hess_callables[phase_name] = \
+                    projection.hessian
+            if ordering:
+                energy = OrderingEnergy(mod, arguments)
+                self._parametric_callables['energy'][phase_name] = energy
+                self._parametric_callables['gradient'][phase_name] = \
+                    energy.gradient
+                if self._solver == 'newton':
+                    self._parametric_callables['hessian'][phase_name] = \
+                        energy.hessian
+                continue
+            if numeric_excess:
+                energy, gradient, hessian = excess_callables(
+                    mod, arguments, wrt=self._variables[phase_name],
+                    hessian=self._solver == 'newton',
+                    numeric_magnetic=numeric_magnetic)
+            elif numeric_magnetic:
+                energy, gradient, hessian = energy_callables(
+                    mod, arguments, wrt=self._variables[phase_name],
+                    hessian=self._solver == 'newton')
+            if numeric_excess or numeric_magnetic:
+                self._parametric_callables['energy'][phase_name] = energy
+                self._parametric_callables['gradient'][phase_name] = gradient
+                if hessian is not None:
+                    self._parametric_callables['hessian'][phase_name] = \
+                        hessian
+                continue
+            if not self._fixed_potentials:
+                energy_ast = mod.ast
+            self._parametric_callables['energy'][phase_name] = \
+                make_callable(energy_ast, arguments)
+            self._parametric_callables['gradient'][phase_name] = \
+                make_callable([energy_ast.diff(vx) \
+                    for vx in self._variables[phase_name]], arguments)
+            if self._solver == 'newton':
+                # Second derivatives are only needed by the Newton solver
+                self._parametric_callables['hessian'][phase_name] = \
+                    make_callable([[energy_ast.diff(vx).diff(vy) \
+                        for vy in self._variables[phase_name]] \
+                        for vx in self._variables[phase_name]], arguments)
+
+    def _bind_parameters(self):
+        """
+        Fix the parameters of the energy callables to the current state
+        variables and chemical potentials.
+        """
+        values = [self._fixed_potentials[param.species] \
+            if isinstance(param, v.ChemicalPotential) \
+            else self.statevars[param] for param in self._parameters]
+        for target, kind in [(self._phase_callables, 'energy'),
+                             (self._gradient_callables, 'gradient'),
+                             (self._hessian_callables, 'hessian')]:
+            for phase_name, func in self._parametric_callables[kind].items():
+                target[phase_name] = functools.partial(func, *values)
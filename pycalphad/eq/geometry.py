@@ -5,12 +5,64 @@ equilibrium calculation.
 
 import pycalphad.variables as v
 import numpy as np
+import scipy.spatial
 from pycalphad.log import logger
 
-def lower_convex_hull(data, comps, conditions):
+def _lower_hull_distance(coordinates, energies, blocksize=10000):
     """
-    Find the simplex on the lower convex hull satisfying the specified
-    conditions.
+    Calculate the vertical distance of each point above the lower convex
+    hull of a set of points.
+
+    Parameters
+    ----------
+    coordinates : ndarray
+        Independent coordinates of each point, one row per point.
+    energies : ndarray
+        Energy of each point.
+    blocksize : int, optional
+        Number of points to process at once. Bounds the size of the
+        temporary (points x facets) array.
+
+    Returns
+    -------
+    ndarray of distances, or None if the hull could not be computed.
+    """
+    if coordinates.shape[1] == 0:
+        # Only one component: the "hull" is the minimum energy
+        return energies - np.min(energies)
+    try:
+        hull = scipy.spatial.ConvexHull(np.column_stack((coordinates,
+                                                         energies)),
+                                        qhull_options='QJ')
+    except (RuntimeError, ValueError):
+        # Qhull fails for degenerate (e.g., too few) points
+        return None
+    # Keep only facets oriented 'downwards' in the energy direction
+    # Each lower facet is a plane which lies below every point; the lower
+    # hull is the maximum of those planes
+    equations = hull.equations[hull.equations[:, -2] < -1e-6]
+    slopes = -equations[:, :-2] / equations[:, -2][:, None]
+    intercepts = -equations[:, -1] / equations[:, -2]
+    distances = np.empty(len(energies))
+    for start in range(0, len(energies), blocksize):
+        end = start + blocksize
+        hull_energies = np.dot(coordinates[start:end], slopes.T) + intercepts
+        distances[start:end] = energies[start:end] - \
+            np.max(hull_energies, axis=1)
+    return distances
+
+def prune_energy_surf(data, comps, tolerance=1e-2):
+    """
+    Remove points which cannot be part of an equilibrium solution from a
+    sample of the energy surface.
+    For each combination of state variables, the lower convex hull of the
+    (mole fraction, energy) points is computed once, and only points lying
+    within `tolerance` of it are kept.
+
+    Because the lower convex hull of a subset of points is never below that
+    of the full set, this function can also be applied incrementally, e.g.,
+    to the output of energy_surf_chunks() concatenated with the previously
+    pruned data.
 
     Parameters
     ----------
@@ -18,22 +70,62 @@ def lower_convex_hull(data, comps, conditions):
         A sample of the energy surface of the system.
     comps : list
         All the components in the system.
-    conditions : dict
-        StateVariables and their corresponding value.
+    tolerance : float, optional
+        Maximum distance above the lower convex hull, in units of R*T,
+        of points to keep.
 
     Returns
     -------
-    A tuple containing:
-    (1) A numpy array of indices corresponding to vertices of the simplex.
-    (2) A numpy array corresponding to the phase fractions.
-    (3) A numpy array of chemical potentials in sorted(comps) order (no 'VA')
-    Note: This routine will not check if the simplex is degenerate.
+    DataFrame containing the subset of rows of `data` near the hull.
 
     Examples
     --------
-    None yet.
+    >>> data = prune_energy_surf(energy_surf(dbf, comps, phases, T=1000),
+    ...                          comps)
+    """
+    comps = sorted(list(comps))
+    # The last mole fraction is dependent; leave it out of the hull
+    dof = ['X({0})'.format(c) for c in comps if c != 'VA'][:-1]
+    statevars = [c for c in data.columns \
+        if c not in ('GM', 'Phase') and not c.startswith('X(') \
+            and not c.startswith('Y(')]
+    keep = np.ones(len(data), dtype=bool)
+    if len(statevars) > 0:
+        groups = data.groupby(statevars, sort=False).indices.items()
+    else:
+        groups = [(None, np.arange(len(data)))]
+    if 'T' not in statevars:
+        logger.debug('No temperature specified; energy surface not pruned')
+        return data
+    for group, indices in groups:
+        distances = _lower_hull_distance(data[dof].values[indices],
+                                         data['GM'].values[indices])
+        if distances is None:
+            logger.debug('Unable to prune energy surface at %s', group)
+            continue
+        threshold = tolerance * float(v.R) * data['T'].values[indices[0]]
+        keep[indices] = distances <= threshold
+    logger.debug('Pruned energy surface from %s to %s points',
+                 len(data), np.sum(keep))
+    return data.loc[keep].reset_index(drop=True)
+
+def composition_target(comps, conditions):
+    """
+    Determine the target overall composition from the specified conditions.
+
+    Parameters
+    ----------
+    comps : list
+        All the components in the system.
+    conditions : dict
+        StateVariables and their corresponding value.
+
+    Returns
+    -------
+    A tuple containing:
+    (1) A list of mole fraction column names in sorted(comps) order (no 'VA')
+    (2) A numpy array of the corresponding target mole fractions
     """
-    # determine column indices for degrees of freedom
     comps = sorted(list(comps))
     dof = ['X({0})'.format(c) for c in comps if c != 'VA']
     dof_values = np.zeros(len(dof))
@@ -49,17 +141,77 @@ def lower_convex_hull(data, comps, conditions):
         dof_values[dof.index('X({0})'.format(cond.species))] = value
         marked_dof_values.remove(dof.index('X({0})'.format(cond.species)))
 
-    dof.append('GM')
-
     if len(marked_dof_values) == 1:
         dof_values[marked_dof_values[0]] = 1-sum(dof_values)
     else:
         logger.error('Not enough composition conditions specified')
         raise ValueError('Not enough composition conditions specified.')
+    return dof, dof_values
+
+def lower_convex_hull(data, comps, conditions):
+    """
+    Find the simplex on the lower convex hull satisfying the specified
+    conditions.
+
+    Parameters
+    ----------
+    data : DataFrame
+        A sample of the energy surface of the system.
+    comps : list
+        All the components in the system.
+    conditions : dict
+        StateVariables and their corresponding value.
 
+    Returns
+    -------
+    A tuple containing:
+    (1) A numpy array of indices corresponding to vertices of the simplex.
+    (2) A numpy array corresponding to the phase fractions.
+    (3) A numpy array of chemical potentials in sorted(comps) order (no 'VA')
+    Note: This routine will not check if the simplex is degenerate.
+
+    Examples
+    --------
+    None yet.
+
+    See Also
+    --------
+    lower_convex_hull_arrays : The same calculation on plain arrays.
+    """
+    # determine column indices for degrees of freedom
+    dof, dof_values = composition_target(comps, conditions)
     # convert DataFrame of independent columns to ndarray
-    dat = data[dof].values
-    temperature = data.at[0, 'T']
+    return lower_convex_hull_arrays(data[dof].values, data['GM'].values,
+                                    dof_values, data.at[0, 'T'])
+
+def lower_convex_hull_arrays(compositions, energies, dof_values, temperature):
+    """
+    Find the simplex on the lower convex hull satisfying the specified
+    conditions. This is the array-based equivalent of lower_convex_hull().
+
+    Parameters
+    ----------
+    compositions : ndarray
+        Mole fractions of every component (no 'VA') for each sampled point,
+        one row per point.
+    energies : ndarray
+        Molar Gibbs energy of each sampled point.
+    dof_values : ndarray
+        Target overall mole fractions, in the same order as the columns
+        of `compositions`.
+    temperature : float
+        Temperature of the energy surface.
+
+    Returns
+    -------
+    Same as lower_convex_hull().
+    """
+    dof_values = np.asarray(dof_values, dtype=np.float64)
+    dat = np.empty((compositions.shape[0], compositions.shape[1]+1))
+    dat[:, :-1] = compositions
+    dat[:, -1] = energies
+    # Number of columns, including energy
+    num_columns = dat.shape[1]
 
     # Build a fictitious hyperplane which has an energy greater than the max
     # energy in the system
@@ -72,15 +224,15 @@ def lower_convex_hull(data, comps, conditions):
         energy_ceiling *= 0.1
     else:
         energy_ceiling *= 10
-    start_matrix = np.empty([len(dof)-1, len(dof)])
-    start_matrix[:, :-1] = np.eye(len(dof)-1)
+    start_matrix = np.empty([num_columns-1, num_columns])
+    start_matrix[:, :-1] = np.eye(num_columns-1)
     start_matrix[:, -1] = energy_ceiling # set energy
     dat = np.concatenate([start_matrix, dat])
 
     max_iterations = min(100, dat.shape[0])
     # Need to choose a feasible starting point
     # initialize simplex as first n points of fictitious hyperplane
-    candidate_simplex = np.array(range(len(dof)-1), dtype=np.int)
+    candidate_simplex = np.array(range(num_columns-1), dtype=np.int)
     # Calculate chemical potentials
     candidate_potentials = np.linalg.solve(dat[candidate_simplex, :-1],
                                            dat[candidate_simplex, -1])
@@ -146,7 +298,7 @@ def lower_convex_hull(data, comps, conditions):
                         #logger.debug('driving_forces: %s', driving_forces)
                         point_mask = driving_forces/(8.3145*temperature) < 1e-4
                         # Don't test points on the fictitious hyperplane
-                        point_mask[list(range(len(dof)-1))] = True
+                        point_mask[list(range(num_columns-1))] = True
                         found_point = True
                         break
                     #else:
@@ -167,7 +319,7 @@ def lower_convex_hull(data, comps, conditions):
             logger.debug('Unadjusted candidate_simplex: %s', candidate_simplex)
             logger.debug(dat[candidate_simplex])
             # Fix candidate simplex indices to remove fictitious points
-            candidate_simplex = candidate_simplex - (len(dof)-1)
+            candidate_simplex = candidate_simplex - (num_columns-1)
             logger.debug('Adjusted candidate_simplex: %s', candidate_simplex)
             # Remove fictitious points from the candidate simplex
             # These can inadvertently show up if we only calculate a phase with
@@ -192,3 +344,106 @@ def lower_convex_hull(data, comps, conditions):
     logger.debug('Positive driving force still exists for these points')
     logger.debug(np.where(driving_forces/(8.3145*temperature) > 1e-4)[0])
     return None, None, None
+
+def binary_tie_lines(compositions, energies, phase_codes, mindist=0.03):
+    """
+    Find the tie-lines on the lower convex hull of a sampled binary energy
+    surface at a single temperature. All facets of the hull are classified
+    at once.
+
+    Parameters
+    ----------
+    compositions : ndarray
+        Mole fraction of the x-axis component of each sampled point.
+    energies : ndarray
+        Molar Gibbs energy of each sampled point.
+    phase_codes : ndarray of int
+        Integer code identifying the phase of each sampled point.
+    mindist : float, optional
+        Facets between points of the same phase are only considered
+        miscibility gaps if their endpoints are at least this far apart.
+
+    Returns
+    -------
+    ndarray of int with shape (N, 2), indices of the endpoints of each
+    tie-line, ordered by composition.
+
+    Examples
+    --------
+    None yet.
+    """
+    points = np.column_stack((compositions, energies))
+    hull = scipy.spatial.ConvexHull(points, qhull_options='QJ')
+    # Facets oriented 'upwards' in the energy direction are not part of
+    # the lower hull
+    simplices = hull.simplices[hull.equations[:, -2] < -1e-6]
+    first, second = simplices[:, 0], simplices[:, 1]
+    distance = np.abs(compositions[first] - compositions[second])
+    # Different phases form a two-phase region; distant points of the same
+    # phase form a miscibility gap
+    simplices = simplices[(phase_codes[first] != phase_codes[second]) | \
+        (distance >= mindist)]
+    swap = compositions[simplices[:, 0]] > compositions[simplices[:, 1]]
+    simplices[swap] = simplices[swap, ::-1]
+    return simplices
+
+def ternary_tie_simplices(compositions, energies, phase_codes, mindist=0.05):
+    """
+    Find the tie-lines and tie-triangles on the lower convex hull of a
+    sampled ternary energy surface at a single temperature. All facets of
+    the hull are classified at once.
+
+    Parameters
+    ----------
+    compositions : ndarray
+        Mole fractions of the two plotted components for each sampled
+        point, one row per point.
+    energies : ndarray
+        Molar Gibbs energy of each sampled point.
+    phase_codes : ndarray of int
+        Integer code identifying the phase of each sampled point.
+    mindist : float, optional
+        Facet edges between points of the same phase shorter than this are
+        considered to lie within a single-phase region.
+
+    Returns
+    -------
+    A tuple containing:
+    (1) ndarray of int with shape (N, 2), indices of the endpoints of each
+        two-phase tie-line.
+    (2) ndarray of int with shape (M, 3), indices of the vertices of each
+        three-phase tie-triangle.
+
+    Examples
+    --------
+    None yet.
+    """
+    compositions = np.asarray(compositions, dtype=np.float64)
+    energies = np.asarray(energies, dtype=np.float64)
+    hull = scipy.spatial.ConvexHull(np.column_stack((compositions, energies)))
+    # Facets oriented 'upwards' in the energy direction are not part of
+    # the lower hull
+    simplices = hull.simplices[hull.equations[:, -2] < -1e-5]
+    # Edges of every facet, with shape (facets, 3 edges, 2 vertices)
+    edge_vertices = np.array([[0, 1], [0, 2], [1, 2]])
+    edges = simplices[:, edge_vertices]
+    distances = np.sqrt(np.sum((compositions[edges[:, :, 0]] - \
+        compositions[edges[:, :, 1]])**2, axis=-1))
+    # An edge is a tie-line if it is long enough or joins different phases
+    tie_edges = (distances >= mindist) | \
+        (phase_codes[edges[:, :, 0]] != phase_codes[edges[:, :, 1]])
+    num_tie_edges = np.sum(tie_edges, axis=1)
+    tie_triangles = simplices[num_tie_edges == 3]
+
+    # Two-phase facets have one short edge within a single phase. The tie-line
+    # joins the opposite vertex to the lower-energy vertex of that edge,
+    # which is more likely to be on the true tie-line since nearby metastable
+    # points are higher in energy.
+    two_phase = num_tie_edges == 2
+    short_edge = np.argmin(distances[two_phase], axis=1)
+    rows = np.arange(len(short_edge))
+    short_vertices = edges[two_phase][rows, short_edge]
+    opposite = simplices[two_phase][rows, 2 - short_edge]
+    lowest = np.argmin(energies[short_vertices], axis=1)
+    tie_lines = np.column_stack((opposite, short_vertices[rows, lowest]))
+    return tie_lines, tie_triangles
@@ -0,0 +1,299 @@
+"""
+The magnetic module evaluates the Inden-Hillert-Jarl magnetic contribution
+to the energy of a phase, and its first and second derivatives, numerically.
+
+Symbolically, the contribution nests Piecewise expressions for the mean
+magnetic moment, the Curie temperature and tau, and polynomials in tau up
+to tau**-25, all of which are evaluated for every branch once compiled.
+Here only the Redlich-Kister sums of BMAGN and TC, and their derivatives,
+are compiled; the rest of the term and the chain rule are evaluated with
+array operations, one branch per point.
+"""
+
+from __future__ import division
+import numpy as np
+import pycalphad.variables as v
+from pycalphad.eq.utils import make_callable
+
+def _ihj_function(tau, structure_factor):
+    """
+    Return the IHJ function g(tau) and its first and second derivatives
+    for the given structure factor p.
+    """
+    p = structure_factor
+    A = 518/1125 + (11692/15975)*(1/p - 1)
+    a = 79/(140*p)
+    b = (474/497)*(1/p - 1)
+    below = tau < 1
+    # Evaluate each branch only where it applies
+    sub_tau = np.where(below, tau, 1)
+    super_tau = np.where(below, 1, tau)
+    value = np.where(below,
+                     1 - (1/A) * (a / sub_tau + b * (sub_tau**3/6 + \
+                        sub_tau**9/135 + sub_tau**15/600)),
+                     -(1/A) * (super_tau**-5/10 + super_tau**-15/315 + \
+                        super_tau**-25/1500))
+    first = np.where(below,
+                     -(1/A) * (-a / sub_tau**2 + b * (sub_tau**2/2 + \
+                        sub_tau**8/15 + sub_tau**14/40)),
+                     -(1/A) * (-super_tau**-6/2 - super_tau**-16/21 - \
+                        super_tau**-26/60))
+    second = np.where(below,
+                      -(1/A) * (2 * a / sub_tau**3 + b * (sub_tau + \
+                        8 * sub_tau**7/15 + 7 * sub_tau**13/20)),
+                      -(1/A) * (3 * super_tau**-7 + 16 * super_tau**-17/21 + \
+                        13 * super_tau**-27/30))
+    return value, first, second
+
+class MagneticEnergy(object):
+    """
+    Numeric evaluator of the IHJ magnetic contribution of a Model, with
+    the same arguments as the callable returned by
+    make_callable(model.magnetic_terms['energy'], variables).
+
+    Values and derivatives at the most recent points are cached, so that
+    calling the evaluator, gradient() and hessian() in turn at the same
+    points computes the shared quantities once.
+
+    Parameters
+    ----------
+    model : Model
+        Model of the phase, with 'magnetic_terms' set.
+    variables : list
+        Input arguments, including temperature.
+    mode : string, optional
+        See 'make_callable' docstring for details.
+
+    Examples
+    --------
+    >>> magnetic = MagneticEnergy(mod, [v.T] + sitefracs)
+    >>> magnetic(1000, *sitefrac_values), magnetic.hessian(1000, *sitefrac_values)
+    """
+    def __init__(self, model, variables, mode=None):
+        if model.magnetic_terms is None:
+            raise ValueError('Model has no magnetic contribution')
+        terms = model.magnetic_terms
+        self.variables = list(variables)
+        if v.T not in self.variables:
+            raise ValueError('Temperature must be one of the variables')
+        self._temperature_index = self.variables.index(v.T)
+        self.afm_factor = float(terms['afm_factor'])
+        self.structure_factor = float(terms['structure_factor'])
+        self._callables = []
+        for key in ('mean_magnetic_moment', 'curie_temperature',
+                    'normalization'):
+            expr = terms[key]
+            gradient = [expr.diff(var) for var in self.variables]
+            hessian = [diff.diff(var) for diff in gradient \
+                for var in self.variables]
+            self._callables.append(
+                make_callable([expr] + gradient + hessian, self.variables,
+                              mode=mode))
+        self._cache = None
+
+    def _derivatives(self, idx, args, shape):
+        """
+        Return the value, gradient and Hessian of one of the compiled
+        expressions, with the points along the last axis.
+        """
+        num_vars = len(self.variables)
+        values = [np.broadcast_to(np.asarray(x, dtype=np.float64),
+                                  shape).ravel() \
+            for x in self._callables[idx](*args)]
+        values = np.array(values)
+        return values[0], values[1:num_vars+1], \
+            values[num_vars+1:].reshape((num_vars, num_vars, -1))
+
+    def _evaluate(self, args, order):
+        """
+        Return the energy, and up to 'order' derivatives, at the points.
+        """
+        args = [np.asarray(arg, dtype=np.float64) for arg in args]
+        if self._cache is not None and self._cache[1] >= order and \
+            len(args) == len(self._cache[0]) and \
+            all(np.array_equal(arg, cached) \
+                for arg, cached in zip(args, self._cache[0])):
+            return self._cache[2]
+        shape = np.broadcast(*args).shape
+        temperature = np.broadcast_to(args[self._temperature_index],
+                                      shape).ravel()
+        moment, moment_grad, moment_hess = self._derivatives(0, args, shape)
+        curie, curie_grad, curie_hess = self._derivatives(1, args, shape)
+        norm, norm_grad, norm_hess = self._derivatives(2, args, shape)
+        # Antiferromagnetic values are divided by the AFM factor
+        moment_scale = np.where(moment > 0, 1, 1/self.afm_factor)
+        curie_scale = np.where(curie > 0, 1, 1/self.afm_factor)
+        beta = moment * moment_scale
+        tc = curie * curie_scale
+        ordered = tc > 0
+        safe_tc = np.where(ordered, tc, 1)
+        # tau is 'infinity' at zero Curie temperature
+        tau = np.where(ordered, temperature / safe_tc, 10000.)
+        g_value, g_first, g_second = _ihj_function(tau,
+                                                   self.structure_factor)
+        # Energy is R * T * log(beta+1) * g(tau) / norm
+        factors = [temperature, np.log(beta + 1), g_value, 1 / norm]
+        energy = float(v.R) * np.prod(factors, axis=0)
+        result = [energy.reshape(shape)]
+        if order > 0:
+            num_vars = len(self.variables)
+            unit = np.zeros((num_vars, 1))
+            unit[self._temperature_index] = 1
+            beta_grad = moment_scale * moment_grad
+            tc_grad = curie_scale * curie_grad
+            tau_grad = np.where(ordered, (unit - tau * tc_grad) / safe_tc, 0)
+            grads = [np.broadcast_to(unit, moment_grad.shape),
+                     beta_grad / (beta + 1),
+                     g_first * tau_grad,
+                     -norm_grad / norm**2]
+            gradient = sum(float(v.R) * grads[i] * \
+                np.prod([factors[j] for j in range(4) if j != i], axis=0) \
+                for i in range(4))
+            result.append(gradient.reshape((num_vars,) + shape))
+        if order > 1:
+            def _outer(first, second):
+                "Outer product of two gradients at every point."
+                return first[:, None] * second[None, :]
+            beta_hess = moment_scale * moment_hess
+            tc_hess = curie_scale * curie_hess
+            tau_hess = np.where(ordered,
+                                -(_outer(unit, tc_grad) + \
+                                  _outer(tc_grad, unit)) / safe_tc**2 + \
+                                2 * temperature * _outer(tc_grad, tc_grad) / \
+                                safe_tc**3 - \
+                                temperature * tc_hess / safe_tc**2, 0)
+            hessians = [np.zeros_like(moment_hess),
+                        beta_hess / (beta + 1) - \
+                            _outer(beta_grad, beta_grad) / (beta + 1)**2,
+                        g_second * _outer(tau_grad, tau_grad) + \
+                            g_first * tau_hess,
+                        2 * _outer(norm_grad, norm_grad) / norm**3 - \
+                            norm_hess / norm**2]
+            hessian = np.zeros_like(moment_hess)
+            for i in range(4):
+                others = [j for j in range(4) if j != i]
+                hessian += hessians[i] * \
+                    np.prod([factors[j] for j in others], axis=0)
+                for j in others:
+                    hessian += _outer(grads[i], grads[j]) * \
+                        np.prod([factors[k] for k in others if k != j],
+                                axis=0)
+            result.append(float(v.R) * \
+                hessian.reshape((num_vars, num_vars) + shape))
+        self._cache = (args, order, result)
+        return result
+
+    def __call__(self, *args):
+        "Evaluate the energy."
+        return self._evaluate(args, 0)[0]
+
+    def gradient(self, *args):
+        """
+        Evaluate the gradient of the energy with respect to every
+        variable, as an ndarray with one row per variable.
+        """
+        return self._evaluate(args, 1)[1]
+
+    def hessian(self, *args):
+        """
+        Evaluate the Hessian of the energy with respect to every
+        variable, as an ndarray of shape (variables, variables, ...).
+        """
+        return self._evaluate(args, 2)[2]
+
+def energy_callable(model, variables, mode=None):
+    """
+    Return a callable of the energy of the Model, like
+    make_callable(model.ast, variables), which evaluates the magnetic
+    contribution, if any, with MagneticEnergy. Models with
+    'ordering_terms' or 'excess_terms' are compiled from 'ast' as a whole
+    (see pycalphad.eq.redlich_kister.excess_callables for the latter).
+
+    Parameters
+    ----------
+    model : Model
+        Model of the phase.
+    variables : list
+        Input arguments, including temperature.
+    mode : string, optional
+        See 'make_callable' docstring for details.
+
+    Returns
+    -------
+    Function that takes arguments in the same order as 'variables'.
+    """
+    if model.magnetic_terms is None or model.ordering_terms is not None or \
+        model.excess_terms is not None:
+        return make_callable(model.ast, variables, mode=mode)
+    remainder = make_callable(model.magnetic_terms['remainder'], variables,
+                              mode=mode)
+    magnetic = MagneticEnergy(model, variables, mode=mode)
+    return lambda *args: remainder(*args) + magnetic(*args)
+
+def energy_callables(model, variables, wrt=None, hessian=False, mode=None):
+    """
+    Return callables of the energy of the Model, of its gradient and,
+    optionally, of its Hessian with respect to some of the variables.
+    The magnetic contribution, if any, is evaluated by one MagneticEnergy,
+    so that the three callables share its cached values at a point.
+    Models with 'ordering_terms' or 'excess_terms' are compiled from 'ast'
+    as a whole (see pycalphad.eq.redlich_kister.excess_callables for the
+    latter).
+
+    Parameters
+    ----------
+    model : Model
+        Model of the phase.
+    variables : list
+        Input arguments, including temperature.
+    wrt : list, optional
+        Variables to differentiate with respect to. Defaults to all of
+        'variables'.
+    hessian : bool, optional
+        If True, also return a callable of the Hessian.
+    mode : string, optional
+        See 'make_callable' docstring for details.
+
+    Returns
+    -------
+    A tuple containing:
+    (1) Function of the energy
+    (2) Function of the gradient, an ndarray with one row per variable
+        of 'wrt'
+    (3) Function of the Hessian, or None if 'hessian' is False
+    All take arguments in the same order as 'variables'.
+    """
+    variables = list(variables)
+    wrt = variables if wrt is None else list(wrt)
+    numeric = model.magnetic_terms is not None and \
+        model.ordering_terms is None and model.excess_terms is None
+    if not numeric:
+        energy = model.ast
+    else:
+        energy = model.magnetic_terms['remainder']
+    gradient = [energy.diff(var) for var in wrt]
+    energy_func = make_callable(energy, variables, mode=mode)
+    gradient_func = make_callable(gradient, variables, mode=mode)
+    hessian_func = None
+    if hessian:
+        hessian_func = make_callable([[diff.diff(var) for var in wrt] \
+            for diff in gradient], variables, mode=mode)
+    if not numeric:
+        return energy_func, \
+            lambda *args: np.asarray(gradient_func(*args), dtype=np.float64), \
+            None if hessian_func is None else \
+            lambda *args: np.asarray(hessian_func(*args), dtype=np.float64)
+    magnetic = MagneticEnergy(model, variables, mode=mode)
+    rows = [variables.index(var) for var in wrt]
+    def _energy(*args):
+        "Energy with the numeric magnetic contribution."
+        return energy_func(*args) + magnetic(*args)
+    def _gradient(*args):
+        "Gradient with the numeric magnetic contribution."
+        return np.asarray(gradient_func(*args), dtype=np.float64) + \
+            magnetic.gradient(*args)[rows]
+    def _hessian(*args):
+        "Hessian with the numeric magnetic contribution."
+        return np.asarray(hessian_func(*args), dtype=np.float64) + \
+            magnetic.hessian(*args)[rows][:, rows]
+    return _energy, _gradient, _hessian if hessian else None
@@ -0,0 +1,233 @@
+"""
+The newton module contains a Gibbs energy minimizer which exploits the
+structure of the equilibrium problem.
+
+The variables are grouped into composition sets, each holding one phase
+fraction followed by the site fractions of that phase. The Hessian of the
+Lagrangian is then block-diagonal, with one block per composition set, and
+the constraints are a sparse set of linear balances (phase fractions,
+site fractions per sublattice) plus the mass balances. Non-negativity of
+all variables is handled with a logarithmic barrier, and each Newton step
+solves the sparse KKT system with a sparse LU factorization.
+"""
+
+from __future__ import division
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from scipy.optimize import OptimizeResult
+from pycalphad.log import logger
+
+def _composition_set_blocks(input_x, composition_sets, multipliers,
+                            molefrac_rows, scale):
+    """
+    Evaluate the objective, its gradient, the mass balances, their Jacobian
+    and the Hessian blocks of the Lagrangian at input_x.
+    """
+    num_vars = len(input_x)
+    objective = 0.0
+    gradient = np.zeros(num_vars)
+    molefracs = np.zeros(len(molefrac_rows))
+    molefrac_jac = np.zeros((len(molefrac_rows), num_vars))
+    hessian_blocks = []
+    for comp_set in composition_sets:
+        fidx = comp_set['phasefrac_index']
+        yslice = comp_set['sitefrac_slice']
+        phase_frac = input_x[fidx]
+        site_fracs = input_x[yslice]
+        energy = comp_set['energy'](*site_fracs) / scale
+        energy_grad = np.asarray(comp_set['gradient'](*site_fracs),
+                                 dtype=np.float64) / scale
+        energy_hess = np.asarray(comp_set['hessian'](*site_fracs),
+                                 dtype=np.float64) / scale
+        objective += phase_frac * energy
+        gradient[fidx] = energy
+        gradient[yslice] = phase_frac * energy_grad
+
+        # Block ordering: phase fraction first, then site fractions
+        block = np.zeros((len(site_fracs)+1, len(site_fracs)+1))
+        block[0, 1:] = energy_grad
+        block[1:, 0] = energy_grad
+        block[1:, 1:] = phase_frac * energy_hess
+        if len(molefrac_rows) > 0:
+            comp_x = np.asarray(comp_set['molefracs'](*site_fracs),
+                                dtype=np.float64)[molefrac_rows]
+            comp_jac = np.asarray(comp_set['molefrac_jac'](*site_fracs),
+                                  dtype=np.float64)[molefrac_rows]
+            molefracs += phase_frac * comp_x
+            molefrac_jac[:, fidx] = comp_x
+            molefrac_jac[:, yslice] = phase_frac * comp_jac
+            # Curvature of the mass balances, weighted by their multipliers
+            weighted_jac = np.dot(multipliers, comp_jac)
+            block[0, 1:] += weighted_jac
+            block[1:, 0] += weighted_jac
+            if comp_set.get('molefrac_hess') is not None:
+                comp_hess = np.asarray(comp_set['molefrac_hess'](*site_fracs),
+                                       dtype=np.float64)[molefrac_rows]
+                block[1:, 1:] += phase_frac * \
+                    np.tensordot(multipliers, comp_hess, axes=1)
+        hessian_blocks.append(block)
+    return objective, gradient, molefracs, molefrac_jac, hessian_blocks
+
+def newton_minimize(x_0, composition_sets, balance_matrix, balance_values,
+                    molefrac_rows, molefrac_values, scale=1.0,
+                    tol=1e-9, max_iterations=300):
+    """
+    Minimize the total Gibbs energy of a set of composition sets with a
+    primal barrier Newton method on the sparse KKT system.
+
+    Parameters
+    ----------
+    x_0 : ndarray
+        Starting point. Each composition set's phase fraction must directly
+        precede its site fractions.
+    composition_sets : list of dict
+        One dict per composition set with keys 'phasefrac_index' (int),
+        'sitefrac_slice' (slice), and callables of the site fractions:
+        'energy', 'gradient', 'hessian', 'molefracs', 'molefrac_jac' and,
+        optionally, 'molefrac_hess'.
+    balance_matrix : scipy.sparse matrix
+        Linear balance constraints `A x = b` on phase and site fractions.
+    balance_values : ndarray
+        Right-hand side `b` of the linear balance constraints.
+    molefrac_rows : ndarray of int
+        Indices into the output of 'molefracs' of the conditioned species.
+    molefrac_values : ndarray
+        Target overall mole fractions of the conditioned species.
+    scale : float, optional
+        Energies are divided by this value during the solve.
+    tol : float, optional
+        Convergence tolerance on the scaled KKT residual.
+    max_iterations : int, optional
+        Maximum number of Newton iterations.
+
+    Returns
+    -------
+    OptimizeResult with attributes x, fun, success, nit, message and
+    multipliers (Lagrange multipliers of the linear balances followed by
+    those of the mass balances, in scaled units).
+
+    Examples
+    --------
+    None yet.
+    """
+    #pylint: disable=R0914
+    balance_matrix = scipy.sparse.csr_matrix(balance_matrix)
+    num_vars = len(x_0)
+    num_linear = balance_matrix.shape[0]
+    num_cons = num_linear + len(molefrac_rows)
+    # The barrier requires a strictly interior starting point
+    input_x = np.clip(np.array(x_0, dtype=np.float64), 1e-10, 1.0)
+    multipliers = np.zeros(num_cons)
+    barrier = 1e-2
+    min_barrier = tol / 10
+    # Indices of each composition set's variables, in block order
+    block_indices = np.concatenate(
+        [np.r_[comp_set['phasefrac_index'],
+               np.arange(num_vars)[comp_set['sitefrac_slice']]]
+         for comp_set in composition_sets])
+    if len(block_indices) != num_vars or \
+        np.any(block_indices != np.arange(num_vars)):
+        raise ValueError('Composition set variables must be contiguous')
+
+    def residuals(point, mu, lagrange):
+        "Objective, gradient, constraint residual and Jacobian at point."
+        objective, grad, molefracs, molefrac_jac, blocks = \
+            _composition_set_blocks(point, composition_sets,
+                                    lagrange[num_linear:], molefrac_rows,
+                                    scale)
+        cons = np.concatenate((balance_matrix.dot(point) - balance_values,
+                               molefracs - molefrac_values))
+        jac = scipy.sparse.vstack((balance_matrix,
+                                   scipy.sparse.csr_matrix(molefrac_jac)))
+        barrier_objective = objective - mu * np.sum(np.log(point))
+        barrier_grad = grad - mu / point
+        return barrier_objective, barrier_grad, cons, jac, blocks, objective
+
+    # Least-squares estimate of the multipliers at the starting point;
+    # the mass balance curvature in the Hessian depends on them
+    _, start_grad, _, start_jac, _, _ = \
+        residuals(input_x, barrier, multipliers)
+    multipliers = scipy.sparse.linalg.lsqr(start_jac.T, -start_grad,
+                                           atol=1e-12, btol=1e-12)[0]
+
+    iteration = 0
+    success = False
+    message = 'Iteration limit reached'
+    while iteration < max_iterations:
+        iteration += 1
+        barrier_obj, barrier_grad, cons, jac, blocks, objective = \
+            residuals(input_x, barrier, multipliers)
+        stationarity = barrier_grad + jac.T.dot(multipliers)
+        kkt_error = max(np.max(np.abs(stationarity)), np.max(np.abs(cons)))
+        if kkt_error < max(tol, 10 * barrier):
+            if barrier <= min_barrier:
+                success = True
+                message = 'Optimization terminated successfully'
+                break
+            barrier = max(barrier / 10, min_barrier)
+            continue
+        hessian = scipy.sparse.block_diag(blocks, format='csr') + \
+            scipy.sparse.diags(barrier / input_x**2)
+        rhs = np.concatenate((-barrier_grad, -cons))
+        regularization = 0.0
+        step = None
+        for _ in range(12):
+            kkt = scipy.sparse.bmat(
+                [[hessian + regularization * scipy.sparse.eye(num_vars),
+                  jac.T],
+                 [jac, -1e-12 * scipy.sparse.eye(num_cons)]], format='csc')
+            try:
+                solution = scipy.sparse.linalg.spsolve(kkt, rhs)
+            except RuntimeError:
+                solution = None
+            if solution is not None and np.all(np.isfinite(solution)):
+                # Reject directions of ascent within the constraints,
+                # measured on the component of the step tangent to them
+                direction = solution[:num_vars]
+                tangent = direction - jac.T.dot(
+                    scipy.sparse.linalg.lsqr(jac.T, direction, atol=1e-12,
+                                             btol=1e-12)[0])
+                curvature = np.dot(tangent, hessian.dot(tangent))
+                if np.max(np.abs(tangent)) < tol or \
+                    curvature >= -1e-8 * np.dot(tangent, tangent):
+                    step = solution
+                    break
+            regularization = max(1e-6, 10 * regularization)
+        if step is None:
+            message = 'Unable to solve the KKT system'
+            break
+        direction = step[:num_vars]
+        new_multipliers = step[num_vars:]
+        # Fraction-to-the-boundary rule keeps the iterate interior
+        decreasing = direction < 0
+        max_step = 1.0
+        if np.any(decreasing):
+            max_step = min(1.0, 0.995 * np.min(-input_x[decreasing] / \
+                direction[decreasing]))
+        # Backtrack on an l1 merit function
+        penalty = np.max(np.abs(new_multipliers)) + 1.0
+        merit = barrier_obj + penalty * np.sum(np.abs(cons))
+        step_size = max_step
+        for _ in range(20):
+            trial_x = input_x + step_size * direction
+            trial_obj, _, trial_cons, _, _, _ = \
+                residuals(trial_x, barrier, new_multipliers)
+            trial_merit = trial_obj + penalty * np.sum(np.abs(trial_cons))
+            if trial_merit <= merit + 1e-12 * abs(merit):
+                break
+            step_size /= 2
+        else:
+            # No step decreases the merit function; keep the last iterate
+            message = 'Line search failed'
+            break
+        input_x = trial_x
+        multipliers = multipliers + step_size * (new_multipliers - multipliers)
+        logger.debug('Newton iteration %s: objective %s, KKT error %s, '
+                     'barrier %s, step %s', iteration, objective, kkt_error,
+                     barrier, step_size)
+
+    _, _, _, _, _, objective = residuals(input_x, barrier, multipliers)
+    return OptimizeResult(x=input_x, fun=objective * scale, success=success,
+                          nit=iteration, message=message,
+                          multipliers=multipliers)
@@ -0,0 +1,176 @@
+"""
+The ordering module evaluates the energy of ordered phases described with
+a disordered contribution (Servant and Ansara, Calphad, 2001) without the
+fully substituted expression.
+
+The energy of such a phase is G(y) = F(y) + D(x(y)) - F(y_eq(y)), where F
+is the energy of the ordered phase itself, D that of the disordered phase,
+x(y) the disordered site fractions and y_eq(y) the ordered site fractions
+with all sublattices equal. Both x and y_eq are linear in y, so only F and
+D are compiled, each once, and the substitutions become matrix products.
+"""
+
+from __future__ import division
+import numpy as np
+import pycalphad.variables as v
+from pycalphad.eq.utils import make_callable
+
+def _linear_map(substitutions, targets, variables):
+    """
+    Return the matrix and offset of the linear function mapping the values
+    of 'variables' to those of 'targets', where targets present in
+    'substitutions' are replaced by their (linear) expression.
+    """
+    matrix = np.zeros((len(targets), len(variables)))
+    offset = np.zeros(len(targets))
+    zero = dict((var, 0) for var in variables)
+    for row, target in enumerate(targets):
+        expr = substitutions.get(target, target)
+        for col, var in enumerate(variables):
+            matrix[row, col] = float(getattr(expr, 'diff', lambda x: 0)(var))
+        offset[row] = float(getattr(expr, 'xreplace', lambda x: expr)(zero))
+    return matrix, offset
+
+class OrderingEnergy(object):
+    """
+    Energy of an ordered phase with a disordered contribution, evaluated
+    by composing compiled functions of the ordered and disordered parts.
+    Arguments and results are the same as those of the callable returned
+    by make_callable(model.ast, variables).
+
+    Parameters
+    ----------
+    model : Model
+        Model of the ordered phase, with 'ordering_terms' set.
+    variables : list
+        Input arguments of the callable: state variables followed by the
+        site fractions of the ordered phase.
+    mode : string, optional
+        See 'make_callable' docstring for details.
+
+    Examples
+    --------
+    >>> energy = OrderingEnergy(mod, [v.T] + sitefracs)
+    >>> energy(1000, *sitefrac_values), energy.gradient(1000, *sitefrac_values)
+    """
+    def __init__(self, model, variables, mode=None):
+        if model.ordering_terms is None:
+            raise ValueError('Model has no atomic ordering contribution')
+        terms = model.ordering_terms
+        self.variables = list(variables)
+        self._sitefrac_indices = [idx for idx, var in enumerate(variables) \
+            if isinstance(var, v.SiteFraction)]
+        sitefracs = [self.variables[idx] for idx in self._sitefrac_indices]
+        statevars = [var for var in self.variables \
+            if not isinstance(var, v.SiteFraction)]
+        disordered_vars = sorted(terms['disordered_substitutions'].keys(),
+                                 key=str)
+        self._terms = terms
+        self._mode = mode
+        self._statevars = statevars
+        self._sitefracs = sitefracs
+        self._disordered_vars = disordered_vars
+        # Derivatives are compiled on first use, by order
+        self._derivatives = dict()
+        self._disordered_map = _linear_map(terms['disordered_substitutions'],
+                                           disordered_vars, sitefracs)
+        self._equal_map = _linear_map(terms['equal_substitutions'],
+                                      sitefracs, sitefracs)
+        self._ordered = make_callable(terms['ordered'], self.variables,
+                                      mode=mode)
+        self._disordered = make_callable(terms['disordered'],
+                                         statevars + disordered_vars,
+                                         mode=mode)
+
+    def _derivative_callables(self, order):
+        """
+        Return callables of the first or second derivatives of the ordered
+        and disordered parts, compiling them on first use.
+        """
+        if order not in self._derivatives:
+            def _diffs(expr, wrt):
+                "Gradient or Hessian of expr as a (nested) list."
+                if order == 1:
+                    return [expr.diff(x) for x in wrt]
+                return [[expr.diff(x).diff(y) for y in wrt] for x in wrt]
+            self._derivatives[order] = (
+                make_callable(_diffs(self._terms['ordered'], self._sitefracs),
+                              self.variables, mode=self._mode),
+                make_callable(_diffs(self._terms['disordered'],
+                                     self._disordered_vars),
+                              self._statevars + self._disordered_vars,
+                              mode=self._mode))
+        return self._derivatives[order]
+
+    def _arguments(self, args):
+        """
+        Return the arguments of the ordered part as floats and with equal
+        sublattices, those of the disordered part, and the shape of the
+        points.
+        """
+        args = [np.asarray(arg, dtype=np.float64) for arg in args]
+        sitefracs = [args[idx] for idx in self._sitefrac_indices]
+        statevars = [arg for idx, arg in enumerate(args) \
+            if idx not in self._sitefrac_indices]
+        sitefracs = np.array(np.broadcast_arrays(*sitefracs))
+        shape = sitefracs.shape[1:]
+        sitefracs = sitefracs.reshape(len(sitefracs), -1)
+        matrix, offset = self._equal_map
+        equal = np.dot(matrix, sitefracs) + offset[:, None]
+        equal_args = list(args)
+        for row, idx in enumerate(self._sitefrac_indices):
+            equal_args[idx] = equal[row].reshape(shape)
+        matrix, offset = self._disordered_map
+        disordered = np.dot(matrix, sitefracs) + offset[:, None]
+        disordered_args = statevars + [x.reshape(shape) for x in disordered]
+        return args, equal_args, disordered_args, shape
+
+    def __call__(self, *args):
+        "Evaluate the energy."
+        args, equal_args, disordered_args, _ = self._arguments(args)
+        return self._ordered(*args) + self._disordered(*disordered_args) - \
+            self._ordered(*equal_args)
+
+    @staticmethod
+    def _stack(values, shape):
+        """
+        Convert a (nested) list of derivatives to an array of shape
+        (derivatives, ..., points).
+        """
+        if isinstance(values, (list, tuple)):
+            return np.array([OrderingEnergy._stack(x, shape) for x in values])
+        return np.broadcast_to(np.asarray(values, dtype=np.float64),
+                               shape).ravel()
+
+    def gradient(self, *args):
+        """
+        Evaluate the gradient of the energy with respect to the site
+        fractions, as an ndarray with one row per site fraction.
+        """
+        ordered_grad, disordered_grad = self._derivative_callables(1)
+        args, equal_args, disordered_args, shape = self._arguments(args)
+        result = self._stack(ordered_grad(*args), shape) + \
+            np.dot(self._disordered_map[0].T,
+                   self._stack(disordered_grad(*disordered_args), shape)) - \
+            np.dot(self._equal_map[0].T,
+                   self._stack(ordered_grad(*equal_args), shape))
+        return result.reshape(result.shape[:1] + shape)
+
+    def hessian(self, *args):
+        """
+        Evaluate the Hessian of the energy with respect to the site
+        fractions, as an ndarray of shape (site fractions, site fractions,
+        ...).
+        """
+        ordered_hess, disordered_hess = self._derivative_callables(2)
+        args, equal_args, disordered_args, shape = self._arguments(args)
+        disordered_matrix = self._disordered_map[0]
+        equal_matrix = self._equal_map[0]
+        result = self._stack(ordered_hess(*args), shape) + \
+            np.einsum('ia,ijp,jb->abp', disordered_matrix,
+                      self._stack(disordered_hess(*disordered_args), shape),
+                      disordered_matrix) - \
+            np.einsum('ia,ijp,jb->abp', equal_matrix,
+                      self._stack(ordered_hess(*equal_args), shape),
+                      equal_matrix)
+        return result.reshape(result.shape[:2] + shape)
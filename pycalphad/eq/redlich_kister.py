@@ -0,0 +1,478 @@
+"""
+The redlich_kister module evaluates the excess mixing energy of a phase,
+and its derivatives, directly from its table of interaction parameters.
+
+Every factor of a Redlich-Kister term is a power of a linear function of
+the site fractions: a site fraction itself, a sum over a wildcard
+sublattice, the difference (y_i - y_j) raised to the parameter order, or
+a Muggianu-corrected site fraction of a ternary interaction. The distinct
+linear functions of all terms are evaluated with one matrix product, and
+the terms, their sum and its gradient follow from array operations. No
+symbolic expression of the excess energy is built or compiled; only the
+temperature-dependent parameters themselves are.
+
+Models built with numeric_excess=True keep only the parameters of the
+excess energy; energy_surf and Equilibrium then evaluate it with this
+module instead of compiling it (see excess_callables).
+"""
+
+from __future__ import division
+import numpy as np
+import pycalphad.variables as v
+from pycalphad import Model
+from pycalphad.eq.utils import make_callable, generate_dof
+from pycalphad.eq.magnetic import MagneticEnergy
+
+class RedlichKister(object):
+    """
+    Numeric evaluator of the excess mixing energy of a phase, normalized
+    per mole of formula unit like Model.excess_mixing_energy().
+
+    Parameters
+    ----------
+    phase : Phase
+        Phase whose excess energy is evaluated.
+    components : set
+        Names of the active components of the phase.
+    params : list of dict
+        Interaction parameters, each with keys 'constituent_array',
+        'parameter_order' and 'parameter', the last being a SymPy
+        expression of the state variables.
+    variables : list of SiteFraction, optional
+        Order of the site fraction arguments. Defaults to the order of
+        generate_dof().
+
+    Attributes
+    ----------
+    variables : list of SiteFraction
+        Order of the site fraction arguments.
+
+    Examples
+    --------
+    >>> excess = RedlichKister.from_database(dbf, ['AL', 'NI', 'VA'], 'LIQUID')
+    >>> energies = excess.energy(site_fractions, T=1000)
+    """
+    def __init__(self, phase, components, params, variables=None):
+        self.components = set(components)
+        if variables is None:
+            variables = generate_dof(phase, self.components)[0]
+        self.variables = list(variables)
+        indices = dict((var, idx) for idx, var in enumerate(self.variables))
+        # Linear functions c + a.y, stored by their (c, a) key
+        self._forms = {}
+        self._add_form(1.0, {})
+        term_factors = []
+        for param in params:
+            factors = []
+            for subl_index, comps in enumerate(param['constituent_array']):
+                if comps[0] == '*':
+                    # Handle wildcards in constituent array
+                    active = set(phase.constituents[subl_index]) \
+                        .intersection(self.components)
+                    comp_symbols = [v.SiteFraction(phase.name, subl_index,
+                                                   comp) for comp in active]
+                    factors.append((self._add_form(0.0, dict(
+                        (indices[var], 1.0) for var in comp_symbols)), 1))
+                else:
+                    comp_symbols = [v.SiteFraction(phase.name, subl_index,
+                                                   comp) for comp in comps]
+                    factors.extend((self._add_form(0.0, {indices[var]: 1.0}),
+                                    1) for var in comp_symbols)
+                if len(comps) == 2 and param['parameter_order'] > 0:
+                    factors.append((self._add_form(0.0, {
+                        indices[comp_symbols[0]]: 1.0,
+                        indices[comp_symbols[1]]: -1.0}),
+                                    param['parameter_order']))
+                if len(comps) == 3:
+                    # Muggianu: y_k + (1 - y_i - y_j - y_k) / 3
+                    coefs = dict((indices[var], -1/3) for var in comp_symbols)
+                    coefs[indices[comp_symbols[param['parameter_order']]]] += 1
+                    factors.append((self._add_form(1/3, coefs), 1))
+                if len(comps) > 3:
+                    raise ValueError('Higher-order interactions (n>3) are '
+                                     'not yet supported')
+            term_factors.append(factors)
+        num_factors = max([len(factors) for factors in term_factors] + [1])
+        # Pad every term with the constant form 1 raised to the power zero
+        self._term_forms = np.zeros((len(params), num_factors), dtype=int)
+        self._term_powers = np.zeros((len(params), num_factors))
+        for term_idx, factors in enumerate(term_factors):
+            for factor_idx, (form, power) in enumerate(factors):
+                self._term_forms[term_idx, factor_idx] = form
+                self._term_powers[term_idx, factor_idx] = power
+        # Selects the linear function of each factor of each term
+        self._form_selector = np.zeros((self._term_forms.size,
+                                        len(self._forms)))
+        self._form_selector[np.arange(self._term_forms.size),
+                            self._term_forms.ravel()] = 1
+        self._form_constants = np.zeros(len(self._forms))
+        self._form_matrix = np.zeros((len(self._forms), len(self.variables)))
+        for (constant, coefs), form in self._forms.items():
+            self._form_constants[form] = constant
+            for var_idx, coef in coefs:
+                self._form_matrix[form, var_idx] = coef
+        # Site ratio normalization: constant plus linear vacancy terms
+        self._norm_constant = 0.0
+        self._norm_vector = np.zeros(len(self.variables))
+        for subl_index, sublattice in enumerate(phase.constituents):
+            self._norm_constant += phase.sublattices[subl_index]
+            if 'VA' in set(sublattice) and 'VA' in self.components:
+                self._norm_vector[indices[v.SiteFraction(phase.name,
+                                                         subl_index,
+                                                         'VA')]] = \
+                    -phase.sublattices[subl_index]
+        statevars = sorted(set().union(*[param['parameter'].free_symbols \
+            for param in params]), key=str)
+        self._statevars = [str(var) for var in statevars]
+        self._parameter_callable = make_callable(
+            [param['parameter'] for param in params], statevars)
+
+    @classmethod
+    def from_database(cls, dbe, comps, phase_name, parameters=None,
+                      variables=None):
+        """
+        Build the evaluator from the interaction parameters of a phase
+        in a Database, as Model would.
+
+        Parameters
+        ----------
+        dbe : Database
+            Database containing the relevant parameters.
+        comps : list
+            Names of components to consider in the calculation.
+        phase_name : string
+            Name of the phase.
+        parameters : dict, optional
+            Optional dictionary of parameters to be substituted in the model.
+        variables : list of SiteFraction, optional
+            Order of the site fraction arguments.
+
+        Returns
+        -------
+        RedlichKister
+        """
+        phase = dbe.phases[phase_name.upper()]
+        possible_comps = set([x.upper() for x in comps])
+        components = set()
+        for sublattice in phase.constituents:
+            components |= set(sublattice).intersection(possible_comps)
+        #pylint: disable=W0212
+        symbols = Model._database_symbols(dbe, parameters)
+        params = []
+        for param in Model._interaction_parameters(phase, components,
+                                                   dbe.search):
+            param = dict(param)
+            param['parameter'] = param['parameter'].xreplace(symbols) \
+                .xreplace(symbols)
+            params.append(param)
+        return cls(phase, components, params, variables=variables)
+
+    @classmethod
+    def from_model(cls, model, variables=None):
+        """
+        Build the evaluator from the 'excess_terms' of a Model built with
+        numeric_excess=True.
+
+        Parameters
+        ----------
+        model : Model
+            Model of the phase.
+        variables : list of SiteFraction, optional
+            Order of the site fraction arguments.
+
+        Returns
+        -------
+        RedlichKister
+        """
+        if model.excess_terms is None:
+            raise ValueError('Model has no numeric excess energy')
+        return cls(model.excess_terms['phase'], model.components,
+                   model.excess_terms['parameters'], variables=variables)
+
+    def _add_form(self, constant, coefs):
+        "Return the index of a linear function, adding it if it is new."
+        key = (constant, tuple(sorted(coefs.items())))
+        if key not in self._forms:
+            self._forms[key] = len(self._forms)
+        return self._forms[key]
+
+    def parameter_values(self, **statevars):
+        """
+        Return the values of the interaction parameters at the given state
+        variables, e.g., T=1000.
+
+        State variables are scalars, giving an ndarray of shape
+        (parameters,), or 1-D arrays with one value per point, giving an
+        ndarray of shape (points, parameters).
+        """
+        args = [np.asarray(statevars[name], dtype=np.float64) \
+            for name in self._statevars]
+        if any(arg.ndim > 1 for arg in args):
+            raise ValueError('State variables must be scalars or 1-D arrays')
+        shape = np.broadcast(*args).shape if args else ()
+        values = self._parameter_callable(*args)
+        values = np.array([np.broadcast_to(np.asarray(x, dtype=np.float64),
+                                           shape) for x in values])
+        return values.reshape((len(values),) + shape).T
+
+    def _point_parameters(self, num_points, statevars):
+        """
+        Return the values of the interaction parameters with shape
+        (points, parameters).
+        """
+        params = self.parameter_values(**statevars)
+        if params.ndim > 1 and len(params) not in (1, num_points):
+            raise ValueError('State variables have {0} values for {1} '
+                             'points'.format(len(params), num_points))
+        return np.broadcast_to(params, (num_points, params.shape[-1]))
+
+    def _terms(self, site_fractions):
+        """
+        Return the factor values (points, terms, factors), each raised to
+        its power, and the factor values themselves.
+        """
+        site_fractions = np.atleast_2d(np.asarray(site_fractions,
+                                                  dtype=np.float64))
+        forms = np.dot(site_fractions, self._form_matrix.T) + \
+            self._form_constants
+        factors = forms[:, self._term_forms]
+        return factors ** self._term_powers, factors
+
+    def energy(self, site_fractions, **statevars):
+        """
+        Evaluate the excess mixing energy.
+
+        Parameters
+        ----------
+        site_fractions : array_like
+            Site fractions with shape (points, variables).
+        Keyword arguments give the values of the state variables, e.g.,
+        T=1000, as scalars or with one value per point.
+
+        Returns
+        -------
+        ndarray of shape (points,)
+        """
+        site_fractions = np.atleast_2d(np.asarray(site_fractions,
+                                                  dtype=np.float64))
+        powered, _ = self._terms(site_fractions)
+        params = self._point_parameters(len(site_fractions), statevars)
+        numerator = np.sum(np.prod(powered, axis=2) * params, axis=1)
+        return numerator / (self._norm_constant + \
+            np.dot(site_fractions, self._norm_vector))
+
+    def gradient(self, site_fractions, **statevars):
+        """
+        Evaluate the gradient of the excess mixing energy with respect to
+        the site fractions.
+
+        Parameters
+        ----------
+        site_fractions : array_like
+            Site fractions with shape (points, variables).
+        Keyword arguments give the values of the state variables, e.g.,
+        T=1000, as scalars or with one value per point.
+
+        Returns
+        -------
+        ndarray of shape (points, variables)
+        """
+        site_fractions = np.atleast_2d(np.asarray(site_fractions,
+                                                  dtype=np.float64))
+        numerator, numerator_grad, _ = \
+            self._numerator(site_fractions, statevars, 1)
+        norm = self._norm_constant + np.dot(site_fractions, self._norm_vector)
+        return numerator_grad / norm[:, None] - \
+            (numerator / norm ** 2)[:, None] * self._norm_vector
+
+    def hessian(self, site_fractions, **statevars):
+        """
+        Evaluate the Hessian of the excess mixing energy with respect to
+        the site fractions.
+
+        Parameters
+        ----------
+        site_fractions : array_like
+            Site fractions with shape (points, variables).
+        Keyword arguments give the values of the state variables, e.g.,
+        T=1000, as scalars or with one value per point.
+
+        Returns
+        -------
+        ndarray of shape (points, variables, variables)
+        """
+        site_fractions = np.atleast_2d(np.asarray(site_fractions,
+                                                  dtype=np.float64))
+        numerator, numerator_grad, numerator_hess = \
+            self._numerator(site_fractions, statevars, 2)
+        norm = self._norm_constant + np.dot(site_fractions, self._norm_vector)
+        # Second derivative of numerator / norm, with norm linear
+        cross = numerator_grad[:, :, None] * self._norm_vector + \
+            self._norm_vector[:, None] * numerator_grad[:, None, :]
+        return numerator_hess / norm[:, None, None] - \
+            cross / (norm ** 2)[:, None, None] + \
+            (2 * numerator / norm ** 3)[:, None, None] * \
+            np.outer(self._norm_vector, self._norm_vector)
+
+    def _numerator(self, site_fractions, statevars, order):
+        """
+        Return the sum of the terms, i.e., the excess energy before site
+        ratio normalization, its gradient and, if 'order' is 2, its
+        Hessian (otherwise None).
+        """
+        powered, factors = self._terms(site_fractions)
+        params = self._point_parameters(len(site_fractions), statevars)
+        numerator = np.sum(np.prod(powered, axis=2) * params, axis=1)
+        # Product of all other factors of a term, without dividing by zero
+        before = np.cumprod(np.concatenate(
+            (np.ones_like(powered[:, :, :1]), powered[:, :, :-1]), axis=2),
+                            axis=2)
+        after = np.cumprod(np.concatenate(
+            (np.ones_like(powered[:, :, :1]), powered[:, :, :0:-1]), axis=2),
+                           axis=2)[:, :, ::-1]
+        nonzero_power = self._term_powers > 0
+        factor_derivs = np.where(nonzero_power, self._term_powers * \
+            factors ** np.where(nonzero_power, self._term_powers - 1, 0), 0)
+        weights = factor_derivs * before * after * params[:, :, None]
+        # Accumulate the derivatives with respect to each linear function
+        form_grad = np.dot(weights.reshape(len(site_fractions), -1),
+                           self._form_selector)
+        numerator_grad = np.dot(form_grad, self._form_matrix)
+        if order < 2:
+            return numerator, numerator_grad, None
+        num_factors = powered.shape[2]
+        factor_second = np.where(self._term_powers > 1, self._term_powers * \
+            (self._term_powers - 1) * factors ** \
+            np.where(self._term_powers > 1, self._term_powers - 2, 0), 0)
+        num_forms = len(self._forms)
+        form_hess = np.zeros((len(site_fractions), num_forms, num_forms))
+        for first in range(num_factors):
+            first_forms = np.eye(num_forms)[self._term_forms[:, first]]
+            for second in range(num_factors):
+                # Product of the factors other than 'first' and 'second'
+                others = np.ones(num_factors, dtype=bool)
+                others[[first, second]] = False
+                weight = np.prod(powered[:, :, others], axis=2) * params
+                if first == second:
+                    weight *= factor_second[:, :, first]
+                else:
+                    weight *= factor_derivs[:, :, first] * \
+                        factor_derivs[:, :, second]
+                second_forms = np.eye(num_forms)[self._term_forms[:, second]]
+                form_hess += np.einsum('pt,ti,tj->pij', weight, first_forms,
+                                       second_forms)
+        numerator_hess = np.einsum('ai,pab,bj->pij', self._form_matrix,
+                                   form_hess, self._form_matrix)
+        return numerator, numerator_grad, numerator_hess
+
+def excess_callables(model, variables, wrt=None, hessian=False,
+                     numeric_magnetic=False, mode=None):
+    """
+    Return callables of the energy of a Model built with
+    numeric_excess=True, of its gradient and, optionally, of its Hessian
+    with respect to some of the site fractions. The excess energy is
+    evaluated with RedlichKister and only the rest of the energy is
+    compiled.
+
+    Parameters
+    ----------
+    model : Model
+        Model of the phase, with 'excess_terms' set.
+    variables : list
+        Input arguments: state variables and the site fractions of the
+        phase.
+    wrt : list of SiteFraction, optional
+        Variables to differentiate with respect to. Defaults to all site
+        fractions of 'variables'.
+    hessian : bool, optional
+        If True, also return a callable of the Hessian.
+    numeric_magnetic : bool, optional
+        If True, also evaluate the magnetic contribution, if any, with
+        MagneticEnergy.
+    mode : string, optional
+        See 'make_callable' docstring for details.
+
+    Returns
+    -------
+    A tuple containing:
+    (1) Function of the energy
+    (2) Function of the gradient, an ndarray with one row per variable
+        of 'wrt'
+    (3) Function of the Hessian, or None if 'hessian' is False
+    All take arguments in the same order as 'variables'.
+    """
+    variables = list(variables)
+    sitefrac_indices = [idx for idx, var in enumerate(variables) \
+        if isinstance(var, v.SiteFraction)]
+    sitefracs = [variables[idx] for idx in sitefrac_indices]
+    statevar_names = dict((idx, str(var)) for idx, var in enumerate(variables) \
+        if idx not in sitefrac_indices)
+    wrt = sitefracs if wrt is None else list(wrt)
+    if any(var not in sitefracs for var in wrt):
+        raise ValueError('Only site fractions can be differentiated')
+    excess = RedlichKister.from_model(model, sitefracs)
+    columns = [sitefracs.index(var) for var in wrt]
+    magnetic = None
+    if numeric_magnetic and model.magnetic_terms is not None:
+        # The remainder of the magnetic terms also excludes the excess
+        remainder = model.magnetic_terms['remainder']
+        magnetic = MagneticEnergy(model, variables, mode=mode)
+        rows = [variables.index(var) for var in wrt]
+    else:
+        remainder = model.excess_terms['remainder']
+    gradient = [remainder.diff(var) for var in wrt]
+    energy_func = make_callable(remainder, variables, mode=mode)
+    gradient_func = make_callable(gradient, variables, mode=mode)
+    hessian_func = None
+    if hessian:
+        hessian_func = make_callable([[diff.diff(var) for var in wrt] \
+            for diff in gradient], variables, mode=mode)
+
+    def _excess_arguments(args):
+        """
+        Return the site fractions with shape (points, variables), the state
+        variables by name and the shape of the points.
+        """
+        args = np.broadcast_arrays(*[np.asarray(arg, dtype=np.float64) \
+            for arg in args])
+        shape = args[0].shape if args else ()
+        site_fractions = np.array([args[idx].ravel() \
+            for idx in sitefrac_indices]).T
+        statevars = dict((name, args[idx].ravel()) \
+            for idx, name in statevar_names.items())
+        return site_fractions, statevars, shape
+    def _stack(values, shape):
+        "Convert a (nested) list of derivatives to an array."
+        if isinstance(values, (list, tuple)):
+            return np.array([_stack(x, shape) for x in values])
+        return np.broadcast_to(np.asarray(values, dtype=np.float64), shape)
+
+    def _energy(*args):
+        "Energy with the numeric excess contribution."
+        site_fractions, statevars, shape = _excess_arguments(args)
+        result = energy_func(*args) + \
+            excess.energy(site_fractions, **statevars).reshape(shape)
+        if magnetic is not None:
+            result = result + magnetic(*args)
+        return result
+    def _gradient(*args):
+        "Gradient with the numeric excess contribution."
+        site_fractions, statevars, shape = _excess_arguments(args)
+        excess_grad = excess.gradient(site_fractions, **statevars)
+        result = _stack(gradient_func(*args), shape) + \
+            excess_grad.T[columns].reshape((len(columns),) + shape)
+        if magnetic is not None:
+            result = result + magnetic.gradient(*args)[rows]
+        return result
+    def _hessian(*args):
+        "Hessian with the numeric excess contribution."
+        site_fractions, statevars, shape = _excess_arguments(args)
+        excess_hess = np.transpose(excess.hessian(site_fractions,
+                                                  **statevars), (1, 2, 0))
+        result = _stack(hessian_func(*args), shape) + \
+            excess_hess[columns][:, columns].reshape(
+                (len(columns), len(columns)) + shape)
+        if magnetic is not None:
+            result = result + magnetic.hessian(*args)[rows][:, rows]
+        return result
+    return _energy, _gradient, _hessian if hessian else None
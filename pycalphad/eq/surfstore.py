@@ -0,0 +1,173 @@
+"""
+The surfstore module handles saving and loading sampled energy surfaces
+to and from disk, so that identical calculations can share their results.
+
+A stored surface is a directory containing one columnar ``.npy`` block per
+generated chunk, plus a small JSON index describing the phase and columns
+of each block. Blocks are opened as read-only memory maps, so several
+processes reading the same surface share the underlying pages.
+"""
+
+from __future__ import division
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from pycalphad.log import logger
+
+_INDEX_NAME = 'index.json'
+_FORMAT_VERSION = 2
+
+def surface_key(dbf, comps, phases, models, pdens, statevars, options=None):
+    """
+    Compute a key uniquely identifying a sampled energy surface.
+    Point sampling is deterministic, so two calculations with the same
+    key will produce identical surfaces.
+
+    Parameters
+    ----------
+    dbf : Database
+        Thermodynamic database containing the relevant parameters.
+    comps : list
+        Names of components to consider in the calculation.
+    phases : list
+        Names of phases to consider in the calculation.
+    models : defaultdict
+        Model classes or instances, keyed by phase name.
+    pdens : defaultdict
+        Number of points to sample per degree of freedom, keyed by phase name.
+    statevars : dict
+        State variable names and their (possibly list-like) values.
+    options : dict, optional
+        Other keyword arguments of the calculation that affect the
+        values, e.g., temperature_sweep.
+
+    Returns
+    -------
+    Hexadecimal string
+    """
+    phases = sorted(set(x.upper() for x in phases))
+    hasher = hashlib.sha1()
+    def _update(obj):
+        "Add the string representation of obj to the hash."
+        hasher.update(repr(obj).encode('utf-8'))
+    _update(_FORMAT_VERSION)
+    _update(sorted(set(x.upper() for x in comps)))
+    _update(phases)
+    for name in phases:
+        phase_obj = dbf.phases[name]
+        _update((phase_obj.constituents, phase_obj.sublattices,
+                 sorted(phase_obj.model_hints.items())))
+        mod = models[name]
+        if isinstance(mod, type):
+            _update('{0}.{1}'.format(mod.__module__, mod.__name__))
+        else:
+            # Model instances may have been customized; hash the energy,
+            # or its parts if the full energy has not been built
+            if mod.ordering_terms is not None:
+                terms = mod.ordering_terms
+                _update([str(terms['ordered']), str(terms['disordered'])] +
+                        [sorted((str(key), str(value)) for key, value in \
+                                terms[subs].items()) \
+                         for subs in ('disordered_substitutions',
+                                      'equal_substitutions')])
+            elif mod.excess_terms is not None:
+                _update([str(mod.excess_terms['remainder'])] +
+                        sorted(repr(sorted((key, str(value)) for key, value \
+                                           in param.items())) \
+                               for param in mod.excess_terms['parameters']))
+            else:
+                _update(str(mod.ast))
+        _update(pdens[name])
+    _update(sorted((name, str(value)) for name, value in dbf.symbols.items()))
+    _update(sorted(repr(sorted((key, str(value)) for key, value in p.items()))
+                   for p in dbf._parameters.all())) #pylint: disable=W0212
+    _update(sorted((str(key), np.asarray(value, dtype=np.float64).tolist())
+                   for key, value in statevars.items()))
+    _update(sorted((options or {}).items()))
+    return hasher.hexdigest()
+
+def write_surface(path, frames):
+    """
+    Write an energy surface to disk, one block per frame as the frames
+    are generated, so that only one frame is held in memory at a time.
+    The directory is written atomically; if another process has already
+    written a surface to `path`, that surface is kept.
+
+    Parameters
+    ----------
+    path : string
+        Directory to create.
+    frames : iterable of DataFrame
+        Energy surface data, as generated by energy_surf_chunks().
+        Each frame must contain points of a single phase.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    index = {'version': _FORMAT_VERSION, 'blocks': []}
+    try:
+        for frame in frames:
+            columns = [c for c in frame.columns if c != 'Phase']
+            filename = '{0}.npy'.format(len(index['blocks']))
+            # Store column-major so that each column is contiguous on disk
+            np.save(os.path.join(tmp_path, filename),
+                    np.ascontiguousarray(frame[columns].values.T,
+                                         dtype=np.float64))
+            index['blocks'].append({'name': frame['Phase'].iat[0],
+                                    'file': filename, 'columns': columns,
+                                    'dtypes': [frame[c].dtype.str \
+                                        for c in columns]})
+        with open(os.path.join(tmp_path, _INDEX_NAME), 'w') as fd:
+            json.dump(index, fd)
+        os.rename(tmp_path, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+        # Another process finished first; use its copy
+        logger.debug('Energy surface at %s already exists', path)
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+
+def read_surface(path, blocks=None):
+    """
+    Read an energy surface from disk.
+
+    Parameters
+    ----------
+    path : string
+        Directory previously created by write_surface().
+    blocks : list of int, optional
+        Positions of the blocks to read, in the order they were written.
+        By default, all blocks are read.
+
+    Returns
+    -------
+    Generator of (phase name, dict of column name to ndarray), one per
+    stored block, in the order they were written.
+    Float columns are read-only views of memory-mapped blocks; columns
+    of other types are converted copies.
+    """
+    with open(os.path.join(path, _INDEX_NAME), 'r') as fd:
+        index = json.load(fd)
+    if index['version'] != _FORMAT_VERSION:
+        raise ValueError('Unsupported energy surface format version: ' + \
+            str(index['version']))
+    entries = index['blocks']
+    if blocks is not None:
+        entries = [entries[idx] for idx in blocks]
+    for entry in entries:
+        block = np.load(os.path.join(path, entry['file']), mmap_mode='r')
+        columns = dict(zip(entry['columns'], block))
+        for column, dtype in zip(entry['columns'], entry['dtypes']):
+            if np.dtype(dtype) != block.dtype:
+                columns[column] = columns[column].astype(dtype)
+        yield entry['name'], columns
+
+def has_surface(path):
+    "Return True if a complete energy surface is stored at `path`."
+    return os.path.isfile(os.path.join(path, _INDEX_NAME))
@@ -0,0 +1,144 @@
+"""
+The tbasis module evaluates energies over many temperatures at fixed
+internal degrees of freedom.
+
+Within a temperature interval of its parameters, nearly every term of a
+CALPHAD energy is a numeric coefficient times a function of T from a small
+basis (1, T, T*log(T), T**2, 1/T, ...) times a function of the site
+fractions. The site fraction functions are evaluated once for a set of
+points and combined with the coefficients of each interval, after which the
+energies at any temperature are a matrix product with the values of the
+basis functions. Only terms not of this form, such as the magnetic
+contribution, are evaluated in full at every temperature.
+"""
+
+from __future__ import division
+import numpy as np
+import pycalphad.variables as v
+from pycalphad.eq.utils import make_callable
+from pycalphad.simplify import temperature_basis
+
+class TemperatureBasis(object):
+    """
+    Compiled representation of an energy expression as coefficients of a
+    basis of functions of temperature, for fast evaluation over many
+    temperatures.
+
+    Parameters
+    ----------
+    model : Model or SymPy object
+        Model, whose stored decomposition is used, or energy expression.
+    variables : list
+        Input arguments other than temperature, e.g., the site fractions.
+    mode : string, optional
+        See 'make_callable' docstring for details.
+
+    Attributes
+    ----------
+    lower_bounds, upper_bounds : ndarray
+        Temperature bounds of each interval.
+    basis : list of tuple
+        Exponents (n, m) of each basis function T**n * log(T)**m.
+    coefficients : ndarray
+        Coefficients with shape (intervals, features, basis).
+
+    Examples
+    --------
+    >>> energies = TemperatureBasis(mod, variables).sweep(temps, *sitefracs)
+    """
+    def __init__(self, model, variables, mode=None):
+        if hasattr(model, 'temperature_basis'):
+            decomposition = model.temperature_basis()
+        else:
+            decomposition = temperature_basis(model)
+        lower_bounds, upper_bounds, self.basis, features, \
+            self.coefficients, residuals = decomposition
+        self.lower_bounds = np.asarray(lower_bounds, dtype=np.float64)
+        self.upper_bounds = np.asarray(upper_bounds, dtype=np.float64)
+        self.variables = list(variables)
+        self._feature_callable = make_callable(features, self.variables,
+                                               mode=mode)
+        self._num_features = len(features)
+        # Residuals without breakpoints of their own, like the magnetic
+        # contribution, are the same in every interval; compile them once
+        compiled = {}
+        self._residual_callables = []
+        for residual in residuals:
+            if residual == 0:
+                self._residual_callables.append(None)
+                continue
+            if residual not in compiled:
+                compiled[residual] = make_callable(
+                    residual, [v.T] + self.variables, mode=mode)
+            self._residual_callables.append(compiled[residual])
+
+    def intervals(self, temperatures):
+        """
+        Return the index of the interval containing each temperature,
+        or -1 for temperatures outside of every interval.
+        """
+        temperatures = np.asarray(temperatures, dtype=np.float64)
+        inside = (self.lower_bounds <= temperatures[..., None]) & \
+            (temperatures[..., None] < self.upper_bounds)
+        return np.where(inside.any(axis=-1), inside.argmax(axis=-1), -1)
+
+    def basis_values(self, temperatures):
+        """
+        Return the values of the basis functions at each temperature,
+        as an ndarray of shape (temperatures, basis).
+        """
+        temperatures = np.asarray(temperatures, dtype=np.float64)
+        values = np.empty((len(temperatures), len(self.basis)))
+        for idx, (power, log_power) in enumerate(self.basis):
+            values[:, idx] = temperatures ** float(power) * \
+                np.log(temperatures) ** log_power
+        return values
+
+    def features(self, *args):
+        """
+        Return the values of the temperature-independent features at the
+        given points, as an ndarray of shape (features, points).
+        """
+        args = np.broadcast_arrays(*[np.asarray(arg, dtype=np.float64) \
+            for arg in args])
+        num_points = args[0].size if len(args) > 0 else 1
+        values = self._feature_callable(*[np.ravel(arg) for arg in args])
+        result = np.empty((self._num_features, num_points))
+        for idx, value in enumerate(values):
+            result[idx] = value
+        return result
+
+    def sweep(self, temperatures, *args):
+        """
+        Evaluate the energy at every temperature for the same points.
+
+        Parameters
+        ----------
+        temperatures : array_like
+            Temperatures at which to evaluate the energy.
+        Other positional arguments are the values of 'variables'.
+
+        Returns
+        -------
+        ndarray of shape (temperatures, points). Energies at temperatures
+        outside of every interval are NaN.
+        """
+        temperatures = np.atleast_1d(np.asarray(temperatures,
+                                                dtype=np.float64))
+        args = [np.ravel(arg) for arg in \
+            np.broadcast_arrays(*[np.asarray(arg, dtype=np.float64) \
+                                  for arg in args])]
+        features = self.features(*args)
+        result = np.full((len(temperatures), features.shape[1]), np.nan)
+        intervals = self.intervals(temperatures)
+        for interval in np.unique(intervals[intervals >= 0]):
+            rows = np.flatnonzero(intervals == interval)
+            # Coefficients of the basis functions at each point
+            projected = np.dot(self.coefficients[interval].T, features)
+            result[rows] = np.dot(self.basis_values(temperatures[rows]),
+                                  projected)
+            residual = self._residual_callables[interval]
+            if residual is not None:
+                for row in rows:
+                    result[row] += residual(temperatures[row], *args)
+        return result
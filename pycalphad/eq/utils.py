@@ -3,6 +3,7 @@ The minimize module handles helper routines for equilibrium calculation.
 """
 from __future__ import division
 import pycalphad.variables as v
+from pycalphad.simplify import temperature_intervals
 import scipy.spatial.distance
 from sympy.utilities import default_sort_key
 from sympy.utilities.lambdify import lambdify
@@ -195,6 +196,57 @@ def point_sample(comp_count, pdof=10):
         pts = np.atleast_2d([1] * len(comp_count))
     return pts
 
+def _as_array(value, num_points):
+    """
+    Convert the (possibly nested list) output of a lambdified function
+    into an array with a trailing axis of length num_points.
+    """
+    if isinstance(value, (list, tuple)):
+        return np.array([_as_array(x, num_points) for x in value])
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (num_points,))
+
+def _interval_callable(lower_bounds, upper_bounds, callables,
+                       temperature_index):
+    """
+    Combine callables defined on disjoint temperature intervals into one
+    function, which evaluates only the callable of the interval each
+    temperature lies in. Outside of every interval the result is NaN.
+    """
+    lower_bounds = np.asarray(lower_bounds, dtype=np.float64)
+    upper_bounds = np.asarray(upper_bounds, dtype=np.float64)
+    def evaluate(*args):
+        "Evaluate the callable of the matching temperature interval."
+        temperature = np.asarray(args[temperature_index], dtype=np.float64)
+        if temperature.ndim == 0:
+            # Keep numpy semantics (e.g., division by zero gives inf) when
+            # the body reduces to plain Python arithmetic on floats
+            args = list(args)
+            args[temperature_index] = temperature[()]
+            matches = np.flatnonzero((lower_bounds <= temperature) & \
+                (temperature < upper_bounds))
+            if len(matches) > 0:
+                return callables[matches[0]](*args)
+            return _as_array(callables[0](*args), 1)[..., 0] * np.nan
+        args = np.broadcast_arrays(*args)
+        num_points = args[0].size
+        args = [np.ravel(arg) for arg in args]
+        temperature = args[temperature_index]
+        result = None
+        for idx, func in enumerate(callables):
+            mask = (lower_bounds[idx] <= temperature) & \
+                (temperature < upper_bounds[idx])
+            if not np.any(mask):
+                continue
+            value = _as_array(func(*[arg[mask] for arg in args]),
+                              np.count_nonzero(mask))
+            if result is None:
+                result = np.full(value.shape[:-1] + (num_points,), np.nan)
+            result[..., mask] = value
+        if result is None:
+            result = _as_array(callables[0](*args), num_points) * np.nan
+        return result
+    return evaluate
+
 def make_callable(model, variables, mode=None):
     """
     Take a SymPy object and create a callable function.
@@ -215,12 +267,23 @@ def make_callable(model, variables, mode=None):
     -------
     Function that takes arguments in the same order as 'variables'
     and returns the energy according to 'model'.
+    If 'model' is a Piecewise over temperature intervals, e.g., from
+    merge_temperature_breakpoints(), each interval is compiled separately
+    and only the one containing the temperature is evaluated.
 
     Examples
     --------
     None yet.
     """
     energy = None
+    if mode != 'sympy' and v.T in variables:
+        intervals = temperature_intervals(model)
+        if intervals is not None:
+            lower_bounds, upper_bounds, bodies = intervals
+            return _interval_callable(lower_bounds, upper_bounds,
+                                      [make_callable(body, variables, mode) \
+                                       for body in bodies],
+                                      list(variables).index(v.T))
     if mode is None:
         # no mode specified; use numexpr if available, otherwise numpy
         # Note: numexpr support appears to break in multi-component situations
@@ -247,7 +310,8 @@ def make_callable(model, variables, mode=None):
 
     return energy
 
-def check_degenerate_phases(phase_compositions, mindist=0.5):
+def check_degenerate_phases(phase_compositions, mindist=0.5,
+                            phase_codes=None):
     """
     Because the global minimization procedure returns a simplex as an
     output, our starting point will always assume the maximum number of
@@ -255,38 +319,41 @@ def check_degenerate_phases(phase_compositions, mindist=0.5):
     i.e., the simplex is narrow. These redundant or degenerate phases can
     be eliminated from the computation.
 
-    Here we perform edge-wise comparisons of all the simplex vertices.
+    Here we compare all pairs of simplex vertices at once.
     Vertices which are from the same phase and "sufficiently" close to
     each other in composition space are redundant, and one of them is
     eliminated from the computation.
 
-    This function accepts a DataFrame of the estimated phase compositions
-    and returns the indices of the "independent" phases in the DataFrame.
+    This function accepts either a DataFrame of the estimated phase
+    compositions, or an array of compositions (one row per vertex) together
+    with an array of integer phase codes, and returns the indices of the
+    "independent" phases.
     """
-    output_vertices = set(range(len(phase_compositions)))
-    edges = list(itertools.combinations(output_vertices, 2))
-    sitefrac_columns = \
-        [c for c in phase_compositions.columns.values \
-            if str(c).startswith('X')]
-    for edge in edges:
-        # check if both end-points are still in output_vertices
-        # if not, we should skip this edge
-        if not set(edge).issubset(output_vertices):
-            continue
-        first_vertex = phase_compositions.iloc[edge[0]]
-        second_vertex = phase_compositions.iloc[edge[1]]
-        if first_vertex.loc['Phase'] != second_vertex.loc['Phase']:
-            # phases along this edge do not match; leave them alone
-            continue
-        # phases match; check the distance between their respective
-        # site fractions; if below the threshold, eliminate one of them
-        first_coords = first_vertex.loc[sitefrac_columns].fillna(0)
-        second_coords = second_vertex.loc[sitefrac_columns].fillna(0)
-        edge_length = \
-            scipy.spatial.distance.chebyshev(first_coords, second_coords)
-        if edge_length < mindist and len(output_vertices) > 1:
-            output_vertices.discard(edge[1])
-    return list(output_vertices)
+    if phase_codes is None:
+        sitefrac_columns = \
+            [c for c in phase_compositions.columns.values \
+                if str(c).startswith('X')]
+        _, phase_codes = np.unique(phase_compositions['Phase'].values,
+                                   return_inverse=True)
+        phase_compositions = phase_compositions[sitefrac_columns].values
+    coordinates = np.nan_to_num(np.asarray(phase_compositions,
+                                           dtype=np.float64))
+    phase_codes = np.asarray(phase_codes)
+    num_vertices = len(phase_codes)
+    if num_vertices < 2:
+        return list(range(num_vertices))
+    # chebyshev distance returns maximum difference between any dimension
+    distances = scipy.spatial.distance.squareform(
+        scipy.spatial.distance.pdist(coordinates, 'chebyshev'))
+    redundant = (distances < mindist) & \
+        (phase_codes[:, None] == phase_codes[None, :])
+    # Visit the vertices in order; each remaining vertex eliminates all
+    # later vertices which are redundant with it
+    independent = np.ones(num_vertices, dtype=bool)
+    for idx in range(num_vertices):
+        if independent[idx]:
+            independent[idx+1:] &= ~redundant[idx, idx+1:]
+    return list(np.flatnonzero(independent))
 
 def generate_dof(phase, active_comps):
     """
@@ -7,6 +7,7 @@ import copy
 from sympy import log, Add, Mul, Piecewise, Pow, S, Symbol
 from tinydb import where
 import pycalphad.variables as v
+from pycalphad import simplify
 from pycalphad.log import logger
 try:
     set
@@ -33,16 +34,59 @@ class Model(object):
     parameters : dict
         Optional dictionary of parameters to be substituted in the model.
         This will overwrite parameters specified in the database
+    canonicalize : bool, optional
+        If True, rewrite the energy into a smaller canonical form
+        (see pycalphad.simplify) before it is used. Default is False.
+    merge_breakpoints : bool, optional
+        If True, merge the temperature breakpoints of all parameters into
+        a single Piecewise over disjoint temperature intervals, so that only
+        one interval is evaluated per temperature. Default is False.
+    numeric_excess : bool, optional
+        If True, keep the interaction parameters of the phase in
+        'excess_terms' instead of building the symbolic excess mixing
+        energy, so that it can be evaluated with
+        pycalphad.eq.redlich_kister.RedlichKister. Not used for ordered
+        phases with a disordered contribution. Default is False.
 
     Methods
     -------
     None yet.
 
+    Attributes
+    ----------
+    ast : SymPy object
+        Gibbs energy of the phase per mole of formula unit.
+    excess_terms : dict or None
+        With 'numeric_excess', the parts of the excess mixing energy:
+        'phase', the Phase; 'parameters', its interaction parameters, as
+        for RedlichKister; and 'remainder', the rest of the energy, so that
+        'ast' equals 'remainder' plus the excess energy. Otherwise None.
+    ordering_terms : dict or None
+        For ordered phases with a disordered contribution, the parts of
+        the energy: 'ordered', the energy before the ordering correction;
+        'disordered', the disordered phase energy in its own site
+        fractions; 'disordered_substitutions', mapping those site
+        fractions to functions of the ordered ones; and
+        'equal_substitutions', mapping the ordered site fractions to
+        their values when all sublattices are equal. Otherwise None.
+    magnetic_terms : dict or None
+        For phases with an IHJ magnetic contribution, its parts:
+        'mean_magnetic_moment' and 'curie_temperature', the Redlich-Kister
+        sums of BMAGN and TC; 'afm_factor' and 'structure_factor', from
+        the model hints; 'normalization', the site ratio normalization;
+        'energy', the contribution itself; and 'remainder', the rest of
+        the energy of the phase, built without the contribution, so that
+        'ast' equals 'remainder' + 'energy' when 'ordering_terms' and
+        'excess_terms' are None. For ordered phases, both exclude the
+        atomic ordering contribution; with 'excess_terms', 'remainder'
+        excludes the excess energy. Otherwise None.
+
     Examples
     --------
     None yet.
     """
-    def __init__(self, dbe, comps, phase, parameters=None):
+    def __init__(self, dbe, comps, phase, parameters=None, canonicalize=False,
+                 merge_breakpoints=False, numeric_excess=False):
         # Constrain possible components to those within phase's d.o.f
         possible_comps = set([x.upper() for x in comps])
         self.components = set()
@@ -60,6 +104,148 @@ class Model(object):
                             dbe.phases[phase.upper()].constituents,
                             self.components))
 
+        symbols = self._database_symbols(dbe, parameters)
+
+        # Build the abstract syntax tree
+        # For ordered phases and with numeric_excess, only the parts of the
+        # energy are kept; the full expression is built on first use of 'ast'
+        self.ordering_terms = None
+        self.magnetic_terms = None
+        self.excess_terms = None
+        self._ast = None
+        self._simplifications = (canonicalize, merge_breakpoints)
+        self._numeric_excess = numeric_excess and \
+            dbe.phases[phase.upper()].model_hints.get('ordered_phase') != \
+            phase.upper()
+        energy = self.build_phase(dbe, phase.upper(), symbols, dbe.search,
+                                  ordering=False)
+        if self.ordering_terms is not None:
+            for key in ('ordered', 'disordered'):
+                self.ordering_terms[key] = \
+                    self.ordering_terms[key].xreplace(symbols)
+        elif self.excess_terms is not None:
+            self.excess_terms['remainder'] = \
+                self._simplify(energy.xreplace(symbols))
+            for param in self.excess_terms['parameters']:
+                param['parameter'] = param['parameter'].xreplace(symbols)
+        else:
+            self._ast = self._simplify(energy.xreplace(symbols))
+        if self.magnetic_terms is not None:
+            for key in ('mean_magnetic_moment', 'curie_temperature',
+                        'energy', 'remainder'):
+                self.magnetic_terms[key] = \
+                    self.magnetic_terms[key].xreplace(symbols)
+            self.magnetic_terms['remainder'] = \
+                self._simplify(self.magnetic_terms['remainder'])
+        self.variables = set().union(*[x.atoms(v.StateVariable) \
+            for x in self._expressions()])
+        if self.ordering_terms is not None:
+            # The disordered site fractions are substituted away
+            self.variables -= set(self.ordering_terms[
+                'disordered_substitutions'].keys())
+        self._temperature_basis = None
+    @property
+    def ast(self):
+        """
+        Gibbs energy of the phase per mole of formula unit. For phases with
+        'ordering_terms' or 'excess_terms', it is built from them on first
+        use.
+        """
+        if self._ast is None and self.ordering_terms is not None:
+            self._ast = self._simplify(
+                self.ordering_terms['ordered'] +
+                self.ordering_contribution(self.ordering_terms))
+        elif self._ast is None:
+            self._ast = self._simplify(
+                self.excess_terms['remainder'] +
+                self.redlich_kister_energy(self.excess_terms['phase'],
+                                           self.excess_terms['parameters']))
+        return self._ast
+    @ast.setter
+    def ast(self, value):
+        "Set the energy; its parts no longer describe it and are dropped."
+        self._ast = value
+        self.ordering_terms = None
+        self.magnetic_terms = None
+        self.excess_terms = None
+    def _simplify(self, energy):
+        "Apply the simplifications requested at construction to 'energy'."
+        canonicalize, merge_breakpoints = self._simplifications
+        if canonicalize:
+            energy = simplify.canonicalize(energy)
+        if merge_breakpoints:
+            energy = simplify.merge_temperature_breakpoints(energy)
+        return energy
+    def _expressions(self):
+        """
+        Return the symbolic expressions describing the energy: 'ast', if
+        it has been built, and the parts in 'ordering_terms',
+        'excess_terms' and 'magnetic_terms'.
+        """
+        expressions = []
+        if self._ast is not None:
+            expressions.append(self._ast)
+        if self.ordering_terms is not None:
+            expressions.extend([self.ordering_terms['ordered'],
+                                self.ordering_terms['disordered']])
+        if self.excess_terms is not None:
+            expressions.append(self.excess_terms['remainder'])
+            expressions.extend(param['parameter'] \
+                for param in self.excess_terms['parameters'])
+        if self.magnetic_terms is not None:
+            expressions.extend([self.magnetic_terms[key] for key in \
+                ('mean_magnetic_moment', 'curie_temperature', 'remainder')])
+        return expressions
+    def zero_undefined_symbols(self):
+        """
+        Set symbols of the energy which are not state variables, e.g.,
+        undefined functions, to zero, in 'ast' and in its parts.
+
+        Returns
+        -------
+        List of the symbols set to zero.
+        """
+        undefs = set()
+        for expr in self._expressions():
+            undefs |= expr.atoms(Symbol) - expr.atoms(v.StateVariable)
+        if not undefs:
+            return []
+        zeros = dict((undef, float(0)) for undef in undefs)
+        if self._ast is not None:
+            self._ast = self._ast.xreplace(zeros)
+        if self.ordering_terms is not None:
+            for key in ('ordered', 'disordered'):
+                self.ordering_terms[key] = \
+                    self.ordering_terms[key].xreplace(zeros)
+        if self.excess_terms is not None:
+            self.excess_terms['remainder'] = \
+                self.excess_terms['remainder'].xreplace(zeros)
+            for param in self.excess_terms['parameters']:
+                param['parameter'] = param['parameter'].xreplace(zeros)
+        if self.magnetic_terms is not None:
+            for key in ('mean_magnetic_moment', 'curie_temperature',
+                        'remainder'):
+                self.magnetic_terms[key] = \
+                    self.magnetic_terms[key].xreplace(zeros)
+        return sorted(undefs, key=str)
+    def temperature_basis(self):
+        """
+        Return the decomposition of the energy into numeric coefficients
+        of functions of temperature, per temperature interval and function
+        of the site fractions (see pycalphad.simplify.temperature_basis).
+        It is computed on first use and stored until 'ast' changes.
+        """
+        if self._temperature_basis is None or \
+            self._temperature_basis[0] is not self.ast:
+            self._temperature_basis = \
+                (self.ast, simplify.temperature_basis(self.ast))
+        return self._temperature_basis[1]
+    @staticmethod
+    def _database_symbols(dbe, parameters=None):
+        """
+        Return the symbols of the database, with any overrides from
+        'parameters', as a dict of Symbol to fully substituted value.
+        """
         # Convert string symbol names to sympy Symbol objects
         # This makes xreplace work with the symbols dict
         symbols = dict([(Symbol(s), val) for s, val in dbe.symbols.items()])
@@ -79,11 +265,7 @@ class Model(object):
             except AttributeError:
                 # Can't use xreplace on a float
                 pass
-
-        # Build the abstract syntax tree
-        self.ast = self.build_phase(dbe, phase.upper(), symbols, dbe.search)
-        self.ast = self.ast.xreplace(symbols)
-        self.variables = self.ast.atoms(v.StateVariable)
+        return symbols
     def _purity_test(self, constituent_array):
         """
         Check if constituent array only has one species in its array
@@ -106,7 +288,8 @@ class Model(object):
             if not valid:
                 return False
         return True
-    def _interaction_test(self, constituent_array):
+    @staticmethod
+    def _interaction_test(constituent_array, components):
         """
         Check if constituent array has more than one active species in
         its array for at least one sublattice.
@@ -114,7 +297,7 @@ class Model(object):
         result = False
         for sublattice in constituent_array:
             # check if all elements involved are also active
-            valid = set(sublattice).issubset(self.components) \
+            valid = set(sublattice).issubset(components) \
                 or sublattice[0] == '*'
             if len(sublattice) > 1 and valid:
                 result = True
@@ -167,9 +350,12 @@ class Model(object):
             return_dict[comp] = comp + correction_term
         return return_dict
 
-    def build_phase(self, dbe, phase_name, symbols, param_search):
+    def build_phase(self, dbe, phase_name, symbols, param_search,
+                    ordering=True):
         """
         Apply phase's model hints to build a master SymPy object.
+        If 'ordering' is False, the atomic ordering contribution is left
+        out; its parts are still stored in 'ordering_terms'.
         """
         phase = dbe.phases[phase_name]
         total_energy = S.Zero
@@ -180,10 +366,22 @@ class Model(object):
         total_energy += self.ideal_mixing_energy(phase, symbols, param_search)
 
         # Next, add the binary, ternary and higher order mixing term
-        total_energy += self.excess_mixing_energy(phase, symbols, param_search)
+        if self._numeric_excess:
+            # Only the parameters are kept (see 'excess_terms')
+            self.excess_terms = {
+                'phase': phase,
+                'parameters': self.interaction_parameters(phase, symbols,
+                                                          param_search)
+            }
+        else:
+            total_energy += self.excess_mixing_energy(phase, symbols,
+                                                      param_search)
 
         # Next, we need to handle contributions from magnetic ordering
-        total_energy += self.magnetic_energy(phase, symbols, param_search)
+        magnetic_term = self.magnetic_energy(phase, symbols, param_search)
+        if self.magnetic_terms is not None:
+            self.magnetic_terms['remainder'] = total_energy
+        total_energy += magnetic_term
 
         # Next, we handle atomic ordering
         # NOTE: We need to add this one last since it uses the energy
@@ -196,12 +394,13 @@ class Model(object):
         except KeyError:
             pass
         if ordered_phase_name == phase_name:
-            total_energy += \
-                self.atomic_ordering_energy(dbe, disordered_phase_name,
-                                            ordered_phase_name,
-                                            total_energy,
-                                            symbols, param_search)
-
+            self.ordering_terms = \
+                self.atomic_ordering_terms(dbe, disordered_phase_name,
+                                           ordered_phase_name, total_energy,
+                                           symbols, param_search)
+            if ordering:
+                total_energy += \
+                    self.ordering_contribution(self.ordering_terms)
         return total_energy
     def _redlich_kister_sum(self, phase, symbols, param_type, param_search):
         """
@@ -359,30 +558,93 @@ class Model(object):
                 ideal_mixing_term += (mixing_term*ratio)
         ideal_mixing_term *= (v.R * v.T)
         return ideal_mixing_term
-    def excess_mixing_energy(self, phase, symbols, param_search):
+    @staticmethod
+    def _interaction_parameters(phase, components, param_search):
         """
-        Build the binary, ternary and higher order interaction term
-        Here we use Redlich-Kister polynomial basis by default
-        Here we use the Muggianu ternary extension by default
-        Replace y_i -> y_i + (1 - sum(y involved in parameter)) / m,
-        where m is the arity of the interaction parameter
+        Return the interaction parameters of phase among the active
+        components, including the implicit parameters of ternary
+        interactions (see below).
         """
-        excess_mixing_terms = []
-        # Normalize site ratios
-        site_ratio_normalization = self._site_ratio_normalization(phase)
-        site_ratios = phase.sublattices
-        site_ratios = [c/site_ratio_normalization for c in site_ratios]
-
         interaction_param_query = (
             (where('phase_name') == phase.name) & \
             (
                 (where('parameter_type') == "G") | \
                 (where('parameter_type') == "L")
             ) & \
-            (where('constituent_array').test(self._interaction_test))
+            (where('constituent_array').test(
+                lambda x: Model._interaction_test(x, components)))
         )
         # search for desired parameters
         interaction_params = param_search(interaction_param_query)
+        implicit_params = []
+        for param in interaction_params:
+            if not any(len(comps) == 3 \
+                       for comps in param['constituent_array']):
+                continue
+            # NOTE: The commercial software packages seem to have
+            # a "feature" where, if only the zeroth
+            # parameter_order term of a ternary parameter is specified,
+            # the other two terms are automatically generated in order
+            # to make the parameter symmetric.
+            # In other words, specifying only this parameter:
+            # PARAMETER G(FCC_A1,AL,CR,NI;0) 298.15  +30300; 6000 N !
+            # Actually implies:
+            # PARAMETER G(FCC_A1,AL,CR,NI;0) 298.15  +30300; 6000 N !
+            # PARAMETER G(FCC_A1,AL,CR,NI;1) 298.15  +30300; 6000 N !
+            # PARAMETER G(FCC_A1,AL,CR,NI;2) 298.15  +30300; 6000 N !
+            #
+            # If either 1 or 2 is specified, no implicit parameters are
+            # generated.
+            # We need to handle this case.
+            if param['parameter_order'] == 0:
+                # are _any_ of the other parameter_orders specified?
+                ternary_param_query = (
+                    (where('phase_name') == param['phase_name']) & \
+                    (where('parameter_type') == param['parameter_type']) & \
+                    (where('constituent_array') == \
+                        param['constituent_array'])
+                )
+                other_tern_params = param_search(ternary_param_query)
+                if len(other_tern_params) == 1 and \
+                    other_tern_params[0] == param:
+                    # only the current parameter is specified
+                    # We need to generate the other two parameters.
+                    order_one = copy.deepcopy(param)
+                    order_one['parameter_order'] = 1
+                    order_two = copy.deepcopy(param)
+                    order_two['parameter_order'] = 2
+                    implicit_params.extend((order_one, order_two))
+        return interaction_params + implicit_params
+    def excess_mixing_energy(self, phase, symbols, param_search):
+        """
+        Build the binary, ternary and higher order interaction term
+        Here we use Redlich-Kister polynomial basis by default
+        Here we use the Muggianu ternary extension by default
+        Replace y_i -> y_i + (1 - sum(y involved in parameter)) / m,
+        where m is the arity of the interaction parameter
+        """
+        return self.redlich_kister_energy(
+            phase, self.interaction_parameters(phase, symbols, param_search))
+    def interaction_parameters(self, phase, symbols, param_search):
+        """
+        Return the interaction parameters of phase among the components of
+        the model, with 'symbols' substituted into their values.
+        """
+        params = []
+        for param in self._interaction_parameters(phase, self.components,
+                                                  param_search):
+            param = dict(param)
+            param['parameter'] = param['parameter'].xreplace(symbols)
+            params.append(param)
+        return params
+    def redlich_kister_energy(self, phase, interaction_params):
+        """
+        Return the excess mixing energy of phase in symbolic form from its
+        interaction parameters (see interaction_parameters()).
+        """
+        excess_mixing_terms = []
+        # Normalize site ratios
+        site_ratio_normalization = self._site_ratio_normalization(phase)
 
         for param in interaction_params:
             # iterate over every sublattice
@@ -419,42 +681,6 @@ class Model(object):
                 if len(comps) == 3:
                     # 'parameter_order' is an index to a variable when
                     # we are in the ternary interaction parameter case
-
-                    # NOTE: The commercial software packages seem to have
-                    # a "feature" where, if only the zeroth
-                    # parameter_order term of a ternary parameter is specified,
-                    # the other two terms are automatically generated in order
-                    # to make the parameter symmetric.
-                    # In other words, specifying only this parameter:
-                    # PARAMETER G(FCC_A1,AL,CR,NI;0) 298.15  +30300; 6000 N !
-                    # Actually implies:
-                    # PARAMETER G(FCC_A1,AL,CR,NI;0) 298.15  +30300; 6000 N !
-                    # PARAMETER G(FCC_A1,AL,CR,NI;1) 298.15  +30300; 6000 N !
-                    # PARAMETER G(FCC_A1,AL,CR,NI;2) 298.15  +30300; 6000 N !
-                    #
-                    # If either 1 or 2 is specified, no implicit parameters are
-                    # generated.
-                    # We need to handle this case.
-                    if param['parameter_order'] == 0:
-                        # are _any_ of the other parameter_orders specified?
-                        ternary_param_query = (
-                            (where('phase_name') == param['phase_name']) & \
-                            (where('parameter_type') == \
-                                param['parameter_type']) & \
-                            (where('constituent_array') == \
-                                param['constituent_array'])
-                        )
-                        other_tern_params = param_search(ternary_param_query)
-                        if len(other_tern_params) == 1 and \
-                            other_tern_params[0] == param:
-                            # only the current parameter is specified
-                            # We need to generate the other two parameters.
-                            order_one = copy.deepcopy(param)
-                            order_one['parameter_order'] = 1
-                            order_two = copy.deepcopy(param)
-                            order_two['parameter_order'] = 2
-                            # Add these parameters to our iteration.
-                            interaction_params.extend((order_one, order_two))
                     # Include variable indicated by parameter order index
                     # Perform Muggianu adjustment to site fractions
                     mixing_term *= comp_symbols[param['parameter_order']].subs(
@@ -463,8 +689,7 @@ class Model(object):
                 if len(comps) > 3:
                     raise ValueError('Higher-order interactions (n>3) are \
                         not yet supported')
-            excess_mixing_terms.append(mixing_term * \
-                param['parameter'].xreplace(symbols))
+            excess_mixing_terms.append(mixing_term * param['parameter'])
         return Add(*excess_mixing_terms) / site_ratio_normalization
     def magnetic_energy(self, phase, symbols, param_search):
         #pylint: disable=C0103, R0914
@@ -517,8 +742,19 @@ class Model(object):
 
         g_term = Piecewise(*expr_cond_pairs)
 
-        return v.R * v.T * log(beta+1) * \
+        magnetic_term = v.R * v.T * log(beta+1) * \
             g_term / site_ratio_normalization
+        # MagneticEnergy (pycalphad.eq.magnetic) works from these parts
+        # instead of the nested Piecewise below
+        self.magnetic_terms = {
+            'mean_magnetic_moment': mean_magnetic_moment,
+            'curie_temperature': curie_temp,
+            'afm_factor': afm_factor,
+            'structure_factor': p,
+            'normalization': site_ratio_normalization,
+            'energy': magnetic_term
+        }
+        return magnetic_term
 
     @staticmethod
     def mole_fraction(species_name, phase_name, constituent_array,
@@ -564,12 +800,43 @@ class Model(object):
         Return the atomic ordering contribution in symbolic form.
         Description follows Servant and Ansara, Calphad, 2001.
         """
+        self.ordering_terms = \
+            self.atomic_ordering_terms(dbe, disordered_phase_name,
+                                       ordered_phase_name,
+                                       ordered_phase_energy,
+                                       symbols, param_search)
+        return self.ordering_contribution(self.ordering_terms)
+
+    @staticmethod
+    def ordering_contribution(ordering_terms):
+        """
+        Return the atomic ordering contribution in symbolic form from its
+        parts (see 'ordering_terms').
+        """
+        # Site fractions are atoms, so a structural replacement suffices;
+        # it is much faster than subs() on these large expressions
+        disordered_term = ordering_terms['disordered'].xreplace(
+            ordering_terms['disordered_substitutions'])
+        subl_equal_term = ordering_terms['ordered'].xreplace(
+            ordering_terms['equal_substitutions'])
+        return disordered_term - subl_equal_term
+
+    def atomic_ordering_terms(self, dbe, disordered_phase_name,
+                              ordered_phase_name, ordered_phase_energy,
+                              symbols, param_search):
+        """
+        Return the parts of the atomic ordering contribution, as described
+        for 'ordering_terms', without substituting them.
+        """
 
         # What we need to add here is the energy of
         # the disordered phase, followed by subtracting out the ordered
         # phase energy for the case when all sublattices are equal.
+        # magnetic_terms describes the ordered phase's own contribution
+        magnetic_terms = self.magnetic_terms
         disordered_term = self.build_phase(dbe, disordered_phase_name,
                                            symbols, param_search)
+        self.magnetic_terms = magnetic_terms
         constituents = [sorted(set(c).intersection(self.components)) \
                 for c in dbe.phases[ordered_phase_name].constituents]
 
@@ -599,7 +866,6 @@ class Model(object):
                         dbe.phases[ordered_phase_name].sublattices
                         )
 
-        disordered_term = disordered_term.subs(variable_rename_dict)
 
         # Now handle the ordered term for degenerate sublattice case
         molefraction_dict = {}
@@ -624,7 +890,11 @@ class Model(object):
                 continue
             molefraction_dict[sitefrac] = species_dict[sitefrac.species]
 
-        subl_equal_term = \
-            ordered_phase_energy.subs(molefraction_dict, simultaneous=True)
-
-        return disordered_term - subl_equal_term
+        # Keep the parts, so that the correction can also be evaluated
+        # by composing compiled functions (see pycalphad.eq.ordering)
+        return {
+            'ordered': ordered_phase_energy,
+            'disordered': disordered_term,
+            'disordered_substitutions': variable_rename_dict,
+            'equal_substitutions': molefraction_dict
+        }
@@ -2,19 +2,89 @@
 The binary module enables plotting of binary
 isobaric phase diagrams.
 """
-import scipy.spatial
+import multiprocessing
+import multiprocessing.sharedctypes
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 #pylint: disable=E1101
 from matplotlib import collections as mc
 from pycalphad import energy_surf
+from pycalphad.eq import surfstore
+from pycalphad.eq.energy_surf import energy_surf_cache
+from pycalphad.eq.boundaries import trace_boundaries
+from pycalphad.eq.geometry import binary_tie_lines
 
+# Energy surface arrays of a worker process, attached by _init_hull_worker
+_WORKER_ARRAYS = {}
 
-def _binplot_setup(ax, phases, tie_lines, tie_line_colors, tie_line_widths):
-    "Setup the plot for a binary phase diagram."
-    colorlist = {}
+def _tie_lines(compositions, energies, phase_codes, temperature):
+    """
+    Find the tie-lines of the energy surface at one temperature.
+    Returns the (x, T) coordinates of their endpoints, with shape (N, 2, 2),
+    and the phase codes of the endpoints, with shape (N, 2).
+    """
+    endpoints = binary_tie_lines(compositions, energies, phase_codes)
+    lines = np.empty(endpoints.shape + (2,))
+    lines[:, :, 0] = compositions[endpoints]
+    lines[:, :, 1] = temperature
+    return lines, phase_codes[endpoints]
+
+def _slice_tie_lines(arrays, bounds):
+    "Find the tie-lines of one temperature slice of the energy surface."
+    start, stop = bounds
+    return _tie_lines(arrays['compositions'][start:stop],
+                      arrays['energies'][start:stop],
+                      arrays['phase_codes'][start:stop],
+                      arrays['temperatures'][start])
+
+def _stored_tie_lines(task):
+    """
+    Find the tie-lines of one temperature of an energy surface stored on
+    disk, reading only the (memory-mapped) blocks of that temperature.
+    `task` holds the directory of the surface, the x-axis variable, and
+    the positions and phase codes of the blocks.
+    """
+    path, x_variable, blocks, codes = task
+    compositions, energies, phase_codes = [], [], []
+    temperature = None
+    for code, (_, columns) in zip(codes, surfstore.read_surface(path, blocks)):
+        compositions.append(columns[x_variable])
+        energies.append(columns['GM'])
+        phase_codes.append(np.full(len(columns['GM']), code, dtype=np.int32))
+        temperature = columns['T'][0]
+    return _tie_lines(np.concatenate(compositions), np.concatenate(energies),
+                      np.concatenate(phase_codes), temperature)
+
+def _init_hull_worker(compositions, energies, phase_codes, temperatures):
+    "Attach the shared energy surface arrays in a worker process."
+    _WORKER_ARRAYS['compositions'] = np.frombuffer(compositions,
+                                                   dtype=np.float64)
+    _WORKER_ARRAYS['energies'] = np.frombuffer(energies, dtype=np.float64)
+    _WORKER_ARRAYS['phase_codes'] = np.frombuffer(phase_codes, dtype=np.int32)
+    _WORKER_ARRAYS['temperatures'] = np.frombuffer(temperatures,
+                                                   dtype=np.float64)
 
+def _hull_worker(bounds):
+    "Find the tie-lines of one temperature slice in a worker process."
+    return _slice_tie_lines(_WORKER_ARRAYS, bounds)
+
+def _shared_copy(array, typecode):
+    "Copy an array into shared memory which worker processes can attach."
+    shared = multiprocessing.sharedctypes.RawArray(typecode, len(array))
+    np.frombuffer(shared, dtype=array.dtype)[:] = array
+    return shared
+
+
+def _binplot_setup(ax, phases, tie_lines, tie_line_phases, tie_line_colors,
+                   tie_line_widths):
+    """
+    Setup the plot for a binary phase diagram.
+    `tie_lines` holds the (x, T) coordinates of each endpoint, with shape
+    (N, 2, 2), and `tie_line_phases` the index in `phases` of each
+    endpoint's phase, with shape (N, 2).
+    """
     # colors from Junwei Huang, March 21 2013
     # exclude green and red because of their special meaning on the diagram
     colorvalues = ["0000FF", "FFFF00", "FF00FF", "00FFFF", "000000",
@@ -28,27 +98,26 @@ def _binplot_setup(ax, phases, tie_lines, tie_line_colors, tie_line_widths):
                    "E00000", "00E000", "0000E0", "E0E000", "E000E0", "00E0E0",
                    "E0E0E0"]
 
-    phasecount = 0
+    colors = np.empty(len(phases), dtype=object)
     legend_handles = []
-    for phase in phases:
+    for phasecount, phase in enumerate(phases):
         phase = phase.upper()
-        colorlist[phase] = "#"+colorvalues[np.mod(phasecount, len(colorvalues))]
-        legend_handles.append(mpatches.Patch(color=colorlist[phase], label=phase))
-        phasecount = phasecount + 1
+        colors[phasecount] = \
+            "#"+colorvalues[np.mod(phasecount, len(colorvalues))]
+        legend_handles.append(mpatches.Patch(color=colors[phasecount],
+                                             label=phase))
     ax.tick_params(axis='both', which='major', labelsize=14)
     ax.grid(True)
 
-    # Get the configured plot colors
-    plotcolors = list(map(lambda x: [colorlist[x[0]], colorlist[x[1]]],
-                          tie_lines[:, :, 2]))
     if len(tie_lines) > 0:
         lc = mc.LineCollection(
-            tie_lines[:, :, 0:2], color=tie_line_colors,
+            tie_lines, color=tie_line_colors,
             linewidth=tie_line_widths, zorder=1
         )
         ax.add_collection(lc)
+        # Get the configured plot colors
         ax.scatter(tie_lines[:, :, 0].ravel(), tie_lines[:, :, 1].ravel(),
-                   color=np.asarray(plotcolors).ravel(), s=3, zorder=2)
+                   color=list(colors[tie_line_phases.ravel()]), s=3, zorder=2)
 
 
     # position the phase legend
@@ -59,7 +128,7 @@ def _binplot_setup(ax, phases, tie_lines, tie_line_colors, tie_line_widths):
     return ax
 
 def binplot(dbf, comps, phases, x_variable, low_temp, high_temp,
-            steps=None, ax=None, **kwargs):
+            steps=None, ax=None, mode='hull', processes=None, **kwargs):
     """
     Calculate the binary isobaric phase diagram for the given temperature
     range.
@@ -81,6 +150,25 @@ def binplot(dbf, comps, phases, x_variable, low_temp, high_temp,
     steps : int, optional
         Number of temperature steps to take between `low_temp` and `high_temp`.
     ax : Matplotlib Axes object, optional
+    mode : ['hull', 'trace'], optional
+        'hull' finds the tie-lines from the lower convex hull of the
+        sampled energy surface at each temperature. 'trace' follows the
+        two-phase boundaries in temperature with equilibrium calculations
+        (see pycalphad.eq.boundaries), giving boundary compositions to
+        solver precision and marking invariant reactions in red.
+    processes : int, optional
+        In 'hull' mode, number of worker processes to find the tie-lines
+        of each temperature with. The energy surface is shared with the
+        workers rather than copied to each of them. By default, all
+        temperatures are handled in this process. isotherm() has no such
+        option, since it calculates a single temperature.
+    cache_dir : string, optional
+        Directory for storing sampled energy surfaces on disk (see
+        energy_surf). In 'hull' mode, the tie-lines of each temperature
+        are found from the memory-mapped blocks of that temperature, so
+        that the surface is neither copied into memory nor, with
+        `processes`, into each worker. In 'trace' mode, it is passed to
+        the equilibrium calculations.
     pdens : int, optional
         Number of points to sample per sublattice, per degree of freedom.
     ast : ['numpy', 'numexpr'], optional
@@ -95,9 +183,6 @@ def binplot(dbf, comps, phases, x_variable, low_temp, high_temp,
     None yet.
     """
     assert high_temp > low_temp
-    tie_lines = []
-    tie_line_colors = []
-    tie_line_widths = []
     tsteps = steps or int((high_temp-low_temp) / 10) # Take 10 K steps by def.
     temps = np.array(np.linspace(low_temp, high_temp, num=tsteps),
                      dtype=np.float64)
@@ -108,123 +193,99 @@ def binplot(dbf, comps, phases, x_variable, low_temp, high_temp,
     try:
         pdens = kwargs.pop('pdens')
     except KeyError:
-        pdens = 1000 # points per d.o.f
-
-    # Calculate energy surface at each temperature
-    full_df = energy_surf(dbf, comps, phases, T=temps, pdens=pdens,
-                          **kwargs)
-    # Select only the P, T, etc., of interest
-    full_df = full_df.groupby('T', sort=False)
-    for temp, hull_frame in full_df:
-        # Calculate the convex hull for the desired points
-        hull_points = hull_frame[[x_variable, 'GM']].values
-        hull = None
+        pdens = 1000 if mode == 'hull' else 200 # points per d.o.f
+
+    if mode == 'trace':
+        traced, invariants = trace_boundaries(dbf, comps, phases,
+                                              x_variable, temps,
+                                              pdens=pdens, **kwargs)
+        tie_lines = np.array([[line[0][0:2], line[1][0:2]] for line in traced],
+                             dtype=np.float64).reshape(-1, 2, 2)
+        tie_line_phases = np.array([[phases.index(line[0][2]),
+                                     phases.index(line[1][2])] \
+            for line in traced], dtype=np.int).reshape(-1, 2)
+        return _binplot_finish(ax, comps, phases, x_variable, low_temp,
+                               high_temp, tie_lines, tie_line_phases,
+                               invariants)
+    elif mode != 'hull':
+        raise ValueError('Unknown binplot mode: ' + str(mode))
+
+    parallel = processes is not None and processes > 1
+    cache_dir = kwargs.pop('cache_dir', None)
+    if cache_dir is not None:
+        # Group the stored blocks by temperature; each task reads its own
+        path = energy_surf_cache(dbf, comps, phases, cache_dir, T=temps,
+                                 pdens=pdens, **kwargs)
+        temperature_blocks = {}
+        for position, (phase_name, columns) in \
+            enumerate(surfstore.read_surface(path)):
+            blocks, codes = temperature_blocks.setdefault(
+                float(columns['T'][0]), ([], []))
+            blocks.append(position)
+            codes.append(phases.index(phase_name))
+        tasks = [(path, x_variable, blocks, codes) for _, (blocks, codes) \
+            in sorted(temperature_blocks.items())]
+        worker = _stored_tie_lines
+        pool_args = dict()
+    else:
+        # Calculate energy surface at each temperature
+        full_df = energy_surf(dbf, comps, phases, T=temps, pdens=pdens,
+                              **kwargs)
+        # Order the points by temperature so that each slice is contiguous
+        order = np.argsort(full_df['T'].values, kind='mergesort')
+        arrays = {
+            'compositions': np.ascontiguousarray(
+                full_df[x_variable].values[order], dtype=np.float64),
+            'energies': np.ascontiguousarray(full_df['GM'].values[order],
+                                             dtype=np.float64),
+            'phase_codes': pd.Categorical(
+                full_df['Phase'].values[order],
+                categories=phases).codes.astype(np.int32),
+            'temperatures': np.ascontiguousarray(full_df['T'].values[order],
+                                                 dtype=np.float64)
+        }
+        del full_df
+        boundaries = np.r_[0, np.flatnonzero(np.diff(arrays['temperatures'])) \
+                           + 1, len(arrays['temperatures'])]
+        tasks = list(zip(boundaries[:-1], boundaries[1:]))
+        if parallel:
+            worker = _hull_worker
+            pool_args = dict(initializer=_init_hull_worker, initargs=(
+                _shared_copy(arrays['compositions'], 'd'),
+                _shared_copy(arrays['energies'], 'd'),
+                _shared_copy(arrays['phase_codes'], 'i'),
+                _shared_copy(arrays['temperatures'], 'd')))
+        else:
+            worker = lambda bounds: _slice_tie_lines(arrays, bounds)
+    if parallel:
+        pool = multiprocessing.Pool(processes, **pool_args)
+        chunksize = max(1, len(tasks) // (4 * processes))
         try:
-            hull = scipy.spatial.ConvexHull(
-                hull_points, qhull_options='QJ'
-            )
-            del hull_points
-        except RuntimeError:
-            print('temperature: '+str(temp))
-            raise
-        # keep track of tie line orientations
-        # this is for invariant reaction detection
-        tieline_normals = []
-        current_tielines = []
-
-        # this was factored out of the loop based on profiling
-        coordinates = hull_frame.iloc[np.asarray(hull.simplices).ravel()].values
-        # Reshape coordinates into rank 3 ndarray of simplex coordinates
-        # Each point is ordered as: Energy, Phase Name, Coordinates
-        coordinates.shape = (len(hull.simplices), len(hull.simplices[0]),
-                             len(coordinates[0]))
-        columns = list(hull_frame.columns)
-
-        for coords, equ in \
-            zip(coordinates, hull.equations):
-            if equ[-2] > -1e-6:
-                # simplex oriented 'upwards' in energy direction
-                # must not be part of the energy surface
-                continue
-            #distances = scipy.spatial.distance.pdist(coords)
-            #simplex_edges = \
-            #    np.asarray(list(itertools.combinations(simplex, 2)))
-            #phase_edge_list = hull_frame['Phase'].values[simplex_edges]
-            #edge_phases_match = \
-            ##    np.array(phase_edge_list[:, 0] == phase_edge_list[:, 1])
-            #new_lines = simplex_edges
-            # Check if this is a two phase region
-            first_endpoint = coords[0]
-            second_endpoint = coords[1]
-            phases_match = first_endpoint[columns.index('Phase')] == \
-                second_endpoint[columns.index('Phase')]
-
-            if phases_match:
-                # Is this a miscibility gap region?
-                # Check that the average of the tieline energy is less than
-                # the energy calculated at the midpoint
-                # If not, this is a single-phase region and should be dropped
-                #phase_name = first_endpoint[columns.index('Phase')]
-                #input_cols = [x for x in hull_frame.columns if phase_name in x]
-                #midpoint = np.mean([first_endpoint.ix[input_cols].values, \
-                #    second_endpoint.ix[input_cols].values], axis=0)
-                # chebyshev distance returns maximum difference between any
-                # dimension
-                #pxd = scipy.spatial.distance.chebyshev(
-                #    first_endpoint.ix[input_cols].values, \
-                #    second_endpoint.ix[input_cols].values)
-                pxd = scipy.spatial.distance.chebyshev(
-                    first_endpoint[columns.index(x_variable)], \
-                    second_endpoint[columns.index(x_variable)])
-                if pxd < 0.03:
-                    continue
-                # energy at midpoint
-                #midpoint_nrg = nrg[phase_name](*midpoint)
-                # average energy of endpoints
-                #average_nrg = (0.5 * (first_endpoint.ix['GM'] + \
-                #    second_endpoint.ix['GM']))
-                #if average_nrg >= midpoint_nrg:
-                #    # not a true tieline, drop this simplex
-                #    continue
-            # if we get here, this is a miscibility gap region or a
-            # two-phase region
-            current_tielines.append(
-                [[first_endpoint[columns.index(x_variable)], temp, \
-                        first_endpoint[columns.index('Phase')]], \
-                    [second_endpoint[columns.index(x_variable)], temp, \
-                        second_endpoint[columns.index('Phase')]]]
-                )
-            tieline_norm = equ[:-1]
-            tieline_normals.append(tieline_norm)
-
-            # enumerate all normals but the one we just added
-            for idx, normal in enumerate(tieline_normals[:-1]):
-                continue
-                dihedral = np.dot(normal, tieline_norm)
-                if dihedral > (1.0 - 1e-11):
-                    # nearly coplanar: we are near a 3-phase boundary
-                    # red for an invariant
-                    tie_lines.append(current_tielines[-1])
-                    tie_lines.append(current_tielines[idx])
-                    # prevent double counting
-                    #del current_tielines[idx]
-                    #del current_tielines[-1]
-                    tie_line_colors.append([1, 0, 0, 1])
-                    tie_line_widths.append(2)
-                    tie_line_colors.append([1, 0, 0, 1])
-                    tie_line_widths.append(2)
-
-            for line in current_tielines:
-                # Green for a tie line
-                tie_lines.append(line)
-                tie_line_colors.append([0, 1, 0, 1])
-                tie_line_widths.append(0.5)
-
-    tie_lines = np.asarray(tie_lines)
+            results = pool.map(worker, tasks, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [worker(task) for task in tasks]
+    tie_lines = np.concatenate([lines for lines, _ in results])
+    tie_line_phases = np.concatenate([codes for _, codes in results])
+    return _binplot_finish(ax, comps, phases, x_variable, low_temp, high_temp,
+                           tie_lines, tie_line_phases)
 
+def _binplot_finish(ax, comps, phases, x_variable, low_temp, high_temp,
+                    tie_lines, tie_line_phases, invariants=None):
+    "Draw the tie-lines and invariants, and label the binary phase diagram."
     if ax is None:
         ax = plt.gca()
-    ax = _binplot_setup(ax, phases, tie_lines, tie_line_colors, tie_line_widths)
+    # Green for a tie line
+    ax = _binplot_setup(ax, phases, tie_lines, tie_line_phases,
+                        [[0, 1, 0, 1]] * len(tie_lines),
+                        [0.5] * len(tie_lines))
+    if invariants:
+        # Red for an invariant
+        ax.add_collection(mc.LineCollection(
+            [[line[0][0:2], line[1][0:2]] for line in invariants],
+            color=[1, 0, 0, 1], linewidth=2, zorder=1))
     plot_title = '-'.join([x.title() for x in sorted(comps) if x != 'VA'])
     ax.set_title(plot_title, fontsize=20)
     ax.set_xlim([-0.01, 1.01])
@@ -0,0 +1,472 @@
+"""
+The simplify module rewrites the symbolic Gibbs energy of a Model into a
+smaller canonical form before it is compiled.
+
+Model builds its energy as the sum of the reference, ideal mixing, excess,
+magnetic and ordering contributions, each divided by the same site ratio
+normalization and each multiplying site fraction products by temperature
+dependent parameters. Here the energy is split into those products, terms
+are collected by their site fraction dependence, parameters sharing the
+same temperature breakpoints are merged into a single Piecewise, and
+every normalization is divided out once.
+
+For fast evaluation over many temperatures, the breakpoints of all
+parameters can also be merged into one set of temperature intervals, and
+the energy in each interval split into numeric coefficients of a small
+basis of functions of T, such as T*log(T) or T**-9.
+"""
+
+from __future__ import division
+from sympy import Add, And, Dummy, Float, Mul, Piecewise, Pow, Rational, S, log
+import numpy as np
+from sympy.core.relational import Relational
+import pycalphad.variables as v
+
+# Placeholder for Piecewise functions outside of their temperature range
+_UNDEFINED = Dummy('undefined')
+
+def _is_separable(expr):
+    """
+    Return True if `expr` is a sum mixing site fraction dependent terms
+    with parameters, so that it should be split into those terms.
+    """
+    if not expr.is_Add:
+        return False
+    return expr.has(v.SiteFraction) and \
+        any(not arg.has(v.SiteFraction) or arg.is_Mul and \
+            any(not factor.has(v.SiteFraction) for factor in arg.args) \
+            for arg in expr.args)
+
+def _is_plain_factor(expr):
+    """
+    Return True if `expr` is cheap to repeat in every term of a product
+    distributed over a sum: a parameter, a site fraction (or a power of
+    one) or a denominator.
+    """
+    if not expr.has(v.SiteFraction) or isinstance(expr, v.SiteFraction):
+        return True
+    return expr.is_Pow and (expr.exp.is_negative or \
+        isinstance(expr.base, v.SiteFraction))
+
+def _expand_terms(expr):
+    "Return the list of products whose sum is `expr`."
+    if expr.is_Add:
+        return [term for arg in expr.args for term in _expand_terms(arg)]
+    if expr.is_Mul:
+        separable = [factor for factor in expr.args if _is_separable(factor)]
+        # Distributing over several sums, or repeating large factors in
+        # every term, would grow the expression instead
+        if len(separable) == 1 and all(_is_plain_factor(factor) \
+                for factor in expr.args if factor is not separable[0]):
+            rest = Mul(*[factor for factor in expr.args \
+                if factor is not separable[0]])
+            return [rest * term for term in _expand_terms(separable[0])]
+    return [expr]
+
+def _split_term(term):
+    """
+    Split a product into its denominator, its site fraction dependent
+    factor and its remaining coefficient.
+    """
+    denominator = []
+    sitefrac_factor = []
+    coefficient = []
+    for factor in Mul.make_args(term):
+        if not factor.has(v.SiteFraction):
+            coefficient.append(factor)
+        elif factor.is_Pow and factor.exp.is_negative:
+            denominator.append(Pow(factor.base, -factor.exp))
+        else:
+            sitefrac_factor.append(factor)
+    return Mul(*denominator), Mul(*sitefrac_factor), Mul(*coefficient)
+
+def merge_piecewise(terms):
+    """
+    Sum a list of expressions, merging those which are (multiples of)
+    Piecewise functions with identical conditions into one Piecewise.
+
+    Parameters
+    ----------
+    terms : list
+        SymPy expressions to be summed.
+
+    Returns
+    -------
+    SymPy expression equal to the sum of `terms`.
+
+    Examples
+    --------
+    >>> merge_piecewise([Piecewise((T, T < 1000)), 2*Piecewise((1, T < 1000))])
+    Piecewise((T + 2, T < 1000))
+    """
+    groups = {}
+    order = []
+    others = []
+    for term in terms:
+        factors = Mul.make_args(term)
+        pieces = [factor for factor in factors \
+            if isinstance(factor, Piecewise)]
+        if len(pieces) != 1:
+            others.append(term)
+            continue
+        conditions = tuple(cond for _, cond in pieces[0].args)
+        if conditions not in groups:
+            groups[conditions] = []
+            order.append(conditions)
+        groups[conditions].append((term, factors, pieces[0]))
+    merged = []
+    for conditions in order:
+        if len(groups[conditions]) == 1:
+            merged.append(groups[conditions][0][0])
+            continue
+        branches = [S.Zero] * len(conditions)
+        for _, factors, piece in groups[conditions]:
+            scale = Mul(*[factor for factor in factors if factor != piece])
+            for idx, (expr, _) in enumerate(piece.args):
+                branches[idx] += scale * expr
+        merged.append(Piecewise(*zip(branches, conditions)))
+    return Add(*(merged + others))
+
+def canonicalize(expr):
+    """
+    Rewrite a Gibbs energy expression into a smaller, equivalent form.
+    Terms are collected by their site fraction dependence, temperature
+    dependent parameters with identical breakpoints are merged, and each
+    distinct normalization is divided out once.
+
+    Parameters
+    ----------
+    expr : SymPy object
+        Energy expression, e.g., Model.ast.
+
+    Returns
+    -------
+    Equivalent SymPy object.
+
+    Examples
+    --------
+    >>> mod = Model(dbf, ['AL', 'FE', 'VA'], 'FCC_A1')
+    >>> energy = canonicalize(mod.ast)
+    """
+    collected = {}
+    for term in _expand_terms(expr):
+        denominator, sitefrac_factor, coefficient = _split_term(term)
+        collected.setdefault(denominator, {}) \
+            .setdefault(sitefrac_factor, []).append(coefficient)
+    result = []
+    for denominator, sitefrac_terms in collected.items():
+        # Site fraction factors sharing the same parameter are summed first
+        by_parameter = {}
+        for sitefrac_factor, coefficients in sitefrac_terms.items():
+            by_parameter.setdefault(merge_piecewise(coefficients), []) \
+                .append(sitefrac_factor)
+        numerator = Add(*[parameter * Add(*sitefrac_factors) \
+            for parameter, sitefrac_factors in by_parameter.items()])
+        result.append(numerator / denominator)
+    return Add(*result)
+
+def _is_temperature_piecewise(expr):
+    "Return True if `expr` is a Piecewise whose conditions only involve T."
+    return isinstance(expr, Piecewise) and \
+        all(cond.free_symbols <= set([v.T]) for _, cond in expr.args)
+
+def _temperature_breakpoints(expr):
+    "Return the sorted temperatures at which any Piecewise in T changes."
+    breakpoints = set()
+    for piece in expr.atoms(Piecewise):
+        if not _is_temperature_piecewise(piece):
+            continue
+        for _, cond in piece.args:
+            for relation in cond.atoms(Relational):
+                bound = relation.rhs if relation.lhs == v.T else relation.lhs
+                breakpoints.add(float(bound))
+    return sorted(breakpoints)
+
+def _select_branch(piece, temperature):
+    "Return the branch of a Piecewise in T taken at `temperature`."
+    for expr, cond in piece.args:
+        if cond.subs(v.T, temperature) == True: #pylint: disable=C0121
+            return expr
+    # Piecewise functions are undefined outside of their conditions
+    return _UNDEFINED
+
+def _float_large_rationals(expr):
+    """
+    Convert rational numbers too large for machine integers to floats.
+    Substituting exact parameters, e.g., a Curie temperature, into powers
+    creates them, and numpy would fall back to slow object arrays.
+    """
+    limit = 2**53
+    large = dict((number, Float(number)) for number in expr.atoms(Rational) \
+        if abs(number.p) > limit or number.q > limit)
+    return expr.xreplace(large) if len(large) > 0 else expr
+
+def _interval_midpoints(breakpoints):
+    """
+    Return the (low, high, midpoint) of each temperature interval formed
+    by the sorted `breakpoints`, including the two unbounded intervals.
+    """
+    bounds = [-float('inf')] + breakpoints + [float('inf')]
+    intervals = []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        if low == -float('inf'):
+            temperature = high - 1
+        elif high == float('inf'):
+            temperature = low + 1
+        else:
+            temperature = 0.5 * (low + high)
+        intervals.append((low, high, temperature))
+    return intervals
+
+def merge_temperature_breakpoints(expr):
+    """
+    Rewrite an expression containing Piecewise functions of temperature,
+    each with its own breakpoints, as a single Piecewise over the disjoint
+    temperature intervals formed by the union of all breakpoints. Within
+    each interval, every Piecewise is replaced by the branch it takes
+    there, leaving a polynomial in T.
+
+    Parameters
+    ----------
+    expr : SymPy object
+        Energy expression, e.g., Model.ast.
+
+    Returns
+    -------
+    Piecewise with one branch per temperature interval, each with a
+    condition of the form And(low <= T, T < high). Intervals where the
+    expression is undefined are left out. If `expr` does not depend on
+    any Piecewise in T, it is returned unchanged.
+
+    Examples
+    --------
+    >>> mod = Model(dbf, ['AL', 'FE', 'VA'], 'FCC_A1')
+    >>> energy = merge_temperature_breakpoints(mod.ast)
+    """
+    breakpoints = _temperature_breakpoints(expr)
+    if len(breakpoints) == 0:
+        return expr
+    # Inner Piecewise functions are handled before those containing them
+    pieces = sorted([piece for piece in expr.atoms(Piecewise) \
+        if _is_temperature_piecewise(piece)],
+        key=lambda piece: len(piece.atoms(Piecewise)))
+    expr_cond_pairs = []
+    for low, high, temperature in _interval_midpoints(breakpoints):
+        branches = {}
+        for piece in pieces:
+            branches[piece] = \
+                _select_branch(piece, temperature).xreplace(branches)
+        body = expr.xreplace(branches)
+        if body.has(_UNDEFINED):
+            continue
+        body = _float_large_rationals(body)
+        if low == -float('inf'):
+            cond = And(v.T < high)
+        elif high == float('inf'):
+            cond = And(low <= v.T)
+        else:
+            cond = And(low <= v.T, v.T < high)
+        expr_cond_pairs.append((body, cond))
+    return Piecewise(*expr_cond_pairs)
+
+def temperature_intervals(expr):
+    """
+    Split a (nested list of) Piecewise functions of temperature, such as
+    those produced by merge_temperature_breakpoints() and their
+    derivatives, into one body per temperature interval.
+
+    Parameters
+    ----------
+    expr : SymPy object or (nested) list of SymPy objects
+        Expressions to split. Each must either be a Piecewise whose
+        conditions only involve T or not depend on any such Piecewise.
+
+    Returns
+    -------
+    A tuple (lower_bounds, upper_bounds, bodies), where bodies has one
+    entry per interval with the same nesting as `expr`, or None if `expr`
+    is not of this form. Intervals where any Piecewise is undefined are
+    left out.
+    """
+    def _leaves(item):
+        "Return the expressions in a nested list."
+        if isinstance(item, (list, tuple)):
+            return [leaf for subitem in item for leaf in _leaves(subitem)]
+        return [item]
+    leaves = _leaves(expr)
+    breakpoints = set()
+    for leaf in leaves:
+        if _is_temperature_piecewise(leaf):
+            # Derivatives may have merged branches with equal expressions,
+            # so conditions are not compared, only their breakpoints
+            breakpoints.update(_temperature_breakpoints(
+                Piecewise(*[(S.Zero, cond) for _, cond in leaf.args])))
+        elif any(_is_temperature_piecewise(piece) \
+                 for piece in getattr(leaf, 'atoms', lambda x: [])(Piecewise)):
+            return None
+    if len(breakpoints) == 0:
+        return None
+
+    def _branch(item, temperature):
+        "Take the branch of every Piecewise in a nested list at temperature."
+        if isinstance(item, (list, tuple)):
+            return [_branch(subitem, temperature) for subitem in item]
+        if _is_temperature_piecewise(item):
+            return _select_branch(item, temperature)
+        return item
+    lower_bounds = []
+    upper_bounds = []
+    bodies = []
+    for low, high, temperature in _interval_midpoints(sorted(breakpoints)):
+        body = _branch(expr, temperature)
+        if any(getattr(leaf, 'has', lambda x: False)(_UNDEFINED) \
+               for leaf in _leaves(body)):
+            continue
+        lower_bounds.append(low)
+        upper_bounds.append(high)
+        bodies.append(body)
+    if len(bodies) == 0:
+        return None
+    return lower_bounds, upper_bounds, bodies
+
+def _temperature_polynomial(expr):
+    """
+    Write a function of T alone as a sum of numeric multiples of
+    T**n * log(T)**m. Return a dict mapping (n, m) to the coefficient,
+    or None if `expr` is not of this form.
+    """
+    if expr.is_number:
+        return {(0, 0): expr}
+    if expr == v.T:
+        return {(1, 0): S.One}
+    if isinstance(expr, log) and expr.args[0] == v.T:
+        return {(0, 1): S.One}
+    if expr.is_Add or expr.is_Mul:
+        polynomials = [_temperature_polynomial(arg) for arg in expr.args]
+        if any(poly is None for poly in polynomials):
+            return None
+        result = polynomials[0]
+        for poly in polynomials[1:]:
+            result = _combine_polynomials(result, poly, expr.is_Add)
+        return result
+    if expr.is_Pow and expr.exp.is_Integer:
+        if expr.base == v.T:
+            return {(int(expr.exp), 0): S.One}
+        if expr.exp.is_positive:
+            base = _temperature_polynomial(expr.base)
+            if base is None:
+                return None
+            result = base
+            for _ in range(int(expr.exp) - 1):
+                result = _combine_polynomials(result, base, False)
+            return result
+    return None
+
+def _combine_polynomials(first, second, add):
+    "Return the sum (if `add`) or product of two polynomials in the basis."
+    if add:
+        result = dict(first)
+        for key, value in second.items():
+            result[key] = result.get(key, S.Zero) + value
+        return result
+    result = {}
+    for (first_n, first_m), first_value in first.items():
+        for (second_n, second_m), second_value in second.items():
+            key = (first_n + second_n, first_m + second_m)
+            result[key] = result.get(key, S.Zero) + first_value * second_value
+    return result
+
+def _basis_terms(expr):
+    """
+    Split an expression without Piecewise functions of T into a list of
+    (polynomial, factor) pairs, where polynomial is as returned by
+    _temperature_polynomial() and factor does not depend on T. Terms which
+    cannot be split are returned with a polynomial of None.
+    """
+    if expr.is_Add:
+        return [term for arg in expr.args for term in _basis_terms(arg)]
+    factors = Mul.make_args(expr)
+    free = [factor for factor in factors if not factor.has(v.T)]
+    dependent = [factor for factor in factors if factor.has(v.T)]
+    polynomial = {(0, 0): S.One}
+    for idx, factor in enumerate(dependent):
+        factor_poly = None
+        if not factor.free_symbols - set([v.T]):
+            factor_poly = _temperature_polynomial(factor)
+        if factor_poly is None:
+            if factor.is_Add:
+                # Sums mixing T and site fractions are distributed
+                rest = Mul(*(free + dependent[:idx] + dependent[idx+1:]))
+                return [term for arg in factor.args \
+                        for term in _basis_terms(rest * arg)]
+            return [(None, expr)]
+        polynomial = _combine_polynomials(polynomial, factor_poly, False)
+    return [(polynomial, Mul(*free))]
+
+def temperature_basis(expr):
+    """
+    Decompose an energy expression, within each temperature interval of
+    its parameters, into numeric coefficients of functions of T times
+    functions of the other variables:
+    sum_ij coefficients[k, i, j] * features[i] * T**n_j * log(T)**m_j,
+    plus a residual for the terms which are not of this form (e.g., the
+    magnetic contribution). The features are shared by all intervals, so
+    that for a fixed set of points they only have to be computed once.
+
+    Parameters
+    ----------
+    expr : SymPy object
+        Energy expression, e.g., Model.ast.
+
+    Returns
+    -------
+    A tuple containing:
+    (1) list of the lower temperature bound of each interval
+    (2) list of the upper temperature bound of each interval
+    (3) list of the (n, m) exponents of T and log(T) of each basis function
+    (4) list of SymPy expressions of the features, free of T
+    (5) ndarray of coefficients with shape (intervals, features, basis)
+    (6) list of SymPy expressions of the residual in each interval
+
+    Examples
+    --------
+    >>> mod = Model(dbf, ['AL', 'FE', 'VA'], 'FCC_A1')
+    >>> lower, upper, basis, features, coefficients, residuals = \\
+    ...     temperature_basis(mod.ast)
+    """
+    intervals = temperature_intervals(merge_temperature_breakpoints(expr))
+    if intervals is None:
+        intervals = ([-float('inf')], [float('inf')], [expr])
+    lower_bounds, upper_bounds, bodies = intervals
+    basis = []
+    basis_indices = {}
+    features = []
+    feature_indices = {}
+    # Coefficients of each interval as {(feature, basis): value}
+    interval_terms = []
+    residuals = []
+    for body in bodies:
+        terms = {}
+        residual = []
+        for polynomial, factor in _basis_terms(body):
+            if polynomial is None:
+                residual.append(factor)
+                continue
+            scale, feature = factor.as_coeff_Mul()
+            if feature not in feature_indices:
+                feature_indices[feature] = len(features)
+                features.append(feature)
+            for key, value in polynomial.items():
+                if key not in basis_indices:
+                    basis_indices[key] = len(basis)
+                    basis.append(key)
+                index = (feature_indices[feature], basis_indices[key])
+                terms[index] = terms.get(index, 0.0) + float(scale * value)
+        interval_terms.append(terms)
+        residuals.append(Add(*residual))
+    coefficients = np.zeros((len(bodies), len(features), len(basis)))
+    for idx, terms in enumerate(interval_terms):
+        for index, value in terms.items():
+            coefficients[(idx,) + index] = value
+    return lower_bounds, upper_bounds, basis, features, coefficients, \
+        residuals
@@ -4,8 +4,15 @@ correct abstract syntax tree for the energy.
 """
 
 import nose.tools
+import numpy as np
 from pycalphad import Database, Model
 from pycalphad.eq.utils import make_callable
+from pycalphad.eq.tbasis import TemperatureBasis
+from pycalphad.eq.magnetic import MagneticEnergy, energy_callable, \
+    energy_callables
+from pycalphad.eq.ordering import OrderingEnergy
+from pycalphad.eq.redlich_kister import RedlichKister, excess_callables
+from pycalphad.tests.utils import random_site_fractions, check_derivatives
 import pycalphad.variables as v
 
 TDB_TEST_STRING = """
@@ -428,6 +435,171 @@ def test_quaternary():
              v.SiteFraction('B2', 1, 'VA'): 1e-12}, \
         -42368.27, mode='numpy')
 
+def test_canonicalize():
+    "Canonicalized energy matches the original for an ordered phase."
+    point = {v.T: 500, v.SiteFraction('B2', 0, 'AL'): 4.03399e-9,
+             v.SiteFraction('B2', 0, 'CR'): 2.65798e-4,
+             v.SiteFraction('B2', 0, 'NI'): 9.99734e-1,
+             v.SiteFraction('B2', 0, 'VA'): 2.68374e-9,
+             v.SiteFraction('B2', 1, 'AL'): 3.75801e-1,
+             v.SiteFraction('B2', 1, 'CR'): 1.20732e-1,
+             v.SiteFraction('B2', 1, 'NI'): 5.03467e-1,
+             v.SiteFraction('B2', 1, 'VA'): 1e-12}
+    check_energy(Model(DBF, ['AL', 'CR', 'NI', 'VA'], 'B2',
+                       canonicalize=True), point, -42368.27, mode='numpy')
+    check_energy(Model(DBF, ['AL', 'CR', 'NI'], 'L12_FCC', canonicalize=True),
+                 {v.T: 300, v.SiteFraction('L12_FCC', 0, 'AL'): 5.42883e-8,
+                  v.SiteFraction('L12_FCC', 0, 'CR'): 2.07934e-6,
+                  v.SiteFraction('L12_FCC', 0, 'NI'): 9.99998e-1,
+                  v.SiteFraction('L12_FCC', 1, 'AL'): 7.49998e-1,
+                  v.SiteFraction('L12_FCC', 1, 'CR'): 2.50002e-1,
+                  v.SiteFraction('L12_FCC', 1, 'NI'): 4.55313e-10},
+                 -40717.204, mode='numpy')
+
+def test_merge_breakpoints():
+    "Energy with merged temperature breakpoints matches the original."
+    original = Model(DBF, ['AL', 'CR', 'NI'], 'L12_FCC')
+    merged = Model(DBF, ['AL', 'CR', 'NI'], 'L12_FCC', merge_breakpoints=True)
+    point = {v.SiteFraction('L12_FCC', 0, 'AL'): 5.42883e-8,
+             v.SiteFraction('L12_FCC', 0, 'CR'): 2.07934e-6,
+             v.SiteFraction('L12_FCC', 0, 'NI'): 9.99998e-1,
+             v.SiteFraction('L12_FCC', 1, 'AL'): 7.49998e-1,
+             v.SiteFraction('L12_FCC', 1, 'CR'): 2.50002e-1,
+             v.SiteFraction('L12_FCC', 1, 'NI'): 4.55313e-10}
+    # Each energy is compiled once and evaluated at all temperatures
+    sitefracs = sorted(point.keys(), key=str)
+    temperatures = np.array([300., 800., 1500., 2500.])
+    args = [temperatures] + [np.repeat(point[x], len(temperatures)) \
+        for x in sitefracs]
+    energies = make_callable(merged.ast, [v.T] + sitefracs)(*args)
+    assert abs(1 - energies[0] / -40717.204) < 1e-5
+    assert np.allclose(energies,
+                       make_callable(original.ast, [v.T] + sitefracs)(*args),
+                       rtol=1e-5, atol=0)
+
+def test_temperature_basis():
+    "Energies from the temperature basis match those of the Model."
+    model = Model(DBF, ['AL', 'CR', 'NI', 'VA'], 'B2')
+    point = {v.SiteFraction('B2', 0, 'AL'): 4.03399e-9,
+             v.SiteFraction('B2', 0, 'CR'): 2.65798e-4,
+             v.SiteFraction('B2', 0, 'NI'): 9.99734e-1,
+             v.SiteFraction('B2', 0, 'VA'): 2.68374e-9,
+             v.SiteFraction('B2', 1, 'AL'): 3.75801e-1,
+             v.SiteFraction('B2', 1, 'CR'): 1.20732e-1,
+             v.SiteFraction('B2', 1, 'NI'): 5.03467e-1,
+             v.SiteFraction('B2', 1, 'VA'): 1e-12}
+    temperatures = [500, 800, 1500, 2500]
+    energies = TemperatureBasis(model, list(point.keys())) \
+        .sweep(temperatures, *list(point.values()))
+    assert abs(1 - energies[0, 0] / -42368.27) < 1e-5
+    for temp, energy in zip(temperatures, energies[:, 0]):
+        point[v.T] = temp
+        check_energy(model, point, energy, mode='numpy')
+
+def test_redlich_kister():
+    "Numeric excess energy and derivatives match those of the Model."
+    #pylint: disable=W0212
+    for phase_name in ['LIQUID', 'BCC_A2', 'B2']:
+        comps = ['AL', 'CR', 'NI', 'VA']
+        excess = RedlichKister.from_database(DBF, comps, phase_name)
+        model = Model(DBF, comps, phase_name)
+        symbols = model._database_symbols(DBF)
+        energy = model.excess_mixing_energy(DBF.phases[phase_name], symbols,
+                                            DBF.search).xreplace(symbols)
+        variables = [v.T] + excess.variables
+        site_fractions = random_site_fractions(10, len(excess.variables))
+        # One temperature for all points, and one temperature per point
+        for temp in [1000., np.linspace(500., 2000., len(site_fractions))]:
+            desired = make_callable(energy, variables)(temp,
+                                                       *site_fractions.T)
+            assert np.allclose(excess.energy(site_fractions, T=temp),
+                               desired)
+            check_derivatives(
+                lambda *y: excess.energy(np.transpose(y), T=temp),
+                lambda *y: excess.gradient(np.transpose(y), T=temp).T,
+                list(site_fractions.T))
+            check_derivatives(
+                lambda *y: excess.gradient(np.transpose(y), T=temp),
+                lambda *y: np.transpose(
+                    excess.hessian(np.transpose(y), T=temp), (1, 0, 2)),
+                list(site_fractions.T), rtol=1e-4, atol=1e-2)
+
+def test_numeric_excess():
+    "Models with numeric excess energy match the symbolic energy."
+    comps = ['CR', 'NI', 'VA']
+    # Ordered phases keep the symbolic excess energy
+    assert Model(DBF, comps, 'B2', numeric_excess=True).excess_terms is None
+    for phase_name in ['LIQUID', 'BCC_A2']:
+        model = Model(DBF, comps, phase_name, numeric_excess=True)
+        variables = [v.T] + sorted([x for x in model.variables \
+            if isinstance(x, v.SiteFraction)], key=str)
+        desired = make_callable(Model(DBF, comps, phase_name).ast, variables)
+        args = [1000.] + \
+            list(random_site_fractions(10, len(variables) - 1).T)
+        point = [arg[0] if idx > 0 else arg for idx, arg in enumerate(args)]
+        # The symbolic Hessian of the magnetic contribution is slow to build
+        for numeric_magnetic in [False, True]:
+            energy, gradient, hessian = excess_callables(
+                model, variables, hessian=numeric_magnetic,
+                numeric_magnetic=numeric_magnetic)
+            assert np.allclose(energy(*args), desired(*args))
+            check_derivatives(energy, gradient, point,
+                              indices=range(1, len(point)))
+        check_derivatives(gradient, hessian, point,
+                          indices=range(1, len(point)), rtol=1e-4, atol=1e-2)
+        assert np.allclose(make_callable(model.ast, variables)(*args),
+                           desired(*args))
+
+def test_ordering_energy():
+    "Composed order-disorder energy and derivatives match Model.ast."
+    model = Model(DBF, ['AL', 'NI', 'VA'], 'L12_FCC')
+    sitefracs = sorted([x for x in model.variables \
+        if isinstance(x, v.SiteFraction)], key=str)
+    variables = [v.T] + sitefracs
+    energy = OrderingEnergy(model, variables)
+    args = [1000.] + list(random_site_fractions(10, len(sitefracs)).T)
+    desired = make_callable(model.ast, variables)(*args)
+    assert model.variables == model.ast.atoms(v.StateVariable)
+    assert np.allclose(energy(*args), desired)
+    check_derivatives(energy, energy.gradient, args,
+                      indices=range(1, len(args)))
+    check_derivatives(energy.gradient, energy.hessian, args,
+                      indices=range(1, len(args)), rtol=1e-4, atol=1e-2)
+
+@nose.tools.raises(ValueError)
+def test_ordering_energy_disordered_phase():
+    "OrderingEnergy requires an atomic ordering contribution."
+    OrderingEnergy(Model(DBF, ['CR', 'NI'], 'LIQUID'), [v.T])
+
+def test_magnetic_energy():
+    "Numeric IHJ energy and its derivatives match those of the Model."
+    model = Model(DBF, ['CR', 'NI'], 'BCC_A2')
+    variables = [v.T] + sorted([x for x in model.ast.free_symbols \
+        if isinstance(x, v.SiteFraction)], key=str)
+    magnetic = MagneticEnergy(model, variables)
+    site_fractions = random_site_fractions(10, len(variables) - 1)
+    # Below and above the Curie temperature
+    for temp in [300., 1500.]:
+        args = [temp] + list(site_fractions.T)
+        desired = make_callable(model.magnetic_terms['energy'],
+                                variables)(*args)
+        assert np.allclose(magnetic(*args), desired)
+        assert np.allclose(energy_callable(model, variables)(*args),
+                           make_callable(model.ast, variables)(*args))
+        check_derivatives(magnetic, magnetic.gradient, args)
+        check_derivatives(magnetic.gradient, magnetic.hessian, args,
+                          rtol=1e-4, atol=1e-2)
+        # Energy, gradient and Hessian sharing one evaluator, at one point
+        energy, gradient, hessian = energy_callables(
+            model, variables, wrt=variables[1:], hessian=True)
+        point = [arg[0] if idx > 0 else arg for idx, arg in enumerate(args)]
+        assert np.allclose(energy(*point),
+                           make_callable(model.ast, variables)(*point))
+        check_derivatives(energy, gradient, point,
+                          indices=range(1, len(point)))
+        check_derivatives(gradient, hessian, point,
+                          indices=range(1, len(point)), rtol=1e-4, atol=1e-2)
+
 # EXCEPTION TESTS
 @nose.tools.raises(Exception)
 def test_negative_site_fraction():
@@ -5,6 +5,14 @@ the energy surface correctly.
 
 import nose.tools
 from pycalphad import Database, energy_surf
+from pycalphad.eq.energy_surf import energy_surf_chunks
+from pycalphad.eq.geometry import prune_energy_surf
+from pycalphad.eq import surfstore
+import numpy as np
+import pandas as pd
+import os
+import shutil
+import tempfile
 
 TDB_TEST_STRING = """
 ELEMENT /-          ELECTRON_GAS         0         0         0 !
@@ -241,4 +249,81 @@ DBF = Database(TDB_TEST_STRING)
 
 def test_surface():
     energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC'],
-                T=1273, pdens=10, mode='numpy')
\ No newline at end of file
+                T=1273, pdens=10, mode='numpy')
+
+def test_surface_chunks():
+    "Chunked energy surface matches the full energy surface."
+    full = energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                       T=[1000, 1273], pdens=10, mode='numpy')
+    chunks = list(energy_surf_chunks(DBF, ['AL', 'CR', 'NI'],
+                                     ['L12_FCC', 'LIQUID'], T=[1000, 1273],
+                                     pdens=10, mode='numpy', chunksize=7))
+    assert all(len(chunk) <= 7 for chunk in chunks)
+    assert all(len(set(chunk['Phase'])) == 1 for chunk in chunks)
+    assert all(len(set(chunk['T'])) == 1 for chunk in chunks)
+    joined = pd.concat(chunks, axis=0, join='outer', ignore_index=True)
+    pd.util.testing.assert_frame_equal(full, joined)
+
+def test_surface_temperature_sweep():
+    "Energy surface evaluated by temperature sweep matches the original."
+    full = energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                       T=[1000, 1273], P=101325, pdens=10, mode='numpy')
+    swept = energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                        T=[1000, 1273], P=101325, pdens=10, mode='numpy',
+                        temperature_sweep=True)
+    pd.util.testing.assert_frame_equal(full, swept)
+
+def test_surface_numeric_magnetic():
+    "Energy surface with numeric magnetic contributions matches the original."
+    comps = ['AL', 'CR', 'NI', 'VA']
+    phases = ['BCC_A2', 'B2', 'FCC_A1']
+    full = energy_surf(DBF, comps, phases, T=[300, 1273], pdens=10,
+                       mode='numpy')
+    numeric = energy_surf(DBF, comps, phases, T=[300, 1273], pdens=10,
+                          mode='numpy', numeric_magnetic=True)
+    pd.util.testing.assert_frame_equal(full, numeric)
+
+def test_surface_cache():
+    "Energy surface loaded from the on-disk cache matches the original."
+    cache_dir = tempfile.mkdtemp()
+    try:
+        full = energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                           T=1273, pdens=10, mode='numpy')
+        first = energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                            T=1273, pdens=10, mode='numpy', cache_dir=cache_dir)
+        second = energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                             T=1273, pdens=10, mode='numpy',
+                             cache_dir=cache_dir)
+        pd.util.testing.assert_frame_equal(full, first)
+        pd.util.testing.assert_frame_equal(full, second)
+        # Stored energies are read as memory-mapped views
+        path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        for _, columns in surfstore.read_surface(path):
+            assert isinstance(columns['GM'].base, np.memmap)
+        # A different temperature must not reuse the stored surface
+        energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                    T=1000, pdens=10, mode='numpy', cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 2
+        # Nor must a different evaluation mode
+        energy_surf(DBF, ['AL', 'CR', 'NI'], ['L12_FCC', 'LIQUID'],
+                    T=1000, pdens=10, mode='numpy', cache_dir=cache_dir,
+                    temperature_sweep=True)
+        assert len(os.listdir(cache_dir)) == 3
+    finally:
+        shutil.rmtree(cache_dir)
+
+def test_surface_prune():
+    "Pruning the energy surface keeps the points on the lower convex hull."
+    comps = ['AL', 'CR', 'NI']
+    full = energy_surf(DBF, comps, ['L12_FCC', 'LIQUID'],
+                       T=[1000, 1273], pdens=100, mode='numpy')
+    pruned = prune_energy_surf(full, comps)
+    assert len(pruned) < len(full) / 2
+    for temp in (1000, 1273):
+        assert full.loc[full['T'] == temp, 'GM'].min() == \
+            pruned.loc[pruned['T'] == temp, 'GM'].min()
+        # Pure-component endmembers are always on the hull
+        for comp in comps:
+            pure = full.loc[(full['T'] == temp) & \
+                (full['X({0})'.format(comp)] > 1 - 1e-10), 'GM'].min()
+            assert pure in set(pruned.loc[pruned['T'] == temp, 'GM'])
@@ -3,10 +3,22 @@ The equilibrium test module verifies that the Equilibrium class produces the
 correct solution for thermodynamic equilibrium.
 """
 
+import os
+import shutil
+import tempfile
 import nose.tools
 from unittest.case import SkipTest
-from pycalphad import Database, Equilibrium
+from pycalphad import Database, Equilibrium, Model
 import pycalphad.variables as v
+from pycalphad.eq.utils import check_degenerate_phases
+from pycalphad.eq.geometry import binary_tie_lines, ternary_tie_simplices
+from pycalphad.eq.conditions import FixedPartialMolarQuantity
+from pycalphad.eq.boundaries import trace_boundaries
+from pycalphad.constraints import linear_balance_matrix, \
+    MoleFractionProjection
+from pycalphad.tests.utils import random_site_fractions, check_derivatives
+import numpy as np
+import pandas as pd
 
 ROSE_TEST_STRING = """
 ELEMENT H                 TEST    0      0    0  !
@@ -426,6 +438,262 @@ def test_eq_binary():
                       pdens=2000)
     check_close(eqx.result.energy, -9.608807e4)
 
+def test_eq_binary_pruned():
+    "Pruning and the driving force check do not change the equilibrium."
+    my_phases = ['LIQUID', 'FCC_A1', 'HCP_A3', 'AL5FE2',
+                 'AL2FE', 'AL13FE4', 'AL5FE4']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.55}
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1400.0,
+                      pdens=2000, prune_tol=1e-2, driving_force_tol=1e-3)
+    check_close(eqx.result.energy, -9.608807e4)
+
+def test_eq_surface_cache():
+    "Equilibria from a stored energy surface match the direct calculation."
+    my_phases = ['LIQUID', 'FCC_A1', 'HCP_A3', 'AL5FE2',
+                 'AL2FE', 'AL13FE4', 'AL5FE4']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.55}
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # The first calculation stores the surface, the second reads it
+        for _ in range(2):
+            eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1400.0,
+                              pdens=2000, cache_dir=cache_dir)
+            check_close(eqx.result.energy, -9.608807e4)
+            assert len(os.listdir(cache_dir)) == 1
+    finally:
+        shutil.rmtree(cache_dir)
+
+def test_eq_binary_newton():
+    "Binary two-phase point equilibrium calculation with the Newton solver."
+    my_phases = ['LIQUID', 'AL5FE2', 'AL2FE']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.7}
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1400.0,
+                      pdens=500, solver='newton')
+    check_close(eqx.result.energy, -9.321679e4)
+    assert sorted(phase.name for phase in eqx.result.phases) == \
+        ['AL2FE', 'AL5FE2']
+
+def test_eq_numeric_magnetic():
+    "Equilibrium with numeric magnetic contributions and derivatives."
+    my_phases = ['LIQUID', 'FCC_A1', 'HCP_A3', 'AL5FE2',
+                 'AL2FE', 'AL13FE4', 'AL5FE4']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.3}
+    # The Newton solver also uses the Hessians
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1000.0,
+                      pdens=500, solver='newton', numeric_magnetic=True)
+    check_close(eqx.result.energy, -6.270732e4)
+    assert [phase.name for phase in eqx.result.phases] == ['HCP_A3']
+
+def test_eq_numeric_excess():
+    "Equilibrium with numeric excess energies and derivatives."
+    my_phases = ['LIQUID', 'FCC_A1', 'HCP_A3', 'AL5FE2',
+                 'AL2FE', 'AL13FE4', 'AL5FE4']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.3}
+    models = dict((name, Model(ALFE_DBF, comps, name, numeric_excess=True)) \
+        for name in my_phases)
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1000.0,
+                      pdens=500, solver='newton', numeric_magnetic=True,
+                      model=models)
+    check_close(eqx.result.energy, -6.270732e4)
+    assert [phase.name for phase in eqx.result.phases] == ['HCP_A3']
+
+def test_eq_chemical_potentials():
+    "Chemical potentials from the solver multipliers."
+    my_phases = ['LIQUID', 'FCC_A1', 'HCP_A3', 'AL5FE2',
+                 'AL2FE', 'AL13FE4', 'AL5FE4']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.9}
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1400.0,
+                      pdens=2000)
+    potentials = eqx.result.chemical_potentials
+    # The molar energy lies on the tangent plane
+    check_close(0.9 * potentials['AL'] + 0.1 * potentials['FE'],
+                eqx.result.energy)
+    check_close(potentials['AL'], -7.618350e4)
+    check_close(potentials['FE'], -1.449893e5)
+    # The hull estimate is close to the refined value
+    for comp in ['AL', 'FE']:
+        assert abs(eqx.hull_potentials[comp] - potentials[comp]) < \
+            1e-2 * abs(potentials[comp])
+
+def test_eq_fixed_potential():
+    "Point equilibrium calculation with a fixed chemical potential."
+    my_phases = ['LIQUID', 'AL13FE4']
+    comps = ['AL', 'FE', 'VA']
+    # Chemical potential of AL in the liquid at X(AL) = 0.9
+    conds = [FixedPartialMolarQuantity(v.MU('AL'), -7.6183501e4)]
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1400.0,
+                      pdens=500, solver='newton')
+    check_close(eqx.result.mole_fractions['AL'], 0.9)
+    check_close(eqx.result.energy, -8.306408e4)
+    check_close(eqx.result.chemical_potentials['FE'], -1.449893e5)
+    assert [phase.name for phase in eqx.result.phases] == ['LIQUID']
+
+def test_eq_missing_composition_sets():
+    "Composition sets missing from a metastable solution are added."
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.7}
+    eqx = Equilibrium(ALFE_DBF, comps, ['LIQUID', 'AL5FE2', 'AL2FE'], conds,
+                      T=1400.0, pdens=500)
+    # Start from a single liquid vertex near the target composition
+    liquid = eqx.data[eqx.data['Phase'] == 'LIQUID']
+    closest = np.argmin(np.abs(liquid['X(AL)'].values - 0.7))
+    metastable = eqx.minimize(liquid.iloc[[closest]], [1.0])
+    assert np.max(eqx.driving_forces(metastable)) > 1e-2
+    # The check starts from the given result, not the most recent solve
+    eqx.minimize(liquid.iloc[[0]], [1.0])
+    stable = eqx.add_missing_composition_sets(metastable)
+    check_close(stable.energy, -9.321679e4)
+    assert np.max(eqx.driving_forces(stable)) < 1e-3
+
+def test_eq_step_temperature():
+    "Equilibria stepped in temperature match independent calculations."
+    my_phases = ['LIQUID', 'AL5FE2', 'AL2FE']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.7}
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1400.0,
+                      pdens=500)
+    # The two-phase region melts between 1420 K and 1440 K
+    results = eqx.step(v.T, [1400.0, 1420.0, 1440.0])
+    check_close(results[0].energy, eqx.result.energy)
+    check_close(results[1].energy, -9.460327e4)
+    check_close(results[2].energy, -9.614783e4)
+    assert [phase.name for phase in results[2].phases
+            if phase.volume_fraction > 1e-8] == ['LIQUID']
+
+def test_trace_boundaries():
+    "Two-phase boundaries traced in temperature match point calculations."
+    my_phases = ['LIQUID', 'AL5FE2', 'AL2FE']
+    comps = ['AL', 'FE', 'VA']
+    tie_lines, invariants = trace_boundaries(ALFE_DBF, comps, my_phases,
+                                             'X(AL)', [1380.0, 1400.0])
+    assert len(invariants) == 0
+    lines = [line for line in tie_lines if line[0][1] == 1400.0]
+    assert [[line[0][2], line[1][2]] for line in lines] == \
+        [['LIQUID', 'AL2FE'], ['AL2FE', 'AL5FE2'], ['AL5FE2', 'LIQUID']]
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, {v.X('AL'): 0.6},
+                      T=1400.0, pdens=500)
+    liquid = [phase for phase in eqx.result.phases if phase.name == 'LIQUID']
+    assert abs(liquid[0].mole_fractions['AL'] - lines[0][0][0]) < 1e-4
+
+def test_trace_invariant():
+    "The temperature of an invariant reaction is located by bisection."
+    my_phases = ['LIQUID', 'AL13FE4', 'AL5FE2']
+    comps = ['AL', 'FE', 'VA']
+    # AL13FE4 melts peritectically between 1425 K and 1426 K
+    _, invariants = trace_boundaries(ALFE_DBF, comps, my_phases, 'X(AL)',
+                                     [1420.0, 1430.0])
+    assert len(invariants) == 1
+    assert abs(invariants[0][0][1] - 1425.41) < 2e-2
+    check_close(invariants[0][0][0], 5.0 / 7.0)
+
+def test_eq_dataframe_interface():
+    "DataFrame-based starting simplex and minimization match the array path."
+    my_phases = ['LIQUID', 'FCC_A1', 'AL13FE4']
+    comps = ['AL', 'FE', 'VA']
+    conds = {v.X('AL'): 0.7}
+    eqx = Equilibrium(ALFE_DBF, comps, my_phases, conds, T=1400.0,
+                      pdens=200)
+    simplex, phase_fracs = eqx.get_starting_simplex()
+    check_close(eqx.minimize(simplex, phase_fracs).energy, eqx.result.energy)
+
+def test_degenerate_phases():
+    "Redundant vertices of the same phase are eliminated."
+    compositions = np.array([[0.1, 0.9], [0.15, 0.85], [0.12, 0.88],
+                             [0.5, 0.5], [0.9, 0.1]])
+    phase_codes = np.array([0, 0, 1, 0, 0])
+    assert check_degenerate_phases(compositions, mindist=0.1,
+                                   phase_codes=phase_codes) == [0, 2, 3, 4]
+    assert check_degenerate_phases(compositions, mindist=0.5,
+                                   phase_codes=phase_codes) == [0, 2, 4]
+    frame = pd.DataFrame({'Phase': ['A', 'A', 'B', 'A', 'A'],
+                          'X(AL)': compositions[:, 0],
+                          'X(FE)': compositions[:, 1]})
+    assert check_degenerate_phases(frame, mindist=0.1) == [0, 2, 3, 4]
+
+def test_linear_balance_matrix():
+    "Phase fraction and site fraction balances as a sparse matrix."
+    # Two composition sets: (f, y, y | y) and (f, y, y)
+    matrix, values = linear_balance_matrix([[0, 4], [4, 7]],
+                                           [[2, 1], [2]], 7)
+    assert matrix.shape == (4, 7)
+    assert np.all(values == 1)
+    assert np.all(matrix.toarray() == [[1, 0, 0, 0, 1, 0, 0],
+                                       [0, 1, 1, 0, 0, 0, 0],
+                                       [0, 0, 0, 1, 0, 0, 0],
+                                       [0, 0, 0, 0, 0, 1, 1]])
+
+def test_mole_fraction_projection():
+    "Mole fractions, and their derivatives, of a phase with vacancies."
+    # (AL, VA)1 (AL, NI)3
+    variables = [v.SiteFraction('TEST', 0, 'AL'),
+                 v.SiteFraction('TEST', 0, 'VA'),
+                 v.SiteFraction('TEST', 1, 'AL'),
+                 v.SiteFraction('TEST', 1, 'NI')]
+    projection = MoleFractionProjection([1, 3], variables, ['AL', 'NI'])
+    point = [0.6, 0.4, 0.2, 0.8]
+    # 3.6 moles of atoms per formula unit
+    desired = np.array([0.6 + 3 * 0.2, 3 * 0.8]) / 3.6
+    assert np.allclose(projection.values(*point), desired)
+    assert np.allclose(projection([point, point]), [desired, desired])
+    closed = projection.closed(['AL'])
+    assert np.allclose(closed.values(*point), desired / (1 - desired[0]))
+    point = list(random_site_fractions(1, len(variables))[0])
+    for proj in [projection, closed]:
+        check_derivatives(proj.values, lambda *y: proj.jacobian(*y).T,
+                          point, atol=1e-8)
+        check_derivatives(proj.jacobian,
+                          lambda *y: np.moveaxis(proj.hessian(*y), 2, 0),
+                          point, atol=1e-5)
+
+def test_binary_tie_lines():
+    "Two-phase regions and miscibility gaps on a sampled binary surface."
+    compositions = np.linspace(0, 1, 101)
+    # Two parabolic phases, the second with a miscibility gap
+    first = 1000 * (compositions - 0.2)**2
+    second = 1000 * ((compositions - 0.65)**2 - 0.04)**2 - 5
+    compositions = np.concatenate((compositions, compositions))
+    energies = np.concatenate((first, second))
+    phase_codes = np.repeat([0, 1], 101)
+    tie_lines = binary_tie_lines(compositions, energies, phase_codes)
+    assert tie_lines.shape == (2, 2)
+    tie_lines = tie_lines[np.argsort(compositions[tie_lines[:, 0]])]
+    assert np.all(compositions[tie_lines[:, 0]] < \
+        compositions[tie_lines[:, 1]])
+    assert np.all(phase_codes[tie_lines[0]] == [0, 1])
+    assert np.all(phase_codes[tie_lines[1]] == [1, 1])
+
+def test_binary_tie_lines_threshold():
+    "Miscibility gaps exactly as wide as the minimum distance are kept."
+    compositions = np.array([0.0, 0.25, 0.5])
+    energies = np.array([0.0, 1.0, 0.0])
+    phase_codes = np.zeros(3, dtype=np.int)
+    tie_lines = binary_tie_lines(compositions, energies, phase_codes,
+                                 mindist=0.5)
+    assert tie_lines.tolist() == [[0, 2]]
+
+def test_ternary_tie_simplices():
+    "Tie-lines and tie-triangles on a sampled ternary surface."
+    grid = np.linspace(0, 1, 41)
+    grid = np.array([[x, y] for x in grid for y in grid if x + y <= 1])
+    centers = [[0.1, 0.1], [0.8, 0.1], [0.1, 0.8]]
+    # Three parabolic phases centered near each corner
+    compositions = np.concatenate([grid] * 3)
+    energies = np.concatenate([1000 * np.sum((grid - center)**2, axis=1) \
+        for center in centers])
+    phase_codes = np.repeat([0, 1, 2], len(grid))
+    tie_lines, tie_triangles = \
+        ternary_tie_simplices(compositions, energies, phase_codes)
+    assert len(tie_triangles) == 1
+    assert sorted(phase_codes[tie_triangles[0]]) == [0, 1, 2]
+    assert len(tie_lines) > 0
+    assert np.all(phase_codes[tie_lines[:, 0]] != phase_codes[tie_lines[:, 1]])
+
 if __name__ == '__main__':
     import nose
     nose.run(defaultTest=__name__)
@@ -0,0 +1,57 @@
+"""
+The plot test module verifies that the phase diagram calculations behind
+the plotting functions give consistent results.
+"""
+
+import os
+import shutil
+import tempfile
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+from pycalphad import Database, binplot
+
+ALFE_DBF = Database('examples/alfe_sei.TDB')
+
+def test_binplot_processes():
+    "Tie-lines found by worker processes match those found serially."
+    my_phases = ['LIQUID', 'FCC_A1', 'AL5FE2', 'AL2FE', 'AL13FE4']
+    comps = ['AL', 'FE', 'VA']
+    segments = []
+    for processes in (None, 2):
+        # Draw without pyplot, so that no display is needed
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = binplot(ALFE_DBF, comps, my_phases, 'X(AL)', 1000, 1600,
+                     steps=4, pdens=100, processes=processes,
+                     ax=fig.add_subplot(111))
+        segments.append(np.array(ax.collections[0].get_segments()))
+    assert len(segments[0]) > 0
+    assert np.array_equal(segments[0], segments[1])
+
+def test_binplot_cache():
+    "Tie-lines found from the stored energy surface match the direct ones."
+    my_phases = ['LIQUID', 'FCC_A1', 'AL5FE2', 'AL2FE', 'AL13FE4']
+    comps = ['AL', 'FE', 'VA']
+    cache_dir = tempfile.mkdtemp()
+    try:
+        segments = []
+        for kwargs in ({}, {'cache_dir': cache_dir},
+                       {'cache_dir': cache_dir, 'processes': 2}):
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = binplot(ALFE_DBF, comps, my_phases, 'X(AL)', 1000, 1600,
+                         steps=4, pdens=100, ax=fig.add_subplot(111),
+                         **kwargs)
+            segments.append(np.array(ax.collections[0].get_segments()))
+        # The surface was stored once and read twice
+        assert len(os.listdir(cache_dir)) == 1
+    finally:
+        shutil.rmtree(cache_dir)
+    assert len(segments[0]) > 0
+    assert np.array_equal(segments[0], segments[1])
+    assert np.array_equal(segments[0], segments[2])
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,29 @@
+"""
+The utils module contains helpers shared by the test modules.
+"""
+
+import numpy as np
+
+def random_site_fractions(num_points, num_variables):
+    "Reproducible site fractions with shape (points, variables)."
+    return np.random.RandomState(0).uniform(0.01, 1,
+                                            (num_points, num_variables))
+
+def check_derivatives(function, derivative, args, indices=None, step=1e-6,
+                      rtol=1e-5, atol=1e-3):
+    """
+    Check that derivative(*args)[row] matches the central difference of
+    function(*args) with respect to args[indices[row]].
+    """
+    if indices is None:
+        indices = range(len(args))
+    actual = derivative(*args)
+    for row, idx in enumerate(indices):
+        upper = list(args)
+        upper[idx] = upper[idx] + step
+        lower = list(args)
+        lower[idx] = lower[idx] - step
+        desired = (np.asarray(function(*upper)) - \
+            np.asarray(function(*lower))) / (2 * step)
+        assert np.allclose(actual[row], desired, rtol=rtol, atol=atol), \
+            "derivative with respect to argument %d" % idx
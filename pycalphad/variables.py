@@ -92,6 +92,21 @@ class Composition(StateVariable):
         else:
             return 'x_{'+self.species+'}'
 
+class ChemicalPotential(StateVariable):
+    """
+    Chemical potentials are symbols with built-in assumptions of being real.
+    """
+    def __new__(cls, species): #pylint: disable=W0221
+        species = species.upper()
+        #pylint: disable=E1121
+        new_self = Symbol.__new__(cls, 'MU_' + species, real=True)
+        new_self.species = species
+        return new_self
+    def _latex(self):
+        "LaTeX representation."
+        #pylint: disable=E1101
+        return '\\mu_{'+self.species+'}'
+
 temperature = T = StateVariable('T')
 entropy = S = StateVariable('S')
 pressure = P = StateVariable('P')
@@ -99,4 +114,5 @@ volume = V = StateVariable('V')
 moles = N = StateVariable('N')
 site_fraction = Y = SiteFraction
 X = Composition
+MU = ChemicalPotential
 si_gas_constant = R = Float(8.3145) # ideal gas constant